@@ -0,0 +1,9 @@
+import os
+from a2wsgi import WSGIMiddleware
+from main import app
+
+# Punto de entrada ASGI: uvicorn asgi:application --workers 2
+# Cada solicitud corre en uno de ASGI_THREADS hilos; las vistas async (flask[async])
+# esperan sus lecturas de Firestore en paralelo sobre el AsyncClient compartido
+# (utils.firestore_async), así que un hilo no queda bloqueado por cada RPC.
+application = WSGIMiddleware(app, workers=int(os.getenv('ASGI_THREADS', 32)))
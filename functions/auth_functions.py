@@ -3,6 +3,7 @@ from utils.firebase import db
 from utils.exceptions import ValidationError, NotFoundError, ForbiddenError
 from firebase_admin.exceptions import FirebaseError
 from models.User import User
+from utils.text import normalize
 
 def register_user(data):
     """Register a new user"""
@@ -29,8 +30,11 @@ def register_user(data):
             "uid": user_record.uid,
             "email": email,
             "username": username,
+            "usernameLower": normalize(username),
             "role": "user",
             "isBanned": False,
+            "challengeWins": 0,
+            "totalEarnings": 0,
             "createdAt": firestore.SERVER_TIMESTAMP,
             "updatedAt": firestore.SERVER_TIMESTAMP
         }
@@ -13,6 +13,13 @@ load_dotenv()
 
 app = Flask(__name__)
 
+# request.remote_addr toma la IP de X-Forwarded-For solo a través de los proxies de
+# confianza (Vercel agrega uno); con TRUSTED_PROXY_HOPS=0 se usa la IP de la conexión
+from werkzeug.middleware.proxy_fix import ProxyFix
+trusted_proxy_hops = int(os.getenv('TRUSTED_PROXY_HOPS', 1))
+if trusted_proxy_hops:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=trusted_proxy_hops)
+
 # Configuración mejorada de CORS
 allowed_origins = [
     "http://localhost:4200",
@@ -31,14 +38,28 @@ CORS(
     resources={
         r"/*": {
             "origins": allowed_origins,
-            "allow_headers": ["Content-Type", "Authorization"],
+            "allow_headers": ["Content-Type", "Authorization", "X-Profile"],
             "methods": ["GET", "POST", "PUT", "DELETE", "OPTIONS"],
             "supports_credentials": True,
-            "expose_headers": ["Content-Disposition"]  # Necesario para algunas respuestas
+            "expose_headers": ["Content-Disposition", "X-Next-Cursor", "Retry-After", "X-Profile-Id"]  # Necesario para algunas respuestas
         }
     }
 )
 
+# Compresión gzip/brotli de respuestas grandes (COMPRESSION_MIN_SIZE, por defecto 1 KB).
+# Se registra antes que el hook de CORS, así que Flask la ejecuta después: los headers
+# de CORS no cambian el cuerpo y los streams (SSE) se dejan sin comprimir.
+from utils.compression import init_compression
+from utils.metrics import init_metrics
+# Métricas en formato Prometheus en /metrics. Su after_request se registra primero
+# para ejecutarse al final y así incluir en la latencia el tiempo de compresión.
+init_metrics(app)
+init_compression(app)
+
+# Perfilado por solicitud para admins ('X-Profile: 1'); solo se activa con PROFILING_DIR
+from utils.profiling import init_profiling
+init_profiling(app)
+
 # Middleware para manejar OPTIONS (preflight)
 @app.after_request
 def after_request(response):
@@ -46,13 +67,17 @@ def after_request(response):
     origin = request.headers.get('Origin', '')
     if origin in allowed_origins:
         response.headers.add('Access-Control-Allow-Origin', origin)
-    response.headers.add('Access-Control-Allow-Headers', 'Content-Type,Authorization')
+    response.headers.add('Access-Control-Allow-Headers', 'Content-Type,Authorization,X-Profile')
     response.headers.add('Access-Control-Allow-Methods', 'GET,PUT,POST,DELETE,OPTIONS')
     response.headers.add('Access-Control-Allow-Credentials', 'true')
     return response
 
 from utils.firebase import initialize_firebase
 firebase_app, db = initialize_firebase()
+
+# Conteo y latencia de cada RPC de Firestore
+from utils.firestore_instrumentation import instrument_firestore
+instrument_firestore(db)
 #from utils.firebase import get_firebase
 #firebase_app, db = get_firebase()
     
@@ -63,6 +88,21 @@ app.register_blueprint(challenge_bp, url_prefix='/challenges')
 app.register_blueprint(participation_bp, url_prefix='/participations')
 app.register_blueprint(notification_bp, url_prefix='/notifications')
 
+# Scheduler de estados de retos (hilo de fondo). En entornos serverless se deja
+# desactivado y se usa POST /admin/challenges/run-scheduler desde un cron.
+from services.challenge_scheduler import challenge_scheduler
+# Declarar el ganador al cerrar (por puntajes reportados) es opcional; por defecto lo
+# hace un admin con declare-winner o POST /admin/challenges/<id>/compute-results
+from services.results_engine import close_challenge
+if os.getenv('AUTO_DECLARE_WINNERS', 'false').lower() == 'true':
+    challenge_scheduler.register_close_handler(close_challenge)
+if os.getenv('ENABLE_CHALLENGE_SCHEDULER', 'false').lower() == 'true':
+    challenge_scheduler.start()
+
+# Índice de búsqueda de retos en memoria, construido en segundo plano al arrancar
+from services.challenge_search import challenge_index
+challenge_index.start_background_load()
+
 # Error handler
 from utils.exceptions import handle_error, ByteBattleError
 
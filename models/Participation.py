@@ -27,4 +27,9 @@ class Participation:
             "paymentStatus": self.payment_status,
             "createdAt": self.created_at,
             "paymentConfirmationDate": self.payment_confirmation_date
-        }
\ No newline at end of file
+        }
+
+    @staticmethod
+    def document_id(challenge_id, user_id):
+        """ID determinista: como máximo una participación por usuario y reto"""
+        return f"{challenge_id}_{user_id}"
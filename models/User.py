@@ -1,5 +1,6 @@
 from datetime import datetime
 from firebase_admin import firestore
+from utils.text import normalize
 
 class User:
     def __init__(self, uid, email, username, role="user", is_banned=False, aceptaelreto_username=None,
@@ -31,6 +32,7 @@ class User:
             "uid": self.uid,
             "email": self.email,
             "username": self.username,
+            "usernameLower": normalize(self.username),
             "role": self.role,
             "isBanned": self.is_banned,
             "aceptaelretoUsername": self.aceptaelreto_username,
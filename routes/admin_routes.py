@@ -1,10 +1,25 @@
 # admin_routes.py
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, Response, request, jsonify, stream_with_context, send_from_directory
 from firebase_admin import firestore
 from datetime import datetime
+import os
 from utils.firebase import db
-from utils.decorators import admin_required
-from utils.exceptions import handle_error
+from utils.decorators import admin_required, max_query_documents
+from utils.exceptions import handle_error, NotFoundError
+from utils.profiling import get_profiling_dir
+from services.notification_retention import run_retention
+from services.participation_migration import migrate_participation_ids
+from services.challenge_scheduler import challenge_scheduler
+from services.challenge_search import challenge_index
+from services.results_engine import compute_challenge_results, DEFAULT_TOP_K
+from services.submission_storage import migrate_inline_code
+from services.admin_bulk_service import bulk_confirm_payments, bulk_ban_users, bulk_set_roles
+from services.user_import_service import import_users, parse_ndjson, export_users
+from services.admin_stats_service import get_admin_stats
+from services.user_search import search_users_by_username, backfill_username_lower, MAX_RESULTS
+from services.user_ranking import backfill_ranking_fields
+from services.index_advisor import advise_indexes
+from utils.query_shapes import shape_registry
 
 admin_bp = Blueprint('admin', __name__)
 
@@ -131,6 +146,8 @@ def challenges_route():
             }
             
             _, doc_ref = db.collection('challenges').add(challenge_data)
+            challenge_scheduler.schedule(doc_ref.id, challenge_data)
+            challenge_index.index(doc_ref.id, challenge_data)
             
             return jsonify({
                 "success": True,
@@ -162,6 +179,8 @@ def update_challenge_route(challenge_id):
             'status': data.get('status', 'próximo'),
             'updatedAt': datetime.utcnow()
         })
+        challenge_scheduler.schedule(challenge_id)
+        challenge_index.index(challenge_id)
         
         return jsonify({
             "success": True,
@@ -184,6 +203,8 @@ def update_challenge_status_route(challenge_id):
             'status': new_status,
             'updatedAt': datetime.utcnow()
         })
+        challenge_scheduler.schedule(challenge_id)
+        challenge_index.index(challenge_id)
         
         return jsonify({
             "success": True,
@@ -303,4 +324,279 @@ def mark_as_paid_route():
             "message": "Reto marcado como pagado correctamente"
         }), 200
     except Exception as e:
-        return handle_error(e)
\ No newline at end of file
+        return handle_error(e)
+
+@admin_bp.route('/maintenance/notifications/retention', methods=['POST'])
+@admin_required
+def run_notification_retention_route():
+    try:
+        data = request.get_json(silent=True) or {}
+        
+        # Ejecución acotada; si no termina, basta con volver a llamarla
+        result = run_retention(
+            max_deletes=int(data.get('maxDeletes', 5000)),
+            max_writes_per_second=int(data.get('maxWritesPerSecond', 500)),
+            compact=bool(data.get('compact', False)),
+            compact_after_days=int(data.get('compactAfterDays', 14))
+        )
+        
+        return jsonify({
+            "success": True,
+            **result
+        }), 200
+    except Exception as e:
+        return handle_error(e)
+
+@admin_bp.route('/maintenance/participations/migrate-ids', methods=['POST'])
+@admin_required
+@max_query_documents(None)
+def migrate_participation_ids_route():
+    try:
+        data = request.get_json(silent=True) or {}
+        
+        # Con dryRun solo se reporta lo que se migraría
+        result = migrate_participation_ids(dry_run=bool(data.get('dryRun', False)))
+        
+        return jsonify({
+            "success": True,
+            **result
+        }), 200
+    except Exception as e:
+        return handle_error(e)
+
+@admin_bp.route('/challenges/run-scheduler', methods=['POST'])
+@admin_required
+def run_challenge_scheduler_route():
+    try:
+        # Aplica ahora las transiciones de estado vencidas (útil desde un cron)
+        transitions = challenge_scheduler.run_once()
+        
+        return jsonify({
+            "success": True,
+            "transitions": [
+                {"challengeId": challenge_id, "status": status}
+                for challenge_id, status in transitions
+            ]
+        }), 200
+    except Exception as e:
+        return handle_error(e)
+
+@admin_bp.route('/challenges/<challenge_id>/compute-results', methods=['POST'])
+@admin_required
+def compute_challenge_results_route(challenge_id):
+    try:
+        data = request.get_json(silent=True) or {}
+        
+        result = compute_challenge_results(
+            challenge_id,
+            top_k=int(data.get('topK', DEFAULT_TOP_K)),
+            force=bool(data.get('force', False))
+        )
+        if 'error' in result:
+            return jsonify({"success": False, "message": result['error']}), 400
+        
+        return jsonify({
+            "success": True,
+            **result
+        }), 200
+    except Exception as e:
+        return handle_error(e)
+
+@admin_bp.route('/maintenance/participations/migrate-code', methods=['POST'])
+@admin_required
+def migrate_inline_code_route():
+    try:
+        data = request.get_json(silent=True) or {}
+        
+        # Reanudable: repetir hasta que migrated sea 0
+        result = migrate_inline_code(max_participations=int(data.get('maxParticipations', 5000)))
+        
+        return jsonify({
+            "success": True,
+            **result
+        }), 200
+    except Exception as e:
+        return handle_error(e)
+
+@admin_bp.route('/bulk/confirm-payments', methods=['POST'])
+@admin_required
+def bulk_confirm_payments_route():
+    try:
+        data = request.get_json(silent=True) or {}
+        
+        result = bulk_confirm_payments(data.get('participationIds'))
+        
+        return jsonify({
+            "success": True,
+            **result
+        }), 200
+    except Exception as e:
+        return handle_error(e)
+
+@admin_bp.route('/bulk/ban-users', methods=['POST'])
+@admin_required
+def bulk_ban_users_route():
+    try:
+        data = request.get_json(silent=True) or {}
+        
+        result = bulk_ban_users(data.get('uids'), is_banned=bool(data.get('isBanned', True)))
+        
+        return jsonify({
+            "success": True,
+            **result
+        }), 200
+    except Exception as e:
+        return handle_error(e)
+
+@admin_bp.route('/bulk/set-roles', methods=['POST'])
+@admin_required
+def bulk_set_roles_route():
+    try:
+        data = request.get_json(silent=True) or {}
+        
+        result = bulk_set_roles(data.get('uids'), data.get('role', 'user'))
+        
+        return jsonify({
+            "success": True,
+            **result
+        }), 200
+    except Exception as e:
+        return handle_error(e)
+
+@admin_bp.route('/users/import', methods=['POST'])
+@admin_required
+def import_users_route():
+    try:
+        # Acepta {"users": [...]} o un cuerpo NDJSON (una cuenta por línea, como el export)
+        if request.mimetype == 'application/x-ndjson':
+            records = parse_ndjson(request.get_data(as_text=True))
+            default_role = request.args.get('defaultRole', 'user')
+        else:
+            data = request.get_json(silent=True) or {}
+            records = data.get('users')
+            default_role = data.get('defaultRole', 'user')
+        
+        result = import_users(records, default_role=default_role)
+        
+        return jsonify({
+            "success": True,
+            **result
+        }), 200
+    except Exception as e:
+        return handle_error(e)
+
+@admin_bp.route('/users/export', methods=['GET'])
+@admin_required
+def export_users_route():
+    try:
+        filename = f"users-{datetime.utcnow().strftime('%Y%m%d%H%M%S')}.ndjson"
+        return Response(
+            stream_with_context(export_users()),
+            mimetype='application/x-ndjson',
+            headers={'Content-Disposition': f'attachment; filename={filename}'}
+        )
+    except Exception as e:
+        return handle_error(e)
+
+@admin_bp.route('/stats', methods=['GET'])
+@admin_required
+def get_admin_stats_route():
+    try:
+        stats, cached = get_admin_stats(refresh=request.args.get('refresh', 'false').lower() == 'true')
+        
+        return jsonify({
+            "success": True,
+            "cached": cached,
+            **stats
+        }), 200
+    except Exception as e:
+        return handle_error(e)
+
+@admin_bp.route('/users/search', methods=['GET'])
+@admin_required
+def search_users_route():
+    try:
+        limit = min(max(int(request.args.get('limit', 10)), 1), MAX_RESULTS)
+        
+        # Rango sobre usernameLower: no recorre la colección
+        users = search_users_by_username(request.args.get('q', ''), limit)
+        
+        return jsonify({
+            "success": True,
+            "users": users
+        }), 200
+    except Exception as e:
+        return handle_error(e)
+
+@admin_bp.route('/maintenance/users/backfill-username-lower', methods=['POST'])
+@admin_required
+@max_query_documents(None)
+def backfill_username_lower_route():
+    try:
+        result = backfill_username_lower()
+        
+        return jsonify({
+            "success": True,
+            **result
+        }), 200
+    except Exception as e:
+        return handle_error(e)
+
+@admin_bp.route('/maintenance/users/backfill-ranking-fields', methods=['POST'])
+@admin_required
+@max_query_documents(None)
+def backfill_ranking_fields_route():
+    try:
+        result = backfill_ranking_fields()
+        
+        return jsonify({
+            "success": True,
+            **result
+        }), 200
+    except Exception as e:
+        return handle_error(e)
+
+@admin_bp.route('/profiles/<profile_id>', methods=['GET'])
+@admin_required
+def get_profile_route(profile_id):
+    try:
+        directory = get_profiling_dir()
+        if not directory:
+            raise NotFoundError("El perfilado no está habilitado (PROFILING_DIR)")
+        
+        # ?format=pstats descarga el binario; por defecto el resumen de texto
+        extension = 'pstats' if request.args.get('format') == 'pstats' else 'txt'
+        filename = f"{profile_id}.{extension}"
+        if not os.path.isfile(os.path.join(directory, filename)):
+            raise NotFoundError("Perfil no encontrado")
+        
+        return send_from_directory(os.path.abspath(directory), filename, as_attachment=extension == 'pstats')
+    except Exception as e:
+        return handle_error(e)
+
+@admin_bp.route('/diagnostics/firestore', methods=['GET'])
+@admin_required
+def firestore_diagnostics_route():
+    try:
+        # Datos de este proceso: formas de consulta vistas, operaciones lentas e índices faltantes
+        advice = advise_indexes()
+        
+        return jsonify({
+            "success": True,
+            "queries": shape_registry.shapes(),
+            "slowOperations": shape_registry.slow_operations(),
+            "missingIndexes": advice['missing']
+        }), 200
+    except Exception as e:
+        return handle_error(e)
+
+@admin_bp.route('/diagnostics/firestore/indexes', methods=['GET'])
+@admin_required
+def firestore_indexes_route():
+    try:
+        # firestore.indexes.json actual más los índices de las consultas observadas
+        response = jsonify(advise_indexes()['indexesFile'])
+        response.headers['Content-Disposition'] = 'attachment; filename=firestore.indexes.json'
+        return response, 200
+    except Exception as e:
+        return handle_error(e)
@@ -1,9 +1,14 @@
 from flask import Blueprint, redirect, request, jsonify
 from utils.exceptions import handle_error
 from utils.decorators import firebase_token_required, admin_required
+from utils.rate_limit import rate_limit
+from utils.metrics import time_external
 from firebase_admin import auth, firestore
 from utils.firebase import get_db
 from functions.auth_functions import register_user  # Importar función de registro
+from services.user_ranking import RANKING_FIELDS, get_ranking_page, get_user_rank
+from services.user_search import username_index, MAX_RESULTS
+from utils.text import normalize
 import re
 from datetime import datetime
 from firebase_admin.exceptions import FirebaseError
@@ -18,6 +23,8 @@ auth_bp = Blueprint('auth', __name__)
 db = get_db()
 
 @auth_bp.route('/register', methods=['POST'])
+@rate_limit("5/minute")
+@rate_limit("20/hour")
 def register_user_route():
     try:
         data = request.get_json()
@@ -63,6 +70,7 @@ def register_user_route():
             "uid": user_record.uid,
             "email": email,
             "username": username,
+            "usernameLower": normalize(username),
             "role": "user",
             "isBanned": False,
             "description": "",
@@ -81,6 +89,7 @@ def register_user_route():
         }
 
         db.collection('users').document(user_record.uid).set(user_data)
+        username_index.upsert(user_record.uid, username)
 
         return jsonify({
             "success": True,
@@ -115,6 +124,8 @@ def register_user_route():
         }), 500
 
 @auth_bp.route('/login', methods=['POST'])
+@rate_limit("10/minute")
+@rate_limit("100/hour")
 def login_user_route():
     try:
         data = request.get_json()
@@ -134,11 +145,12 @@ def login_user_route():
             }), 500
             
         auth_url = f'https://identitytoolkit.googleapis.com/v1/accounts:signInWithPassword?key={firebase_key}'
-        auth_response = requests.post(auth_url, json={
-            'email': email,
-            'password': password,
-            'returnSecureToken': True
-        })
+        with time_external('identity_toolkit'):
+            auth_response = requests.post(auth_url, json={
+                'email': email,
+                'password': password,
+                'returnSecureToken': True
+            })
      
         if auth_response.status_code != 200:
             error_data = auth_response.json()
@@ -272,9 +284,16 @@ def update_user_profile(user_id):
             if field in data:
                 update_data[field] = data[field]
         
+        # Mantener el campo normalizado para la búsqueda por prefijo
+        if "username" in update_data:
+            update_data["usernameLower"] = normalize(update_data["username"])
+        
         # Actualizar el documento
         db.collection('users').document(user_id).update(update_data)
         
+        if "username" in update_data:
+            username_index.upsert(user_id, update_data["username"])
+        
         return jsonify({"message": "Perfil actualizado exitosamente"}), 200
         
     except Exception as e:
@@ -301,11 +320,12 @@ def change_password(user_id):
         email = user.email
         
         # Verificar credenciales actuales
-        auth_response = requests.post(auth_url, json={
-            'email': email,
-            'password': data['currentPassword'],
-            'returnSecureToken': True
-        })
+        with time_external('identity_toolkit'):
+            auth_response = requests.post(auth_url, json={
+                'email': email,
+                'password': data['currentPassword'],
+                'returnSecureToken': True
+            })
         
         if auth_response.status_code != 200:
             return jsonify({"error": "La contraseña actual es incorrecta"}), 401
@@ -346,6 +366,84 @@ def get_total_users():
             "details": str(e)
         }), 500
 
+@auth_bp.route('/users/autocomplete', methods=['GET'])
+@firebase_token_required
+def autocomplete_usernames():
+    try:
+        prefix = request.args.get('q', '')
+        if not normalize(prefix):
+            return jsonify({"success": True, "users": []}), 200
+        limit = min(max(int(request.args.get('limit', 10)), 1), MAX_RESULTS)
+        
+        # Trie en memoria: no consulta Firestore salvo en la carga inicial
+        return jsonify({
+            "success": True,
+            "users": username_index.search(prefix, limit)
+        }), 200
+    except ValueError:
+        return jsonify({"success": False, "message": "Parámetro limit inválido"}), 400
+    except Exception as e:
+        print(f"Error en autocompletado de usuarios: {str(e)}")
+        return jsonify({
+            "success": False,
+            "message": "Error al buscar usuarios",
+            "details": str(e)
+        }), 500
+
+@auth_bp.route('/ranking', methods=['GET'])
+def get_global_ranking():
+    try:
+        by = request.args.get('by', 'wins')
+        if by not in RANKING_FIELDS:
+            return jsonify({"success": False, "message": "Criterio de ranking inválido (wins o earnings)"}), 400
+        limit = min(max(int(request.args.get('limit', 20)), 1), 100)
+        
+        # El cursor es el ID del último usuario de la página anterior
+        ranking, next_cursor = get_ranking_page(by, limit, request.args.get('cursor'))
+        if ranking is None:
+            return jsonify({"success": False, "message": "Cursor inválido"}), 400
+        
+        return jsonify({
+            "success": True,
+            "by": by,
+            "ranking": ranking,
+            "nextCursor": next_cursor
+        }), 200
+    except ValueError:
+        return jsonify({"success": False, "message": "Parámetro limit inválido"}), 400
+    except Exception as e:
+        print(f"Error al obtener el ranking: {str(e)}")
+        return jsonify({
+            "success": False,
+            "message": "Error al obtener el ranking",
+            "details": str(e)
+        }), 500
+
+@auth_bp.route('/ranking/me', methods=['GET'])
+@firebase_token_required
+def get_my_ranking():
+    try:
+        by = request.args.get('by', 'wins')
+        if by not in RANKING_FIELDS:
+            return jsonify({"success": False, "message": "Criterio de ranking inválido (wins o earnings)"}), 400
+        
+        result = get_user_rank(by, request.user['uid'])
+        if result is None:
+            return jsonify({"success": False, "message": "Usuario no encontrado"}), 404
+        
+        return jsonify({
+            "success": True,
+            "by": by,
+            **result
+        }), 200
+    except Exception as e:
+        print(f"Error al obtener el puesto del usuario: {str(e)}")
+        return jsonify({
+            "success": False,
+            "message": "Error al obtener el puesto del usuario",
+            "details": str(e)
+        }), 500
+
 def send_email(to_email, subject, body):
     smtp_server = os.getenv('SMTP_SERVER', 'smtp.gmail.com')
     smtp_port = int(os.getenv('SMTP_PORT', 587))
@@ -359,11 +457,12 @@ def send_email(to_email, subject, body):
     msg.attach(MIMEText(body, 'html'))
 
     try:
-        server = smtplib.SMTP(smtp_server, smtp_port)
-        server.starttls()
-        server.login(smtp_user, smtp_password)
-        server.send_message(msg)
-        server.quit()
+        with time_external('smtp'):
+            server = smtplib.SMTP(smtp_server, smtp_port)
+            server.starttls()
+            server.login(smtp_user, smtp_password)
+            server.send_message(msg)
+            server.quit()
         return True
     except Exception as e:
         print(f"Error sending email: {str(e)}")
@@ -493,6 +592,7 @@ def get_public_profile(user_id):
 # En auth_routes.py
 @auth_bp.route('/<user_id>/increment-views', methods=['PUT'])
 @firebase_token_required
+@rate_limit("30/minute", key='uid')
 def increment_profile_views(user_id):
     try:
         # Verificar que el usuario que incrementa no es el mismo
@@ -602,6 +702,8 @@ def handle_email_verification():
         return jsonify({"error": str(e)}), 500
 
 @auth_bp.route('/send-password-reset-email', methods=['POST'])
+@rate_limit("3/minute")
+@rate_limit("10/hour")
 def send_password_reset_email():
     try:
         email = request.json.get('email', '').strip().lower()
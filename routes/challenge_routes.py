@@ -1,12 +1,26 @@
 from flask import Blueprint, request, jsonify
 from models.Challenge import Challenge
+from models.Participation import Participation
 from utils.firebase import db
-from utils.decorators import firebase_token_required, admin_required
+from utils.decorators import firebase_token_required, admin_required, stream_token_required, max_query_documents
+from utils.exceptions import ByteBattleError
 from datetime import datetime
 from firebase_admin import firestore
-from services.notification_service import send_notification
+from services.notification_service import send_notifications_async
+from services.participation_migration import find_legacy_participation_async
+from services.leaderboard_stream import leaderboard_hub, STREAM_ENDED
+from services.challenge_scheduler import challenge_scheduler
+from services.challenge_search import challenge_index, MAX_RESULTS
+from utils.concurrency import get_documents
+from utils.firestore_async import get_async_db, get_documents_async, query_async, run_async
+from utils.sse import format_sse, heartbeat, sse_response, HEARTBEAT_SECONDS, MAX_STREAM_SECONDS, RETRY_MILLISECONDS, RECONNECT
+import asyncio
+import queue
+import time
 
 challenge_bp = Blueprint('challenges', __name__)
+# Máximo de participaciones que set_winner lee para notificar el resultado
+MAX_NOTIFIED_PARTICIPANTS = 10000
 
 @challenge_bp.route('', methods=['POST'])
 @firebase_token_required
@@ -32,6 +46,8 @@ def create_challenge():
         challenge.total_pot = 0
         
         _, doc_ref = db.collection('challenges').add(challenge.to_dict())
+        challenge_scheduler.schedule(doc_ref.id, challenge.to_dict())
+        challenge_index.index(doc_ref.id, challenge.to_dict())
         
         return jsonify({
             "message": "Reto creado exitosamente",
@@ -61,6 +77,8 @@ def update_challenge(challenge_id):
         
         # Actualizar solo campos proporcionados
         challenge_ref.update({k: v for k, v in updates.items() if v is not None})
+        challenge_scheduler.schedule(challenge_id)
+        challenge_index.index(challenge_id)
         
         return jsonify({"message": "Reto actualizado exitosamente"}), 200
     except Exception as e:
@@ -85,6 +103,33 @@ def get_challenges():
     except Exception as e:
         return jsonify({"error": f"Error al obtener retos: {str(e)}"}), 500
     
+@challenge_bp.route('/search', methods=['GET'])
+def search_challenges():
+    try:
+        query = request.args.get('q', '').strip()
+        if not query:
+            return jsonify([]), 200
+        limit = min(max(int(request.args.get('limit', 20)), 1), MAX_RESULTS)
+        
+        # Índice invertido en memoria; solo se leen de Firestore los retos encontrados
+        hits = challenge_index.search(query, limit, status=request.args.get('status'))
+        snapshots = get_documents(db, [db.collection('challenges').document(challenge_id) for challenge_id, _ in hits])
+        
+        challenges = []
+        for (challenge_id, score), doc in zip(hits, snapshots):
+            if not doc.exists:
+                continue
+            challenge_data = doc.to_dict()
+            challenge_data['id'] = challenge_id
+            challenge_data['score'] = round(score, 4)
+            challenges.append(challenge_data)
+            
+        return jsonify(challenges), 200
+    except ValueError:
+        return jsonify({"error": "Parámetro limit inválido"}), 400
+    except Exception as e:
+        return jsonify({"error": f"Error al buscar retos: {str(e)}"}), 500
+    
 @challenge_bp.route('/<challenge_id>', methods=['GET'])
 def get_challenge(challenge_id):
     try:
@@ -108,6 +153,8 @@ def update_challenge_status(challenge_id):
         db.collection('challenges').document(challenge_id).update({
             "status": new_status
         })
+        challenge_scheduler.schedule(challenge_id)
+        challenge_index.index(challenge_id)
         
         return jsonify({"message": "Estado actualizado exitosamente"}), 200
     except Exception as e:
@@ -115,9 +162,10 @@ def update_challenge_status(challenge_id):
 
 @challenge_bp.route('/<challenge_id>/winner', methods=['PUT'])
 @firebase_token_required
-def set_winner(challenge_id):
+@max_query_documents(MAX_NOTIFIED_PARTICIPANTS)
+async def set_winner(challenge_id):
     try:
-        db = firestore.client()
+        async_db = get_async_db()
         data = request.get_json()
         winner_id = data.get('winnerId')
         score = data.get('score')
@@ -125,10 +173,14 @@ def set_winner(challenge_id):
         if not winner_id or not score:
             return jsonify({"error": "Se requieren winnerId y score"}), 400
 
-        challenge_ref = db.collection('challenges').document(challenge_id)
-        user_ref = db.collection('users').document(winner_id)
+        challenge_ref = async_db.collection('challenges').document(challenge_id)
+        user_ref = async_db.collection('users').document(winner_id)
+        
+        participation_ref = async_db.collection('participations').document(Participation.document_id(challenge_id, winner_id))
+        
+        # Reto, participación y usuario ganador se leen juntos en un solo RPC
+        challenge, participation, user = await get_documents_async([challenge_ref, participation_ref, user_ref])
         
-        challenge = challenge_ref.get()
         if not challenge.exists:
             return jsonify({"error": "Reto no encontrado"}), 404
             
@@ -137,17 +189,13 @@ def set_winner(challenge_id):
         if challenge_data.get('winnerUserId'):
             return jsonify({"error": "Este reto ya tiene un ganador"}), 400
             
-        participations = db.collection('participations') \
-            .where('challengeId', '==', challenge_id) \
-            .where('userId', '==', winner_id) \
-            .limit(1) \
-            .stream()
+        if not participation.exists:
+            # Participación con ID aleatorio todavía sin migrar
+            participation = await find_legacy_participation_async(async_db, challenge_id, winner_id)
+            if participation is None:
+                return jsonify({"error": "Participación no encontrada"}), 404
             
-        participation = next(participations, None)
-        if not participation:
-            return jsonify({"error": "Participación no encontrada"}), 404
-            
-        batch = db.batch()
+        batch = async_db.batch()
         
         # 1. Marcar ganador en el reto
         batch.update(challenge_ref, {
@@ -172,36 +220,40 @@ def set_winner(challenge_id):
             'updatedAt': firestore.SERVER_TIMESTAMP
         })
         
-        batch.commit()
+        await run_async(batch.commit())
         
-        # Obtener datos para notificación
-        user = user_ref.get().to_dict()
-        winner_username = user.get('username', 'un participante')
+        # Obtener datos para notificación (leídos antes del batch; el username no cambia)
+        user_data = user.to_dict() if user.exists else {}
+        winner_username = user_data.get('username', 'un participante')
         challenge_title = challenge_data.get('title', 'un reto')
         
         # Notificar al ganador
-        send_notification(
-            user_id=winner_id,
-            title="¡Has ganado un reto!",
-            message=f"Felicidades, has ganado el reto '{challenge_title}' con un premio de ${total_pot}",
-            notification_type="challenge_win"
-        )
+        notifications = [(
+            winner_id,
+            "¡Has ganado un reto!",
+            f"Felicidades, has ganado el reto '{challenge_title}' con un premio de ${total_pot}",
+            "challenge_win"
+        )]
         
         # Notificar a todos los participantes que no ganaron
         if challenge_data.get('status') == 'activo':
             # Solo si el reto estaba activo (para evitar notificaciones duplicadas)
-            participants = db.collection('participations') \
-                .where('challengeId', '==', challenge_id) \
-                .where('userId', '!=', winner_id) \
-                .stream()
+            participants = await query_async(
+                async_db.collection('participations')
+                .where('challengeId', '==', challenge_id)
+                .where('userId', '!=', winner_id)
+            )
             
             for part in participants:
-                send_notification(
-                    user_id=part.to_dict().get('userId'),
-                    title="Resultado del reto",
-                    message=f"El reto '{challenge_title}' ha finalizado. El ganador fue {winner_username}",
-                    notification_type="challenge_result"
-                )
+                notifications.append((
+                    part.to_dict().get('userId'),
+                    "Resultado del reto",
+                    f"El reto '{challenge_title}' ha finalizado. El ganador fue {winner_username}",
+                    "challenge_result"
+                ))
+        
+        # Todas las notificaciones se escriben en batches confirmados a la vez
+        await send_notifications_async(notifications)
         
         return jsonify({
             "success": True,
@@ -212,6 +264,9 @@ def set_winner(challenge_id):
             "isPaid": True
         }), 200
         
+    except ByteBattleError:
+        # QueryTooLargeError y demás errores propios los responde el manejador de la app
+        raise
     except Exception as e:
         print(f"Error al establecer ganador: {str(e)}")
         return jsonify({
@@ -259,27 +314,29 @@ def mark_challenge_as_paid(challenge_id):
         }), 500
     
 @challenge_bp.route('/<challenge_id>/participations', methods=['GET'])
-def get_challenge_participations(challenge_id):
+async def get_challenge_participations(challenge_id):
     try:
+        async_db = get_async_db()
+        
+        # El reto y sus participaciones se leen a la vez
+        (challenge,), participation_docs = await asyncio.gather(
+            get_documents_async([async_db.collection('challenges').document(challenge_id)]),
+            query_async(async_db.collection('participations').where('challengeId', '==', challenge_id))
+        )
+        
         # Verificar que el reto existe
-        challenge_ref = db.collection('challenges').document(challenge_id)
-        if not challenge_ref.get().exists:
+        if not challenge.exists:
             return jsonify({"error": "Reto no encontrado"}), 404
 
-        # Obtener TODAS las participaciones del reto
-        participations_ref = db.collection('participations').where('challengeId', '==', challenge_id)
-        participations = []
-        
-        for doc in participations_ref.stream():
-            part_data = doc.to_dict()
-            part_data['id'] = doc.id
-            
-            # Obtener datos del usuario
-            user_ref = db.collection('users').document(part_data['userId']).get()
-            if user_ref.exists:
-                part_data['user'] = user_ref.to_dict()
-            
-            participations.append(part_data)
+        # Datos de todos los usuarios en un solo get_all
+        participations = [dict(doc.to_dict(), id=doc.id) for doc in participation_docs]
+        users = await get_documents_async([
+            async_db.collection('users').document(part_data['userId']) for part_data in participations
+        ])
+        
+        for part_data, user in zip(participations, users):
+            if user.exists:
+                part_data['user'] = user.to_dict()
             
         # Ordenar por puntaje descendente (los nulls van al final)
         participations.sort(key=lambda x: (-x.get('score', float('-inf')) if x.get('score') is not None else float('inf')))
@@ -288,6 +345,97 @@ def get_challenge_participations(challenge_id):
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+@challenge_bp.route('/<challenge_id>/leaderboard', methods=['GET'])
+async def get_leaderboard(challenge_id):
+    try:
+        async_db = get_async_db()
+        
+        # Obtener todas las participaciones pagadas con puntaje
+        participations = await query_async(
+            async_db.collection('participations')
+            .where('challengeId', '==', challenge_id)
+            .where('isPaid', '==', True)
+            .where('score', '>', 0)
+            .order_by('score', direction=firestore.Query.DESCENDING)
+        )
+        leaderboard = []
+        for doc in participations:
+            participation = doc.to_dict()
+            # Ruta pública: el código del envío no se expone
+            participation.pop('code', None)
+            participation.pop('codeRef', None)
+            participation['id'] = doc.id
+            leaderboard.append(participation)
+        
+        # Información de los usuarios en un solo get_all
+        users = await get_documents_async([
+            async_db.collection('users').document(participation['userId']) for participation in leaderboard
+        ])
+        
+        # Misma forma que functions/participation_functions.get_leaderboard, sin el email
+        for participation, user in zip(leaderboard, users):
+            if user.exists:
+                user_data = user.to_dict()
+                participation['user'] = {
+                    'name': user_data.get('name'),
+                    'aceptaelretoUsername': user_data.get('aceptaelretoUsername')
+                }
+            
+        return jsonify(leaderboard), 200
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@challenge_bp.route('/<challenge_id>/leaderboard/stream', methods=['GET'])
+@stream_token_required
+def stream_leaderboard(challenge_id):
+    try:
+        challenge = db.collection('challenges').document(challenge_id).get()
+        if not challenge.exists:
+            return jsonify({"error": "Reto no encontrado"}), 404
+        if challenge.to_dict().get('status') != 'activo':
+            return jsonify({"error": "El ranking en vivo solo está disponible para retos activos"}), 400
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+    # Todos los espectadores del reto comparten un único listener en este worker
+    ranking, subscription = leaderboard_hub.subscribe(challenge_id)
+
+    def generate():
+        try:
+            yield f"retry: {RETRY_MILLISECONDS}\n\n"
+            if not ranking.wait_ready(HEARTBEAT_SECONDS):
+                yield format_sse({}, event='reconnect')
+                return
+
+            # Primero el ranking completo, después solo los cambios de puesto
+            version, rows = ranking.snapshot()
+            yield format_sse({"version": version, "ranking": rows}, event='ranking', event_id=str(version))
+
+            deadline = time.monotonic() + MAX_STREAM_SECONDS
+            while time.monotonic() < deadline:
+                # El reto dejó de estar activo: fin del stream, sin pedir reconexión
+                if ranking.ended_status is not None:
+                    yield format_sse({"status": ranking.ended_status}, event='end')
+                    return
+                try:
+                    delta = subscription.get(timeout=HEARTBEAT_SECONDS)
+                except queue.Empty:
+                    yield heartbeat()
+                    continue
+                if delta is STREAM_ENDED:
+                    continue
+                if delta is RECONNECT:
+                    break
+                if delta['version'] <= version:
+                    continue
+                yield format_sse(delta, event='delta', event_id=str(delta['version']))
+
+            yield format_sse({}, event='reconnect')
+        finally:
+            leaderboard_hub.unsubscribe(subscription)
+
+    return sse_response(generate())
+
 @challenge_bp.route('/<challenge_id>/declare-winner', methods=['POST'])
 @admin_required
 def declare_challenge_winner(challenge_id):
@@ -1,42 +1,126 @@
 from flask import Blueprint, request, jsonify
 from models.Notification import Notification
 from utils.firebase import db
-from utils.decorators import firebase_token_required
+from utils.decorators import firebase_token_required, stream_token_required
+from utils.exceptions import ValidationError
 from firebase_admin import firestore
+from services.notification_service import queue_notification, adjust_unread_count, get_unread_count
+from utils.batch import chunks, MAX_BATCH_WRITES
+from utils.sse import format_sse, heartbeat, sse_response, HEARTBEAT_SECONDS, MAX_STREAM_SECONDS, RETRY_MILLISECONDS, RECONNECT
+from services.notification_stream import notification_broker, serialize_notification
+import queue
+import time
 
 notification_bp = Blueprint('notifications', __name__)
 
+MAX_PAGE_SIZE = 50
+MAX_BULK_IDS = 500
+# Una escritura por notificación más la del contador de no leídas
+BULK_CHUNK_SIZE = MAX_BATCH_WRITES - 1
+
+MAX_REPLAY = 50
+
+def _serialize_notification(notif):
+    return serialize_notification(notif.id, notif.to_dict())
+
 @notification_bp.route('', methods=['GET'])
 @firebase_token_required
 def get_notifications():
     try:
         user_id = request.user['uid']
-        limit = int(request.args.get('limit', 10))
+        limit = min(max(int(request.args.get('limit', 10)), 1), MAX_PAGE_SIZE)
+        cursor = request.args.get('cursor')
         
-        # Consulta modificada temporalmente (sin ordenamiento)
-        notifications = db.collection('notifications') \
+        # Índice compuesto: userId ASC + createdAt DESC (firestore.indexes.json)
+        query = db.collection('notifications') \
             .where('userId', '==', user_id) \
-            .limit(limit) \
-            .stream()
-        
-        result = []
-        for notif in notifications:
-            notif_data = notif.to_dict()
-            if 'createdAt' in notif_data:
-                notif_data['createdAt'] = notif_data['createdAt'].isoformat()
-            if 'readAt' in notif_data and notif_data['readAt']:
-                notif_data['readAt'] = notif_data['readAt'].isoformat()
-            notif_data['id'] = notif.id
-            result.append(notif_data)
-        
-        # Ordenar manualmente en Python
-        result.sort(key=lambda x: x.get('createdAt', ''), reverse=True)
-            
-        return jsonify(result), 200
+            .order_by('createdAt', direction=firestore.Query.DESCENDING) \
+            .limit(limit)
+        
+        # El cursor es el ID de la última notificación de la página anterior
+        if cursor:
+            cursor_doc = db.collection('notifications').document(cursor).get()
+            if not cursor_doc.exists or cursor_doc.to_dict().get('userId') != user_id:
+                return jsonify({"error": "Cursor inválido"}), 400
+            query = query.start_after(cursor_doc)
+        
+        result = [_serialize_notification(notif) for notif in query.stream()]
+        
+        response = jsonify(result)
+        # Solo hay más páginas si la actual vino completa
+        if len(result) == limit:
+            response.headers['X-Next-Cursor'] = result[-1]['id']
+        return response, 200
+    except ValueError:
+        return jsonify({"error": "Parámetro limit inválido"}), 400
     except Exception as e:
         print(f"Error en get_notifications: {str(e)}")
         return jsonify({"error": f"Error al obtener notificaciones: {str(e)}"}), 500
+
+@notification_bp.route('/unread-count', methods=['GET'])
+@firebase_token_required
+def get_unread_notifications_count():
+    try:
+        return jsonify({"unreadCount": get_unread_count(request.user['uid'])}), 200
+    except Exception as e:
+        print(f"Error en get_unread_notifications_count: {str(e)}")
+        return jsonify({"error": f"Error al obtener notificaciones no leídas: {str(e)}"}), 500
     
+def _notifications_after(user_id, last_event_id):
+    """Notificaciones creadas después de last_event_id (reconexión de EventSource)"""
+    cursor_doc = db.collection('notifications').document(last_event_id).get()
+    if not cursor_doc.exists or cursor_doc.to_dict().get('userId') != user_id:
+        return []
+    query = db.collection('notifications') \
+        .where('userId', '==', user_id) \
+        .order_by('createdAt') \
+        .start_after(cursor_doc) \
+        .limit(MAX_REPLAY)
+    return [_serialize_notification(notif) for notif in query.stream()]
+
+@notification_bp.route('/stream', methods=['GET'])
+@stream_token_required
+def stream_notifications():
+    user_id = request.user['uid']
+    last_event_id = request.headers.get('Last-Event-ID') or request.args.get('lastEventId')
+
+    # Suscribirse antes de recuperar lo perdido para no dejar huecos entre ambos
+    subscription = notification_broker.subscribe(user_id)
+    try:
+        missed = _notifications_after(user_id, last_event_id) if last_event_id else []
+    except Exception as e:
+        notification_broker.unsubscribe(subscription)
+        print(f"Error en stream_notifications: {str(e)}")
+        return jsonify({"error": f"Error al abrir el stream: {str(e)}"}), 500
+
+    def generate():
+        try:
+            yield f"retry: {RETRY_MILLISECONDS}\n\n"
+            sent = set()
+            for notif in missed:
+                sent.add(notif['id'])
+                yield format_sse(notif, event='notification', event_id=notif['id'])
+
+            deadline = time.monotonic() + MAX_STREAM_SECONDS
+            while time.monotonic() < deadline:
+                try:
+                    item = subscription.get(timeout=HEARTBEAT_SECONDS)
+                except queue.Empty:
+                    yield heartbeat()
+                    continue
+                if item is RECONNECT:
+                    break
+                if item['id'] in sent:
+                    continue
+                yield format_sse(item, event='notification', event_id=item['id'])
+
+            # El cliente reconecta solo y recupera lo pendiente con Last-Event-ID
+            yield format_sse({}, event='reconnect')
+        finally:
+            notification_broker.unsubscribe(subscription)
+
+    return sse_response(generate())
+
 @notification_bp.route('', methods=['POST'])
 @firebase_token_required
 def create_notification():
@@ -50,14 +134,10 @@ def create_notification():
         if not all([user_id, title, message, notification_type]):
             return jsonify({"error": "Faltan campos requeridos"}), 400
             
-        notification = Notification(
-            user_id=user_id,
-            title=title,
-            message=message,
-            notification_type=notification_type
-        )
-        
-        _, doc_ref = db.collection('notifications').add(notification.to_dict())
+        # La notificación y el contador de no leídas se escriben juntos
+        batch = db.batch()
+        doc_ref = queue_notification(batch, user_id, title, message, notification_type)
+        batch.commit()
         
         return jsonify({
             "success": True,
@@ -78,13 +158,20 @@ def mark_notification_as_read(notification_id):
         if not notification.exists:
             return jsonify({"error": "Notificación no encontrada"}), 404
         
-        if notification.to_dict().get('userId') != request.user['uid']:
+        notification_data = notification.to_dict()
+        if notification_data.get('userId') != request.user['uid']:
             return jsonify({"error": "No autorizado"}), 403
         
-        notification_ref.update({
+        if notification_data.get('isRead'):
+            return jsonify({"message": "Notificación marcada como leída"}), 200
+        
+        batch = db.batch()
+        batch.update(notification_ref, {
             "isRead": True,
             "readAt": firestore.SERVER_TIMESTAMP
         })
+        adjust_unread_count(batch, request.user['uid'], -1)
+        batch.commit()
         
         return jsonify({"message": "Notificación marcada como leída"}), 200
     except Exception as e:
@@ -100,13 +187,111 @@ def delete_notification(notification_id):
         if not notification.exists:
             return jsonify({"error": "Notificación no encontrada"}), 404
         
-        if notification.to_dict().get('userId') != request.user['uid']:
+        notification_data = notification.to_dict()
+        if notification_data.get('userId') != request.user['uid']:
             return jsonify({"error": "No autorizado"}), 403
         
-        notification_ref.delete()
+        batch = db.batch()
+        batch.delete(notification_ref)
+        if not notification_data.get('isRead'):
+            adjust_unread_count(batch, request.user['uid'], -1)
+        batch.commit()
         
         return jsonify({"message": "Notificación eliminada"}), 200
     except Exception as e:
         return jsonify({"error": f"Error al eliminar notificación: {str(e)}"}), 500
 
-    
\ No newline at end of file
+def _select_bulk_notifications(user_id, data, unread_only=False):
+    """Devuelve los snapshots afectados por una operación masiva.
+
+    Acepta {"ids": [...]} (un solo get_all que además verifica la propiedad),
+    {"before": "<id>"} (esa notificación y todas las anteriores) o {"all": true}.
+    """
+    ids = data.get('ids')
+    if ids is not None:
+        if not isinstance(ids, list) or not all(isinstance(i, str) and i for i in ids):
+            raise ValidationError("ids debe ser una lista de IDs")
+        if len(ids) > MAX_BULK_IDS:
+            raise ValidationError(f"Máximo {MAX_BULK_IDS} notificaciones por solicitud")
+        refs = [db.collection('notifications').document(i) for i in dict.fromkeys(ids)]
+        snapshots = db.get_all(refs)
+        return (
+            snap for snap in snapshots
+            if snap.exists and snap.to_dict().get('userId') == user_id
+            and not (unread_only and snap.to_dict().get('isRead'))
+        )
+
+    before = data.get('before')
+    if not before and not data.get('all'):
+        raise ValidationError("Se requiere ids, before o all")
+
+    query = db.collection('notifications').where('userId', '==', user_id)
+    if unread_only:
+        query = query.where('isRead', '==', False)
+    query = query.order_by('createdAt', direction=firestore.Query.DESCENDING)
+
+    if before:
+        cursor_doc = db.collection('notifications').document(before).get()
+        if not cursor_doc.exists or cursor_doc.to_dict().get('userId') != user_id:
+            raise ValidationError("Cursor inválido")
+        query = query.start_at(cursor_doc)
+
+    return query.stream()
+
+@notification_bp.route('/bulk-read', methods=['PUT'])
+@firebase_token_required
+def mark_notifications_as_read():
+    try:
+        user_id = request.user['uid']
+        data = request.get_json() or {}
+        updated = 0
+
+        for chunk in chunks(_select_bulk_notifications(user_id, data, unread_only=True), BULK_CHUNK_SIZE):
+            batch = db.batch()
+            for snap in chunk:
+                batch.update(snap.reference, {
+                    "isRead": True,
+                    "readAt": firestore.SERVER_TIMESTAMP
+                })
+            adjust_unread_count(batch, user_id, -len(chunk))
+            batch.commit()
+            updated += len(chunk)
+
+        return jsonify({
+            "message": "Notificaciones marcadas como leídas",
+            "updated": updated,
+            "unreadCount": get_unread_count(user_id)
+        }), 200
+    except ValidationError as e:
+        return jsonify({"error": e.message}), 400
+    except Exception as e:
+        return jsonify({"error": f"Error al marcar notificaciones: {str(e)}"}), 500
+
+@notification_bp.route('/bulk-delete', methods=['POST'])
+@firebase_token_required
+def delete_notifications():
+    try:
+        user_id = request.user['uid']
+        data = request.get_json() or {}
+        deleted = 0
+
+        for chunk in chunks(_select_bulk_notifications(user_id, data), BULK_CHUNK_SIZE):
+            batch = db.batch()
+            unread = 0
+            for snap in chunk:
+                batch.delete(snap.reference)
+                if not snap.to_dict().get('isRead'):
+                    unread += 1
+            adjust_unread_count(batch, user_id, -unread)
+            batch.commit()
+            deleted += len(chunk)
+
+        return jsonify({
+            "message": "Notificaciones eliminadas",
+            "deleted": deleted,
+            "unreadCount": get_unread_count(user_id)
+        }), 200
+    except ValidationError as e:
+        return jsonify({"error": e.message}), 400
+    except Exception as e:
+        return jsonify({"error": f"Error al eliminar notificaciones: {str(e)}"}), 500
@@ -1,19 +1,36 @@
+import asyncio
 import traceback
+from collections import Counter
+from google.api_core.exceptions import AlreadyExists
 from flask import Blueprint, request, jsonify
 from models.Participation import Participation
 from utils.firebase import db
-from utils.decorators import firebase_token_required, admin_required
+from utils.decorators import firebase_token_required, admin_required, max_query_documents
 from firebase_admin import firestore
-from utils.exceptions import ValidationError
+from utils.exceptions import ValidationError, ByteBattleError
 from services.notification_service import send_notification, send_admin_notification
+from utils.batch import chunks
+from utils.concurrency import parallel_map, get_documents
+from utils.firestore_async import get_async_db, get_documents_async, query_async
+from services.payment_service import confirm_participation_payment
+from services.submission_storage import queue_submission, submission_ref, participation_code
+from services.participation_migration import find_legacy_participation
 
 participation_bp = Blueprint('participations', __name__)
 MAX_CODE_LENGTH = 10000  # Límite de 10,000 caracteres para el código
+MAX_IN_VALUES = 30  # Límite actual de valores en un filtro "in" de Firestore
+MAX_CHALLENGE_IDS = 100  # Máximo de retos por consulta en /by-challenges (ruta pública)
+# Máximo de documentos por consulta: administradores a notificar al iniciar una
+# participación y participaciones listadas por estado de pago
+MAX_ADMINS_NOTIFIED = 500
+MAX_PARTICIPATIONS_BY_STATUS = 2000
 
 @participation_bp.route('', methods=['GET'])
 @firebase_token_required
-def get_user_participations():
+async def get_user_participations():
     try:
+        async_db = get_async_db()
+        
         # Obtener el ID del usuario desde el token o parámetro
         requesting_user_id = request.user['uid']
         target_user_id = request.args.get('userId')
@@ -22,27 +39,28 @@ def get_user_participations():
         if not target_user_id:
             target_user_id = requesting_user_id
         
-        # Verificar permisos
+        # Obtener participaciones (junto con el rol de quien consulta, si hace falta)
+        reads = [query_async(async_db.collection('participations').where('userId', '==', target_user_id))]
         if requesting_user_id != target_user_id:
+            reads.append(get_documents_async([async_db.collection('users').document(requesting_user_id)]))
+        participation_docs, *requesting_user = await asyncio.gather(*reads)
+        
+        # Verificar permisos
+        if requesting_user:
             # Solo permitir a admins ver otras participaciones
-            user_ref = db.collection('users').document(requesting_user_id).get()
-            if not user_ref.exists or user_ref.to_dict().get('role') != 'admin':
+            (user_doc,) = requesting_user[0]
+            if not user_doc.exists or user_doc.to_dict().get('role') != 'admin':
                 return jsonify({"error": "No autorizado"}), 403
         
-        # Obtener participaciones
-        participations_ref = db.collection('participations').where('userId', '==', target_user_id)
-        participations = []
+        # Datos de los retos en un solo get_all
+        participations = [dict(doc.to_dict(), id=doc.id) for doc in participation_docs]
+        challenges = await get_documents_async([
+            async_db.collection('challenges').document(part_data['challengeId']) for part_data in participations
+        ])
         
-        for doc in participations_ref.stream():
-            part_data = doc.to_dict()
-            part_data['id'] = doc.id
-            
-            # Obtener datos del reto
-            challenge_ref = db.collection('challenges').document(part_data['challengeId']).get()
-            if challenge_ref.exists:
-                part_data['challenge'] = challenge_ref.to_dict()
-            
-            participations.append(part_data)
+        for part_data, challenge in zip(participations, challenges):
+            if challenge.exists:
+                part_data['challenge'] = challenge.to_dict()
         
         return jsonify(participations), 200
         
@@ -52,6 +70,7 @@ def get_user_participations():
     
 @participation_bp.route('', methods=['POST'])
 @firebase_token_required
+@max_query_documents(MAX_ADMINS_NOTIFIED)
 def initiate_participation():
     try:
         print("\n--- Iniciando participación ---")
@@ -84,14 +103,8 @@ def initiate_participation():
             print("Error: Reto no está activo")
             return jsonify({"error": "El reto no está activo"}), 400
             
-        # Verificar que el usuario no haya participado ya
-        existing_query = db.collection('participations') \
-            .where('userId', '==', user_id) \
-            .where('challengeId', '==', challenge_id)
-            
-        existing_participations = list(existing_query.stream())
-        
-        if len(existing_participations) > 0:
+        # Participaciones anteriores a los IDs deterministas (hasta completar la migración)
+        if find_legacy_participation(challenge_id, user_id) is not None:
             print("Error: Usuario ya está participando")
             return jsonify({"error": "Ya estás participando en este reto"}), 400
             
@@ -111,9 +124,14 @@ def initiate_participation():
         
         print("Creando participación con datos:", new_participation)
         
-        # Agregar la participación a Firestore
-        doc_ref = db.collection('participations').document()
-        doc_ref.set(new_participation)
+        # El ID es {challengeId}_{userId}: create() falla si el usuario ya participa,
+        # así no hace falta consultar antes y un doble clic no crea duplicados
+        doc_ref = db.collection('participations').document(Participation.document_id(challenge_id, user_id))
+        try:
+            doc_ref.create(new_participation)
+        except AlreadyExists:
+            print("Error: Usuario ya está participando")
+            return jsonify({"error": "Ya estás participando en este reto"}), 400
 
         # Notificar al usuario
         challenge_title = challenge_data.get('title', 'el reto')
@@ -135,6 +153,9 @@ def initiate_participation():
             "participationId": doc_ref.id
         }), 201
         
+    except ByteBattleError:
+        # QueryTooLargeError y demás errores propios los responde el manejador de la app
+        raise
     except Exception as e:
         print(f"Error completo en initiate_participation: {str(e)}")
         print(f"Traceback: {traceback.format_exc()}")
@@ -142,29 +163,31 @@ def initiate_participation():
     
 @participation_bp.route('/pending-results', methods=['GET'])
 @admin_required
-def get_pending_results():
+async def get_pending_results():
     try:
-        participations_ref = db.collection('participations')
-        query = participations_ref.where('paymentStatus', '==', 'confirmed') \
-                                 .where('score', '>', 0) \
-                                 .order_by('score', direction=firestore.Query.DESCENDING)
+        async_db = get_async_db()
+        query = async_db.collection('participations') \
+            .where('paymentStatus', '==', 'confirmed') \
+            .where('score', '>', 0) \
+            .order_by('score', direction=firestore.Query.DESCENDING)
+        participations = [dict(doc.to_dict(), id=doc.id) for doc in await query_async(query)]
+        
+        # Retos y usuarios se leen a la vez, cada grupo en un solo get_all
+        challenges, users = await asyncio.gather(
+            get_documents_async([async_db.collection('challenges').document(part_data['challengeId'])
+                                 for part_data in participations]),
+            get_documents_async([async_db.collection('users').document(part_data['userId'])
+                                 for part_data in participations])
+        )
         
         pending_results = []
-        
-        for doc in query.stream():
-            part_data = doc.to_dict()
-            part_data['id'] = doc.id
-            
-            # Obtener datos del reto
-            challenge = db.collection('challenges').document(part_data['challengeId']).get().to_dict()
+        for part_data, challenge, user in zip(participations, challenges, users):
+            challenge = challenge.to_dict()
             if not challenge or challenge.get('winnerUserId'):
                 continue
                 
-            # Obtener datos del usuario
-            user = db.collection('users').document(part_data['userId']).get().to_dict()
-            
             part_data['challenge'] = challenge
-            part_data['user'] = user
+            part_data['user'] = user.to_dict()
             pending_results.append(part_data)
         
         # Devuelve directamente el array de resultados
@@ -187,6 +210,8 @@ def submit_score_and_code(participation_id):
         # Validaciones básicas
         if not all([score, code, aceptaelreto_username]):
             return jsonify({"error": "Faltan datos requeridos"}), 400
+        if len(code) > MAX_CODE_LENGTH:
+            return jsonify({"error": f"El código no puede superar {MAX_CODE_LENGTH} caracteres"}), 400
 
         # Obtener participación
         participation_ref = db.collection('participations').document(participation_id)
@@ -210,19 +235,22 @@ def submit_score_and_code(participation_id):
         user_ref = db.collection('users').document(request.user['uid'])
         user = user_ref.get()
         
+        batch = db.batch()
         if user.exists and not user.to_dict().get('aceptaelretoUsername'):
-            user_ref.update({
+            batch.update(user_ref, {
                 "aceptaelretoUsername": aceptaelreto_username,
                 "updatedAt": firestore.SERVER_TIMESTAMP
             })
         
-        # Actualizar participación
-        participation_ref.update({
+        # El código va comprimido a submissions; la participación solo guarda la referencia
+        participation_update = queue_submission(batch, code)
+        participation_update.update({
             "score": int(score),
-            "code": code,
             "aceptaelretoUsername": aceptaelreto_username,
             "submissionDate": firestore.SERVER_TIMESTAMP
         })
+        batch.update(participation_ref, participation_update)
+        batch.commit()
         
         return jsonify({"message": "Resultados enviados exitosamente"}), 200
         
@@ -238,18 +266,26 @@ def get_participant_code(participation_id):
             return jsonify({"error": "Participación no encontrada"}), 404
             
         part_data = participation.to_dict()
-        challenge = db.collection('challenges').document(part_data['challengeId']).get()
+        
+        # Reto, usuario y código no dependen entre sí: se leen juntos en un solo RPC
+        refs = [
+            db.collection('challenges').document(part_data['challengeId']),
+            db.collection('users').document(part_data['userId'])
+        ]
+        if part_data.get('codeRef'):
+            refs.append(submission_ref(part_data['codeRef']))
+        challenge, user, *submission = get_documents(db, refs)
         
         # Solo permitir ver código si el reto ha finalizado
-        if challenge.to_dict().get('status') != 'pasado':
+        if not challenge.exists or challenge.to_dict().get('status') != 'pasado':
             return jsonify({"error": "El código solo es visible después de finalizado el reto"}), 403
         
-        # Obtener código directamente del documento
-        code = part_data.get('code', '')
+        # Código desde submissions (o inline en participaciones antiguas)
+        code = participation_code(part_data, submission[0] if submission else None)
         
         return jsonify({
             "code": code,
-            "username": db.collection('users').document(part_data['userId']).get().to_dict().get('username')
+            "username": user.to_dict().get('username') if user.exists else None
         }), 200
     except Exception as e:
         return jsonify({"error": f"Error al obtener código: {str(e)}"}), 500
@@ -286,6 +322,7 @@ def notify_payment(participation_id):
     
 @participation_bp.route('/status/<status>', methods=['GET'])
 @admin_required
+@max_query_documents(MAX_PARTICIPATIONS_BY_STATUS)
 def get_participations_by_status(status):
     try:
         participations_ref = db.collection('participations').where('paymentStatus', '==', status)
@@ -308,6 +345,8 @@ def get_participations_by_status(status):
             participations.append(part_data)
             
         return jsonify(participations), 200
+    except ByteBattleError:
+        raise
     except Exception as e:
         return jsonify({"error": str(e)}), 500
     
@@ -315,59 +354,23 @@ def get_participations_by_status(status):
 @admin_required
 def confirm_payment(participation_id):
     try:
-        participation_ref = db.collection('participations').document(participation_id)
-        participation = participation_ref.get()
+        # Un solo commit atómico; repetir la solicitud no vuelve a sumar al premio
+        result = confirm_participation_payment(participation_id)
         
-        if not participation.exists:
-            return jsonify({"error": "Participación no encontrada"}), 404
-            
-        participation_data = participation.to_dict()
-        user_id = participation_data.get('userId')
-        challenge_id = participation_data.get('challengeId')
-        
-        # Obtener el reto para actualizar el premio total
-        challenge_ref = db.collection('challenges').document(challenge_id)
-        challenge = challenge_ref.get()
-        
-        if not challenge.exists:
-            return jsonify({"error": "Reto no encontrado"}), 404
-            
-        challenge_data = challenge.to_dict()
-        participation_cost = challenge_data.get('participationCost', 0)
-        
-        # Actualizar participación
-        participation_ref.update({
-            "isPaid": True,
-            "paymentStatus": "confirmed",
-            "paymentConfirmationDate": firestore.SERVER_TIMESTAMP
-        })
-        
-        # Actualizar el premio total del reto (incrementar)
-        challenge_ref.update({
-            "totalPot": firestore.Increment(participation_cost),
-            "updatedAt": firestore.SERVER_TIMESTAMP
-        })
-        
-        # Incrementar contador de participaciones del usuario
-        db.collection('users').document(user_id).update({
-            "totalParticipations": firestore.Increment(1),
-            "updatedAt": firestore.SERVER_TIMESTAMP
-        })
-        
-        # Notificar al usuario
-        challenge_title = challenge_data.get('title', 'el reto')
-        
-        send_notification(
-            user_id=user_id,
-            title="Pago confirmado",
-            message=f"Tu pago para {challenge_title} ha sido confirmado. ¡Ya puedes enviar tus resultados!",
-            notification_type="payment"
-        )
+        if result['alreadyConfirmed']:
+            return jsonify({
+                "message": "El pago ya estaba confirmado.",
+                "alreadyConfirmed": True,
+                "newTotalPot": result['newTotalPot']
+            }), 200
         
         return jsonify({
             "message": "Pago confirmado exitosamente. Premio total actualizado.",
-            "newTotalPot": challenge_data.get('totalPot', 0) + participation_cost
+            "alreadyConfirmed": False,
+            "newTotalPot": result['newTotalPot']
         }), 200
+    except ByteBattleError as e:
+        return jsonify({"error": e.message}), e.status_code
     except Exception as e:
         print(f"Error al confirmar pago: {str(e)}")
         return jsonify({"error": f"Error al confirmar pago: {str(e)}"}), 500
@@ -392,10 +395,15 @@ def get_participation_details(participation_id):
             if not user_ref.exists or user_ref.to_dict().get('role') != 'admin':
                 return jsonify({"error": "No autorizado"}), 403
         
-        # Obtener datos del reto
-        challenge_ref = db.collection('challenges').document(part_data['challengeId']).get()
+        # Obtener datos del reto (y el código del envío, en el mismo RPC)
+        refs = [db.collection('challenges').document(part_data['challengeId'])]
+        if part_data.get('codeRef'):
+            refs.append(submission_ref(part_data['codeRef']))
+        challenge_ref, *submission = get_documents(db, refs)
         if challenge_ref.exists:
             part_data['challenge'] = challenge_ref.to_dict()
+        if submission:
+            part_data['code'] = participation_code(part_data, submission[0])
         
         part_data['id'] = participation_id
         return jsonify(part_data), 200
@@ -411,28 +419,46 @@ def get_participations_by_challenge_ids():
         if not challenge_ids:
             return jsonify({"error": "Se requieren IDs de retos"}), 400
         
-        # Convertir a lista
-        challenge_ids_list = challenge_ids.split(',')
+        # Convertir a lista (sin vacíos ni repetidos)
+        challenge_ids_list = list(dict.fromkeys(cid.strip() for cid in challenge_ids.split(',') if cid.strip()))
+        if not challenge_ids_list:
+            return jsonify({"error": "Se requieren IDs de retos"}), 400
+        if len(challenge_ids_list) > MAX_CHALLENGE_IDS:
+            return jsonify({"error": f"Se admiten como máximo {MAX_CHALLENGE_IDS} IDs de retos"}), 400
         
-        # Consulta para obtener solo participaciones confirmadas
         participations_ref = db.collection('participations')
         
-        # Firestore no permite consultas con "IN" en más de 10 elementos, así que hacemos consultas separadas
-        participations = []
-        for chunk in [challenge_ids_list[i:i + 10] for i in range(0, len(challenge_ids_list), 10)]:
-            query = participations_ref.where('challengeId', 'in', chunk) \
-                                    .where('paymentStatus', '==', 'confirmed')
+        # mode=counts: solo el número de participaciones confirmadas por reto. Se usan las
+        # mismas consultas "in" por bloques con una proyección mínima y se cuenta aquí,
+        # en vez de un count() por reto (hasta MAX_CHALLENGE_IDS RPCs por solicitud)
+        if request.args.get('mode') == 'counts':
+            def count_chunk(chunk):
+                query = participations_ref.where('challengeId', 'in', chunk) \
+                                          .where('paymentStatus', '==', 'confirmed') \
+                                          .select(['challengeId'])
+                return Counter(doc.get('challengeId') for doc in query.stream())
             
-            for doc in query.stream():
-                part_data = {
-                    'id': doc.id,
-                    'challengeId': doc.get('challengeId'),
-                    'paymentStatus': doc.get('paymentStatus')
-                }
-                participations.append(part_data)
+            counts = Counter()
+            for chunk_counts in parallel_map(count_chunk, chunks(challenge_ids_list, MAX_IN_VALUES)):
+                counts.update(chunk_counts)
+            return jsonify({challenge_id: counts[challenge_id] for challenge_id in challenge_ids_list}), 200
+        
+        # Firestore admite hasta 30 valores en un "in"; los bloques se consultan en paralelo
+        def fetch_chunk(chunk):
+            query = participations_ref.where('challengeId', 'in', chunk) \
+                                      .where('paymentStatus', '==', 'confirmed')
+            return [{
+                'id': doc.id,
+                'challengeId': doc.get('challengeId'),
+                'paymentStatus': doc.get('paymentStatus')
+            } for doc in query.stream()]
+        
+        participations = []
+        for chunk_result in parallel_map(fetch_chunk, chunks(challenge_ids_list, MAX_IN_VALUES)):
+            participations.extend(chunk_result)
         
         return jsonify(participations), 200
         
     except Exception as e:
         print(f"Error en get_participations_by_challenge_ids: {str(e)}")
-        return jsonify({"error": "Error al obtener participaciones"}), 500
\ No newline at end of file
+        return jsonify({"error": "Error al obtener participaciones"}), 500
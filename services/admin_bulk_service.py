@@ -0,0 +1,197 @@
+from collections import Counter
+from datetime import datetime
+from firebase_admin import auth, firestore
+from google.api_core.exceptions import FailedPrecondition
+from utils.firebase import db
+from utils.batch import BatchWriter, chunks
+from utils.concurrency import parallel_map, get_documents
+from utils.exceptions import ByteBattleError, ValidationError
+from services.notification_service import queue_notification
+from services.payment_service import confirm_participation_payment
+
+MAX_BULK_ITEMS = 500
+# Documentos por llamada a get_all
+READ_CHUNK_SIZE = 100
+# Por pago: participación + notificación + contador de no leídas, más a lo sumo un
+# incremento de reto y uno de usuario. 90 * 5 = 450 < 500 escrituras por batch
+CONFIRM_CHUNK_SIZE = 90
+VALID_ROLES = ('admin', 'user')
+
+def _validate_ids(ids, label):
+    if not isinstance(ids, list) or not ids:
+        raise ValidationError(f"Se requiere una lista de {label}")
+    ids = list(dict.fromkeys(i for i in ids if isinstance(i, str) and i))
+    if len(ids) > MAX_BULK_ITEMS:
+        raise ValidationError(f"Máximo {MAX_BULK_ITEMS} {label} por solicitud")
+    return ids
+
+def _load(collection, ids):
+    """Lee los documentos en chunks de get_all en paralelo; devuelve {id: snapshot}"""
+    refs = [db.collection(collection).document(i) for i in ids]
+    pages = parallel_map(lambda chunk: get_documents(db, chunk), list(chunks(refs, READ_CHUNK_SIZE)))
+    return {snap.id: snap for page in pages for snap in page}
+
+def _summary(results):
+    return dict(Counter(result['status'] for result in results))
+
+def _confirm_single(participation_id):
+    try:
+        result = confirm_participation_payment(participation_id)
+        return {"status": "alreadyConfirmed" if result['alreadyConfirmed'] else "confirmed"}
+    except ByteBattleError as e:
+        return {"status": "error", "message": e.message}
+    except Exception as e:
+        return {"status": "error", "message": str(e)}
+
+def bulk_confirm_payments(participation_ids):
+    """Confirma varios pagos con pocas lecturas y un batch por cada CONFIRM_CHUNK_SIZE pagos.
+
+    Cada participación se escribe con precondición last_update_time. Si el commit de un
+    batch falla (alguna cambió entre la lectura y el commit, falta un usuario, etc.), ese
+    chunk se reprocesa pago por pago con confirm_participation_payment, que es
+    idempotente, y los errores quedan en el resultado de cada pago. Los chunks ya
+    confirmados no se ven afectados.
+    """
+    ids = _validate_ids(participation_ids, "participaciones")
+    participations = _load('participations', ids)
+
+    results = {}
+    pending = []
+    for participation_id in ids:
+        snap = participations[participation_id]
+        if not snap.exists:
+            results[participation_id] = {"status": "notFound", "message": "Participación no encontrada"}
+        elif snap.to_dict().get('paymentStatus') == 'confirmed':
+            results[participation_id] = {"status": "alreadyConfirmed"}
+        else:
+            pending.append(snap)
+
+    challenge_ids = list(dict.fromkeys(snap.to_dict().get('challengeId') for snap in pending))
+    challenges = _load('challenges', [c for c in challenge_ids if c])
+
+    for chunk in chunks(pending, CONFIRM_CHUNK_SIZE):
+        batch = db.batch()
+        pot_increments = Counter()
+        participation_increments = Counter()
+        confirmed = []
+
+        for snap in chunk:
+            data = snap.to_dict()
+            challenge = challenges.get(data.get('challengeId'))
+            if challenge is None or not challenge.exists:
+                results[snap.id] = {"status": "error", "message": "Reto no encontrado"}
+                continue
+
+            challenge_data = challenge.to_dict()
+            batch.update(snap.reference, {
+                "isPaid": True,
+                "paymentStatus": "confirmed",
+                "paymentConfirmationDate": firestore.SERVER_TIMESTAMP
+            }, option=db.write_option(last_update_time=snap.update_time))
+            pot_increments[challenge.id] += challenge_data.get('participationCost', 0)
+            participation_increments[data.get('userId')] += 1
+            queue_notification(
+                batch,
+                data.get('userId'),
+                "Pago confirmado",
+                f"Tu pago para {challenge_data.get('title', 'el reto')} ha sido confirmado. ¡Ya puedes enviar tus resultados!",
+                "payment"
+            )
+            confirmed.append(snap.id)
+
+        if not confirmed:
+            continue
+
+        # Un incremento por reto y por usuario, aunque haya varios pagos del mismo
+        for challenge_id, amount in pot_increments.items():
+            batch.update(db.collection('challenges').document(challenge_id), {
+                "totalPot": firestore.Increment(amount),
+                "updatedAt": firestore.SERVER_TIMESTAMP
+            })
+        for user_id, amount in participation_increments.items():
+            batch.update(db.collection('users').document(user_id), {
+                "totalParticipations": firestore.Increment(amount),
+                "updatedAt": firestore.SERVER_TIMESTAMP
+            })
+
+        try:
+            batch.commit()
+        except Exception as e:
+            # Nada del batch se aplicó (un commit es atómico): reintentar cada pago por
+            # separado, así un documento faltante solo afecta a su propio pago
+            if not isinstance(e, FailedPrecondition):
+                print(f"Error al confirmar un bloque de {len(confirmed)} pagos, se reintentan uno a uno: {str(e)}")
+            for participation_id in confirmed:
+                results[participation_id] = _confirm_single(participation_id)
+            continue
+
+        for participation_id in confirmed:
+            results[participation_id] = {"status": "confirmed"}
+
+    ordered = [{"id": participation_id, **results[participation_id]} for participation_id in ids]
+    return {"results": ordered, "summary": _summary(ordered)}
+
+def bulk_ban_users(user_ids, is_banned=True):
+    """Banea o desbanea usuarios en Firestore y deshabilita/habilita su cuenta en Auth.
+
+    Las llamadas a Auth no admiten lotes, así que se hacen en el pool acotado de
+    utils.concurrency; solo los usuarios cuya cuenta se actualizó se marcan en Firestore.
+    """
+    ids = _validate_ids(user_ids, "usuarios")
+    users = _load('users', ids)
+
+    def update_auth(user_id):
+        try:
+            auth.update_user(user_id, disabled=is_banned)
+            return None
+        except auth.UserNotFoundError:
+            return "Cuenta de autenticación no encontrada"
+        except Exception as e:
+            return str(e)
+
+    existing = [user_id for user_id in ids if users[user_id].exists]
+    auth_errors = dict(zip(existing, parallel_map(update_auth, existing)))
+
+    results = {}
+    writer = BatchWriter(db)
+    for user_id in ids:
+        if not users[user_id].exists:
+            results[user_id] = {"status": "notFound", "message": "Usuario no encontrado"}
+        elif auth_errors[user_id]:
+            results[user_id] = {"status": "error", "message": auth_errors[user_id]}
+        else:
+            writer.update(users[user_id].reference, {
+                'isBanned': is_banned,
+                'updatedAt': datetime.utcnow()
+            })
+            results[user_id] = {"status": "banned" if is_banned else "unbanned"}
+    writer.flush()
+
+    ordered = [{"id": user_id, **results[user_id]} for user_id in ids]
+    return {"results": ordered, "summary": _summary(ordered)}
+
+def bulk_set_roles(user_ids, role):
+    """Asigna el mismo rol a varios usuarios en batches de hasta 500 escrituras"""
+    if role not in VALID_ROLES:
+        raise ValidationError("Rol inválido")
+    ids = _validate_ids(user_ids, "usuarios")
+    users = _load('users', ids)
+
+    results = {}
+    writer = BatchWriter(db)
+    for user_id in ids:
+        snap = users[user_id]
+        if not snap.exists:
+            results[user_id] = {"status": "notFound", "message": "Usuario no encontrado"}
+        elif snap.to_dict().get('role') == role:
+            results[user_id] = {"status": "unchanged"}
+        else:
+            writer.update(snap.reference, {
+                'role': role,
+                'updatedAt': datetime.utcnow()
+            })
+            results[user_id] = {"status": "updated"}
+    writer.flush()
+
+    ordered = [{"id": user_id, **results[user_id]} for user_id in ids]
+    return {"results": ordered, "summary": _summary(ordered)}
@@ -0,0 +1,76 @@
+import os
+from datetime import datetime
+from utils.firebase import db
+from utils.cache import TTLCache
+from utils.concurrency import gather
+
+CHALLENGE_STATUSES = ('próximo', 'activo', 'pasado')
+PAYMENT_STATUSES = ('pending', 'confirmed')
+
+stats_cache = TTLCache(ttl_seconds=int(os.getenv('ADMIN_STATS_TTL_SECONDS', 60)), name='admin_stats')
+
+def _aggregate(query, sum_field=None):
+    """count() y opcionalmente sum(sum_field) en una sola consulta de agregación"""
+    aggregation = query.count(alias='count')
+    if sum_field:
+        aggregation = aggregation.sum(sum_field, alias='sum')
+    results = {result.alias: result.value for result in aggregation.get()[0]}
+    return results.get('count', 0), results.get('sum', 0) or 0
+
+def compute_admin_stats():
+    """Resumen del panel de administración a partir de agregaciones en paralelo.
+
+    Cada cifra es un RPC de agregación (sin descargar documentos) y todas se lanzan a
+    la vez en el pool de utils.concurrency.
+    """
+    users = db.collection('users')
+    challenges = db.collection('challenges')
+    participations = db.collection('participations')
+
+    calls = {
+        'users': lambda: _aggregate(users),
+        'bannedUsers': lambda: _aggregate(users.where('isBanned', '==', True)),
+        'admins': lambda: _aggregate(users.where('role', '==', 'admin')),
+        'challenges': lambda: _aggregate(challenges, 'totalPot'),
+        'unpaidWinners': lambda: _aggregate(
+            challenges.where('status', '==', 'pasado').where('isPaidToWinner', '==', False), 'totalPot'),
+        'participations': lambda: _aggregate(participations)
+    }
+    for status in CHALLENGE_STATUSES:
+        calls[f'challenges:{status}'] = (
+            lambda status=status: _aggregate(challenges.where('status', '==', status), 'totalPot'))
+    for status in PAYMENT_STATUSES:
+        calls[f'participations:{status}'] = (
+            lambda status=status: _aggregate(participations.where('paymentStatus', '==', status)))
+
+    results = dict(zip(calls, gather(*calls.values())))
+
+    return {
+        "users": {
+            "total": results['users'][0],
+            "banned": results['bannedUsers'][0],
+            "admins": results['admins'][0]
+        },
+        "challenges": {
+            "total": results['challenges'][0],
+            "byStatus": {status: results[f'challenges:{status}'][0] for status in CHALLENGE_STATUSES},
+            "unpaidWinners": results['unpaidWinners'][0]
+        },
+        "payments": {
+            "total": results['participations'][0],
+            "pending": results['participations:pending'][0],
+            "confirmed": results['participations:confirmed'][0]
+        },
+        "pots": {
+            "total": results['challenges'][1],
+            "byStatus": {status: results[f'challenges:{status}'][1] for status in CHALLENGE_STATUSES},
+            "pendingPayout": results['unpaidWinners'][1]
+        },
+        "generatedAt": datetime.utcnow().isoformat()
+    }
+
+def get_admin_stats(refresh=False):
+    """Estadísticas cacheadas durante ADMIN_STATS_TTL_SECONDS; refresh fuerza el recálculo"""
+    if refresh:
+        stats_cache.invalidate('admin')
+    return stats_cache.get_or_compute('admin', compute_admin_stats)
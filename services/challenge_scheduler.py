@@ -0,0 +1,234 @@
+import heapq
+import os
+import threading
+import time
+from datetime import datetime, timezone
+from firebase_admin import firestore
+from google.api_core.exceptions import FailedPrecondition
+from utils.firebase import db
+from utils.batch import chunks, MAX_BATCH_WRITES
+from services.notification_service import queue_notification
+
+# Estado actual -> (campo de fecha que dispara la transición, nuevo estado)
+TRANSITIONS = {
+    'próximo': ('startDate', 'activo'),
+    'activo': ('endDate', 'pasado')
+}
+# Cada notificación de cierre ocupa dos escrituras (documento + contador)
+CLOSE_NOTIFICATION_CHUNK_SIZE = MAX_BATCH_WRITES // 2
+
+def _as_utc(value):
+    if not isinstance(value, datetime):
+        return None
+    if value.tzinfo is None:
+        return value.replace(tzinfo=timezone.utc)
+    return value.astimezone(timezone.utc)
+
+def notify_challenge_closed(challenge_id, challenge_data):
+    """Handler de cierre por defecto: avisa a los participantes confirmados"""
+    challenge_title = challenge_data.get('title', 'el reto')
+    participants = db.collection('participations') \
+        .where('challengeId', '==', challenge_id) \
+        .where('paymentStatus', '==', 'confirmed') \
+        .select(['userId']) \
+        .stream()
+
+    for chunk in chunks(participants, CLOSE_NOTIFICATION_CHUNK_SIZE):
+        batch = db.batch()
+        for participant in chunk:
+            queue_notification(
+                batch,
+                participant.get('userId'),
+                "Reto finalizado",
+                f"El reto '{challenge_title}' ha finalizado. Pronto se publicarán los resultados.",
+                "challenge_result"
+            )
+        batch.commit()
+
+class ChallengeScheduler:
+    """Cambia el estado de los retos según startDate/endDate.
+
+    Mantiene un min-heap de transiciones (fecha, reto, estado esperado) cargado con
+    consultas indexadas por estado y fecha. Al vencer, relee los retos en un solo
+    get_all, descarta entradas obsoletas (fechas o estado cambiados) y aplica los
+    cambios en batches con precondición last_update_time, de modo que varios workers
+    pueden ejecutar el scheduler sin duplicar transiciones ni procesos de cierre.
+    """
+
+    def __init__(self, refresh_seconds=300):
+        self.refresh_seconds = refresh_seconds
+        self._heap = []
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._close_handlers = [notify_challenge_closed]
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def register_close_handler(self, handler):
+        """handler(challenge_id, challenge_data) se ejecuta al pasar un reto a 'pasado'"""
+        self._close_handlers.append(handler)
+
+    def load(self):
+        entries = []
+        for status, (date_field, _) in TRANSITIONS.items():
+            query = db.collection('challenges') \
+                .where('status', '==', status) \
+                .order_by(date_field) \
+                .select([date_field])
+            for doc in query.stream():
+                when = _as_utc(doc.get(date_field))
+                if when:
+                    entries.append((when, doc.id, status))
+        heapq.heapify(entries)
+        with self._lock:
+            self._heap = entries
+        self._wakeup.set()
+        return len(entries)
+
+    def schedule(self, challenge_id, data=None):
+        """Agenda (o reagenda) un reto tras crearlo o editarlo; sin costo si el scheduler no corre"""
+        if not self.running:
+            return
+        if data is None:
+            snapshot = db.collection('challenges').document(challenge_id).get()
+            if not snapshot.exists:
+                return
+            data = snapshot.to_dict()
+        self._push(challenge_id, data)
+        self._wakeup.set()
+
+    def _push(self, challenge_id, data):
+        transition = TRANSITIONS.get(data.get('status'))
+        if not transition:
+            return
+        when = _as_utc(data.get(transition[0]))
+        if when:
+            with self._lock:
+                heapq.heappush(self._heap, (when, challenge_id, data.get('status')))
+
+    def _pop_due(self, now):
+        due = {}
+        with self._lock:
+            while self._heap and self._heap[0][0] <= now:
+                _, challenge_id, status = heapq.heappop(self._heap)
+                due[challenge_id] = status
+        return due
+
+    def run_due(self, now=None):
+        """Aplica las transiciones vencidas y devuelve [(challengeId, nuevoEstado)]"""
+        now = now or datetime.now(timezone.utc)
+        due = self._pop_due(now)
+        if not due:
+            return []
+
+        applied = []
+        for chunk in chunks(due.items(), MAX_BATCH_WRITES):
+            refs = [db.collection('challenges').document(challenge_id) for challenge_id, _ in chunk]
+            updates = []
+            for snapshot in db.get_all(refs):
+                if not snapshot.exists:
+                    continue
+                data = snapshot.to_dict()
+                status = data.get('status')
+                # La entrada es obsoleta si el estado o la fecha cambiaron desde que se agendó
+                if status != due[snapshot.id] or status not in TRANSITIONS:
+                    continue
+                date_field, new_status = TRANSITIONS[status]
+                when = _as_utc(data.get(date_field))
+                if not when or when > now:
+                    if when:
+                        self._push(snapshot.id, data)
+                    continue
+                updates.append((snapshot, data, new_status))
+            applied.extend(self._commit(updates))
+
+        for snapshot, data, new_status in applied:
+            data = dict(data, status=new_status)
+            if new_status == 'pasado':
+                self._run_close_handlers(snapshot.id, data)
+            else:
+                # Recién activado: agendar su cierre
+                self._push(snapshot.id, data)
+
+        return [(snapshot.id, new_status) for snapshot, _, new_status in applied]
+
+    def _update(self, writer, snapshot, new_status):
+        writer.update(snapshot.reference, {
+            'status': new_status,
+            'updatedAt': firestore.SERVER_TIMESTAMP
+        }, option=db.write_option(last_update_time=snapshot.update_time))
+
+    def _commit(self, updates):
+        if not updates:
+            return []
+        batch = db.batch()
+        for snapshot, _, new_status in updates:
+            self._update(batch, snapshot, new_status)
+        try:
+            batch.commit()
+            return updates
+        except FailedPrecondition:
+            pass
+
+        # Otro worker o un admin modificó alguno: aplicar uno por uno y omitir los que cambiaron
+        applied = []
+        for update in updates:
+            batch = db.batch()
+            self._update(batch, update[0], update[2])
+            try:
+                batch.commit()
+                applied.append(update)
+            except FailedPrecondition:
+                continue
+        return applied
+
+    def _run_close_handlers(self, challenge_id, data):
+        for handler in self._close_handlers:
+            try:
+                handler(challenge_id, data)
+            except Exception as e:
+                print(f"Error en cierre del reto {challenge_id} ({handler.__name__}): {str(e)}")
+
+    def run_once(self):
+        """Recarga y aplica lo vencido; pensado para un cron cuando no hay hilo de fondo"""
+        self.load()
+        transitions = []
+        # Un reto vencido por completo pasa de 'próximo' a 'activo' y luego a 'pasado'
+        while True:
+            applied = self.run_due()
+            if not applied:
+                return transitions
+            transitions.extend(applied)
+
+    def start(self):
+        if self.running:
+            return
+        self._thread = threading.Thread(target=self._loop, name='challenge-scheduler', daemon=True)
+        self._thread.start()
+
+    def _loop(self):
+        next_refresh = 0
+        while True:
+            self._wakeup.clear()
+            try:
+                if time.monotonic() >= next_refresh:
+                    self.load()
+                    next_refresh = time.monotonic() + self.refresh_seconds
+                self.run_due()
+            except Exception as e:
+                print(f"Error en el scheduler de retos: {str(e)}")
+
+            # Dormir hasta la próxima transición, la próxima recarga o un schedule() nuevo
+            with self._lock:
+                next_due = self._heap[0][0] if self._heap else None
+            timeout = max(next_refresh - time.monotonic(), 0)
+            if next_due:
+                timeout = min(timeout, max((next_due - datetime.now(timezone.utc)).total_seconds(), 0))
+            self._wakeup.wait(timeout)
+
+challenge_scheduler = ChallengeScheduler(
+    refresh_seconds=int(os.getenv('CHALLENGE_SCHEDULER_REFRESH_SECONDS', 300))
+)
@@ -0,0 +1,221 @@
+import heapq
+import math
+import os
+import re
+import threading
+import time
+from bisect import bisect_left, insort
+from collections import Counter
+from utils.firebase import db
+from utils.text import normalize
+
+# Parámetros estándar de BM25
+K1 = 1.2
+B = 0.75
+# El título pesa más que la descripción (cada aparición cuenta doble)
+TITLE_WEIGHT = 2
+MIN_PREFIX_LENGTH = 2
+MAX_PREFIX_EXPANSIONS = 50
+MAX_RESULTS = 50
+INDEX_TTL_SECONDS = int(os.getenv('CHALLENGE_INDEX_TTL_SECONDS', 600))
+# Espera antes de reintentar una recarga de fondo fallida (se sigue sirviendo el índice anterior)
+RELOAD_RETRY_SECONDS = 60
+STOPWORDS = {
+    'a', 'al', 'con', 'de', 'del', 'el', 'en', 'es', 'la', 'las', 'lo', 'los',
+    'o', 'para', 'por', 'que', 'se', 'su', 'un', 'una', 'y'
+}
+_TOKEN = re.compile(r"[a-z0-9]+")
+
+def tokenize(text):
+    """Términos sin acentos ni mayúsculas, sin stopwords"""
+    return [token for token in _TOKEN.findall(normalize(text)) if token not in STOPWORDS]
+
+class InvertedIndex:
+    """Índice invertido término -> {documento: frecuencia} con ranking BM25.
+
+    El vocabulario se mantiene ordenado para resolver prefijos con bisect: el último
+    término de la consulta (o cualquiera con MIN_PREFIX_LENGTH caracteres) también
+    encuentra palabras que empiezan por él, como en un autocompletado.
+    """
+
+    def __init__(self):
+        self._postings = {}
+        self._vocabulary = []
+        self._lengths = {}
+        self._meta = {}
+        self._total_length = 0
+
+    def __len__(self):
+        return len(self._lengths)
+
+    def add(self, doc_id, title, description, meta=None):
+        self.remove(doc_id)
+        frequencies = Counter()
+        for token in tokenize(title):
+            frequencies[token] += TITLE_WEIGHT
+        frequencies.update(tokenize(description))
+
+        for term, frequency in frequencies.items():
+            postings = self._postings.get(term)
+            if postings is None:
+                postings = self._postings[term] = {}
+                insort(self._vocabulary, term)
+            postings[doc_id] = frequency
+        length = sum(frequencies.values())
+        self._lengths[doc_id] = length
+        self._total_length += length
+        self._meta[doc_id] = (meta or {}, tuple(frequencies))
+
+    def remove(self, doc_id):
+        if doc_id not in self._lengths:
+            return
+        self._total_length -= self._lengths.pop(doc_id)
+        _, terms = self._meta.pop(doc_id)
+        for term in terms:
+            postings = self._postings[term]
+            postings.pop(doc_id, None)
+            if not postings:
+                del self._postings[term]
+                del self._vocabulary[bisect_left(self._vocabulary, term)]
+
+    def _expand(self, token):
+        """El término exacto más los del vocabulario que empiezan por token"""
+        terms = [token] if token in self._postings else []
+        if len(token) < MIN_PREFIX_LENGTH:
+            return terms
+        start = bisect_left(self._vocabulary, token)
+        for term in self._vocabulary[start:start + MAX_PREFIX_EXPANSIONS + 1]:
+            if not term.startswith(token):
+                break
+            if term != token:
+                terms.append(term)
+        return terms
+
+    def search(self, query, limit=MAX_RESULTS, predicate=None):
+        """Devuelve [(doc_id, score)] ordenado por relevancia"""
+        tokens = list(dict.fromkeys(tokenize(query)))
+        if not tokens or not self._lengths:
+            return []
+
+        total_docs = len(self._lengths)
+        average_length = self._total_length / total_docs or 1
+        scores = Counter()
+        for token in tokens:
+            # Cada término de la consulta aporta su mejor coincidencia (exacta o prefijo)
+            best = {}
+            for term in self._expand(token):
+                postings = self._postings[term]
+                idf = math.log(1 + (total_docs - len(postings) + 0.5) / (len(postings) + 0.5))
+                # Las coincidencias por prefijo valen algo menos que la palabra exacta
+                weight = 1.0 if term == token else 0.8
+                for doc_id, frequency in postings.items():
+                    norm = K1 * (1 - B + B * self._lengths[doc_id] / average_length)
+                    score = weight * idf * frequency * (K1 + 1) / (frequency + norm)
+                    if score > best.get(doc_id, 0):
+                        best[doc_id] = score
+            scores.update(best)
+
+        candidates = scores.items()
+        if predicate is not None:
+            candidates = [(doc_id, score) for doc_id, score in candidates if predicate(self._meta[doc_id][0])]
+        return heapq.nlargest(limit, candidates, key=lambda item: item[1])
+
+class ChallengeSearchIndex:
+    """Índice de búsqueda de retos de esta instancia; se reconstruye cada INDEX_TTL_SECONDS.
+
+    Igual que el índice de usernames: solo la primera carga bloquea. Después el índice
+    vigente se sigue sirviendo mientras uno nuevo se construye en un hilo de fondo, y se
+    reemplaza de una vez bajo el lock, aplicando los cambios llegados durante la carga.
+    """
+
+    def __init__(self):
+        self._index = InvertedIndex()
+        self._lock = threading.Lock()
+        # Solo una carga a la vez; la tiene tomada el hilo que reconstruye el índice
+        self._load_lock = threading.Lock()
+        self._loaded_at = None
+        self._next_reload_at = None
+        # (challenge_id, datos o None si se eliminó) recibidos durante una carga
+        self._pending = None
+
+    def _build(self):
+        index = InvertedIndex()
+        for doc in db.collection('challenges').select(['title', 'description', 'status']).stream():
+            data = doc.to_dict()
+            index.add(doc.id, data.get('title'), data.get('description'), {"status": data.get('status')})
+        return index
+
+    @staticmethod
+    def _write(index, challenge_id, data):
+        if data is None:
+            index.remove(challenge_id)
+        else:
+            index.add(challenge_id, data.get('title'), data.get('description'), {"status": data.get('status')})
+
+    def _reload(self):
+        with self._lock:
+            self._pending = []
+        try:
+            index = self._build()
+        except Exception:
+            with self._lock:
+                self._pending = None
+            raise
+        with self._lock:
+            for challenge_id, data in self._pending:
+                self._write(index, challenge_id, data)
+            self._index = index
+            self._pending = None
+            self._loaded_at = time.monotonic()
+            self._next_reload_at = self._loaded_at + INDEX_TTL_SECONDS
+
+    def _reload_in_background(self):
+        try:
+            self._reload()
+        except Exception as e:
+            # Sin esto cada búsqueda lanzaría otra recarga justo cuando Firestore falla
+            self._next_reload_at = time.monotonic() + RELOAD_RETRY_SECONDS
+            print(f"Error recargando el índice de retos: {str(e)}")
+        finally:
+            self._load_lock.release()
+
+    def _ensure_loaded(self):
+        if self._loaded_at is None:
+            # Primera carga: todavía no hay índice que servir, así que se espera
+            with self._load_lock:
+                if self._loaded_at is None:
+                    self._reload()
+            return
+        if time.monotonic() >= self._next_reload_at and self._load_lock.acquire(blocking=False):
+            threading.Thread(target=self._reload_in_background, name='challenge-search-index', daemon=True).start()
+
+    def start_background_load(self):
+        """Construye el índice al arrancar sin bloquear el inicio de la app"""
+        def load():
+            try:
+                self._ensure_loaded()
+            except Exception as e:
+                print(f"Error al construir el índice de retos: {str(e)}")
+        threading.Thread(target=load, name='challenge-search-index', daemon=True).start()
+
+    def index(self, challenge_id, data=None):
+        """Agrega o actualiza un reto tras crearlo o editarlo; sin costo si aún no se cargó"""
+        if self._loaded_at is None and self._pending is None:
+            return
+        if data is None:
+            snapshot = db.collection('challenges').document(challenge_id).get()
+            data = snapshot.to_dict() if snapshot.exists else None
+        with self._lock:
+            if self._pending is not None:
+                self._pending.append((challenge_id, data))
+            # Durante la primera carga el cambio solo queda pendiente
+            if self._loaded_at is not None:
+                self._write(self._index, challenge_id, data)
+
+    def search(self, query, limit=MAX_RESULTS, status=None):
+        self._ensure_loaded()
+        predicate = (lambda meta: meta.get('status') == status) if status else None
+        with self._lock:
+            return self._index.search(query, limit, predicate)
+
+challenge_index = ChallengeSearchIndex()
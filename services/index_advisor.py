@@ -0,0 +1,116 @@
+import json
+import os
+from utils.query_shapes import shape_registry, EQUALITY_OPERATORS, ARRAY_OPERATORS
+
+INDEXES_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'firestore.indexes.json')
+
+def _index_parts(shape):
+    """(campos de igualdad, resto de campos) del índice que necesita una forma de consulta.
+
+    Sigue las reglas de Firestore: primero los campos de igualdad, luego array-contains
+    y al final los campos de orden (las desigualdades sin order_by explícito se ordenan
+    implícitamente ascendente).
+    """
+    equality = []
+    array_field = None
+    inequality = []
+    for field, op in shape['filters']:
+        if op in EQUALITY_OPERATORS:
+            if field not in equality:
+                equality.append(field)
+        elif op in ARRAY_OPERATORS:
+            array_field = field
+        elif field not in inequality:
+            inequality.append(field)
+
+    rest = [(array_field, 'CONTAINS')] if array_field else []
+    ordered_fields = {field for field, _ in shape['orderBy']}
+    for field in inequality:
+        if field not in ordered_fields:
+            rest.append((field, 'ASCENDING'))
+    previous = None
+    for field, direction in shape['orderBy']:
+        # __name__ en la misma dirección que el orden anterior ya está en todo índice
+        if field == '__name__' and direction == (previous or 'ASCENDING'):
+            continue
+        previous = direction
+        if field not in equality:
+            rest.append((field, direction))
+    return sorted(equality), rest
+
+def index_for_shape(shape):
+    """Índice compuesto que necesita una forma de consulta, o None si bastan los simples.
+
+    Las consultas solo de igualdad se resuelven combinando índices simples, así que
+    no generan sugerencia.
+    """
+    equality, rest = _index_parts(shape)
+    if not any(direction != 'CONTAINS' for _, direction in rest) or len(equality) + len(rest) < 2:
+        return None
+    fields = [{"fieldPath": field, "order": "ASCENDING"} for field in equality]
+    for field, direction in rest:
+        if direction == 'CONTAINS':
+            fields.append({"fieldPath": field, "arrayConfig": "CONTAINS"})
+        else:
+            fields.append({"fieldPath": field, "order": direction})
+    return {
+        "collectionGroup": shape['collection'],
+        "queryScope": "COLLECTION_GROUP" if shape['allDescendants'] else "COLLECTION",
+        "fields": fields
+    }
+
+def _field_key(field):
+    return (field['fieldPath'], field.get('order') or field.get('arrayConfig'))
+
+def _index_keys(index):
+    """Claves con las que un índice existente cubre consultas.
+
+    Los campos de igualdad pueden ir en cualquier orden, así que por cada prefijo
+    ascendente se genera la clave (conjunto de igualdades, resto en orden).
+    """
+    fields = [_field_key(field) for field in index['fields'] if field['fieldPath'] != '__name__']
+    scope = (index['collectionGroup'], index.get('queryScope', 'COLLECTION'))
+    keys = set()
+    for split in range(len(fields) + 1):
+        if split and fields[split - 1][1] != 'ASCENDING':
+            break
+        keys.add(scope + (frozenset(field for field, _ in fields[:split]), tuple(fields[split:])))
+    return keys
+
+def _shape_key(shape, index):
+    equality, rest = _index_parts(shape)
+    return (index['collectionGroup'], index['queryScope'], frozenset(equality), tuple(rest))
+
+def load_indexes(path=INDEXES_FILE):
+    if not os.path.exists(path):
+        return {"indexes": [], "fieldOverrides": []}
+    with open(path, encoding='utf-8') as indexes_file:
+        return json.load(indexes_file)
+
+def advise_indexes(path=INDEXES_FILE):
+    """Compara las consultas observadas con firestore.indexes.json.
+
+    Devuelve las sugerencias que faltan (con la consulta que las origina) y el
+    archivo completo resultante de agregarlas, listo para `firebase deploy --only firestore:indexes`.
+    """
+    config = load_indexes(path)
+    known = set()
+    for index in config.get('indexes', []):
+        known |= _index_keys(index)
+
+    missing = []
+    for entry in shape_registry.shapes():
+        index = index_for_shape(entry['shape'])
+        if index is None:
+            continue
+        key = _shape_key(entry['shape'], index)
+        if key in known:
+            continue
+        known.add(key)
+        missing.append({"query": entry['query'], "endpoints": entry['endpoints'],
+                        "missingIndex": entry['missingIndex'], "index": index})
+
+    generated = dict(config)
+    generated['indexes'] = list(config.get('indexes', [])) + [item['index'] for item in missing]
+    generated.setdefault('fieldOverrides', [])
+    return {"missing": missing, "indexesFile": generated}
@@ -0,0 +1,175 @@
+import bisect
+import threading
+from datetime import datetime, timezone
+from utils.firebase import db
+from utils.sse import Subscription
+
+# Mensaje de control: el reto dejó de estar activo y el stream debe terminar
+STREAM_ENDED = object()
+
+# Sin fecha de envío se ordena después de cualquier envío con el mismo puntaje
+_NO_DATE = datetime.max.replace(tzinfo=timezone.utc)
+
+def _sort_key(participation_id, data):
+    submission_date = data.get('submissionDate') or _NO_DATE
+    return (-data['score'], submission_date, participation_id)
+
+def _is_ranked(data):
+    return data.get('paymentStatus') == 'confirmed' and data.get('score') is not None
+
+class LiveRanking:
+    """Ranking en memoria de un reto alimentado por un único listener de participaciones.
+
+    Mantiene una lista ordenada (bisect) por puntaje descendente y fecha de envío,
+    y publica a los suscriptores solo las filas cuyo puesto o datos cambiaron.
+    """
+
+    def __init__(self, challenge_id):
+        self.challenge_id = challenge_id
+        self._lock = threading.Lock()
+        self._ready = threading.Event()
+        self._entries = {}
+        self._order = []
+        self._usernames = {}
+        self._subscribers = set()
+        self._watch = None
+        self._challenge_watch = None
+        self.version = 0
+        # Estado con el que terminó el reto (None mientras siga activo)
+        self.ended_status = None
+
+    def start(self):
+        query = db.collection('participations').where('challengeId', '==', self.challenge_id)
+        self._watch = query.on_snapshot(self._on_snapshot)
+        challenge_ref = db.collection('challenges').document(self.challenge_id)
+        self._challenge_watch = challenge_ref.on_snapshot(self._on_challenge_snapshot)
+
+    def stop(self):
+        for watch in (self._watch, self._challenge_watch):
+            if watch is None:
+                continue
+            try:
+                watch.unsubscribe()
+            except Exception as e:
+                print(f"Error cerrando listener del ranking {self.challenge_id}: {str(e)}")
+        self._watch = None
+        self._challenge_watch = None
+
+    def add_subscriber(self, subscription):
+        with self._lock:
+            self._subscribers.add(subscription)
+
+    def remove_subscriber(self, subscription):
+        with self._lock:
+            self._subscribers.discard(subscription)
+            return len(self._subscribers)
+
+    def wait_ready(self, timeout):
+        return self._ready.wait(timeout)
+
+    def snapshot(self):
+        with self._lock:
+            return self.version, [self._row(key[2], rank) for rank, key in enumerate(self._order, start=1)]
+
+    def _row(self, participation_id, rank):
+        data = self._entries[participation_id]
+        submission_date = data.get('submissionDate')
+        return {
+            "id": participation_id,
+            "userId": data.get('userId'),
+            "username": self._usernames.get(data.get('userId')),
+            "aceptaelretoUsername": data.get('aceptaelretoUsername'),
+            "score": data.get('score'),
+            "submissionDate": submission_date.isoformat() if submission_date else None,
+            "rank": rank
+        }
+
+    def _on_challenge_snapshot(self, docs, changes, read_time):
+        challenge = docs[0] if docs else None
+        status = challenge.to_dict().get('status') if challenge is not None and challenge.exists else 'eliminado'
+        if status == 'activo':
+            return
+        with self._lock:
+            if self.ended_status is not None:
+                return
+            self.ended_status = status
+            subscribers = list(self._subscribers)
+        for subscription in subscribers:
+            subscription.publish(STREAM_ENDED)
+
+    def _load_usernames(self, user_ids):
+        missing = [user_id for user_id in user_ids if user_id and user_id not in self._usernames]
+        if not missing:
+            return
+        refs = [db.collection('users').document(user_id) for user_id in missing]
+        for user in db.get_all(refs):
+            self._usernames[user.id] = user.to_dict().get('username') if user.exists else None
+
+    def _on_snapshot(self, docs, changes, read_time):
+        # Una sola lectura de usuarios por lote de cambios, fuera del lock
+        self._load_usernames({change.document.to_dict().get('userId') for change in changes})
+
+        with self._lock:
+            previous_ranks = {key[2]: rank for rank, key in enumerate(self._order, start=1)}
+            touched = set()
+
+            for change in changes:
+                participation_id = change.document.id
+                old = self._entries.pop(participation_id, None)
+                if old is not None:
+                    index = bisect.bisect_left(self._order, _sort_key(participation_id, old))
+                    del self._order[index]
+
+                data = change.document.to_dict()
+                if change.type.name != 'REMOVED' and _is_ranked(data):
+                    self._entries[participation_id] = data
+                    bisect.insort(self._order, _sort_key(participation_id, data))
+                touched.add(participation_id)
+
+            updated = []
+            for rank, key in enumerate(self._order, start=1):
+                participation_id = key[2]
+                if participation_id in touched or previous_ranks.get(participation_id) != rank:
+                    row = self._row(participation_id, rank)
+                    row['previousRank'] = previous_ranks.get(participation_id)
+                    updated.append(row)
+            removed = [pid for pid in touched if pid in previous_ranks and pid not in self._entries]
+
+            first_snapshot = not self._ready.is_set()
+            self._ready.set()
+            if first_snapshot or not (updated or removed):
+                return
+
+            self.version += 1
+            delta = {"version": self.version, "updated": updated, "removed": removed}
+            subscribers = list(self._subscribers)
+
+        for subscription in subscribers:
+            subscription.publish(delta)
+
+class LeaderboardHub:
+    """Un LiveRanking por reto con suscriptores; se libera con el último suscriptor"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._rankings = {}
+
+    def subscribe(self, challenge_id):
+        subscription = Subscription(challenge_id)
+        with self._lock:
+            ranking = self._rankings.get(challenge_id)
+            if ranking is None:
+                ranking = LiveRanking(challenge_id)
+                self._rankings[challenge_id] = ranking
+                ranking.start()
+            ranking.add_subscriber(subscription)
+        return ranking, subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            ranking = self._rankings.get(subscription.key)
+            if ranking is not None and ranking.remove_subscriber(subscription) == 0:
+                ranking.stop()
+                del self._rankings[subscription.key]
+
+leaderboard_hub = LeaderboardHub()
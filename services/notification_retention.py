@@ -0,0 +1,195 @@
+import os
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+from firebase_admin import firestore
+from utils.firebase import db
+from utils.batch import chunks, MAX_BATCH_WRITES
+from services.notification_service import adjust_unread_count
+
+# Días que se conserva cada tipo de notificación (None = nunca expira).
+# Los tipos que no aparecen aquí no se eliminan.
+DEFAULT_TTL_DAYS = {
+    'challenge_result': 30,
+    'participation': 60,
+    'admin': 90,
+    'payment': 180,
+    'challenge_win': 365,
+    'digest': None
+}
+
+# Cada documento puede requerir además la escritura del contador de su usuario
+RETENTION_CHUNK_SIZE = MAX_BATCH_WRITES // 2
+STATE_DOCUMENT = ('maintenance', 'notificationRetention')
+
+def get_ttl_config():
+    """TTL por tipo, sobrescribible con NOTIFICATION_TTL_DAYS="payment=120,admin=30" """
+    ttl = dict(DEFAULT_TTL_DAYS)
+    overrides = os.getenv('NOTIFICATION_TTL_DAYS', '')
+    for item in overrides.split(','):
+        if '=' not in item:
+            continue
+        notification_type, days = item.split('=', 1)
+        days = days.strip().lower()
+        ttl[notification_type.strip()] = None if days in ('', 'none', 'never') else int(days)
+    return ttl
+
+def _state_ref():
+    return db.collection(STATE_DOCUMENT[0]).document(STATE_DOCUMENT[1])
+
+def _throttle(started, writes, max_writes_per_second):
+    # Limita el ritmo de escritura para no competir con el tráfico normal
+    if not max_writes_per_second:
+        return
+    expected = writes / max_writes_per_second
+    elapsed = time.monotonic() - started
+    if expected > elapsed:
+        time.sleep(expected - elapsed)
+
+def prune_expired_notifications(max_deletes=5000, max_writes_per_second=500, ttl_config=None):
+    """Elimina notificaciones expiradas por tipo en lotes.
+
+    El trabajo es reanudable: cada lote se confirma por separado, así que si se
+    interrumpe o agota max_deletes la siguiente ejecución continúa con las más
+    antiguas que queden. El progreso se registra en maintenance/notificationRetention.
+    """
+    ttl_config = ttl_config or get_ttl_config()
+    started = time.monotonic()
+    now = datetime.utcnow()
+    deleted_by_type = Counter()
+    total_deleted = 0
+    writes = 0
+    completed = True
+
+    for notification_type, days in ttl_config.items():
+        if days is None:
+            continue
+        remaining = max_deletes - total_deleted
+        if remaining <= 0:
+            completed = False
+            break
+
+        cutoff = now - timedelta(days=days)
+        query = db.collection('notifications') \
+            .where('type', '==', notification_type) \
+            .where('createdAt', '<', cutoff) \
+            .order_by('createdAt') \
+            .limit(remaining)
+
+        for chunk in chunks(query.stream(), RETENTION_CHUNK_SIZE):
+            batch = db.batch()
+            unread_by_user = Counter()
+            for snap in chunk:
+                batch.delete(snap.reference)
+                data = snap.to_dict()
+                if not data.get('isRead') and data.get('userId'):
+                    unread_by_user[data['userId']] += 1
+            for user_id, unread in unread_by_user.items():
+                adjust_unread_count(batch, user_id, -unread)
+            batch.commit()
+
+            writes += len(chunk) + len(unread_by_user)
+            deleted_by_type[notification_type] += len(chunk)
+            total_deleted += len(chunk)
+            _throttle(started, writes, max_writes_per_second)
+
+        if total_deleted >= max_deletes:
+            completed = False
+            break
+
+    result = {
+        "deleted": total_deleted,
+        "deletedByType": dict(deleted_by_type),
+        "completed": completed,
+        "durationSeconds": round(time.monotonic() - started, 2)
+    }
+    _state_ref().set({
+        "lastPrune": result,
+        "lastPruneAt": firestore.SERVER_TIMESTAMP,
+        "totalDeleted": firestore.Increment(total_deleted)
+    }, merge=True)
+    return result
+
+def compact_read_notifications(older_than_days=14, max_notifications=5000, max_writes_per_second=500):
+    """Agrupa las notificaciones leídas antiguas en un resumen por usuario.
+
+    Cada usuario tiene un único documento notifications/digest_{userId} de tipo
+    'digest' con el conteo por tipo de lo archivado; los originales se eliminan.
+    """
+    started = time.monotonic()
+    cutoff = datetime.utcnow() - timedelta(days=older_than_days)
+    compacted = 0
+    users = set()
+    writes = 0
+
+    query = db.collection('notifications') \
+        .where('isRead', '==', True) \
+        .where('createdAt', '<', cutoff) \
+        .order_by('createdAt')
+
+    # Los resúmenes también están leídos y tienen createdAt antiguo, así que la consulta
+    # los devuelve primero: se pagina con start_after para avanzar más allá de ellos
+    last = None
+    while compacted < max_notifications:
+        page_query = query.start_after(last) if last is not None else query
+        page = list(page_query.limit(min(RETENTION_CHUNK_SIZE, max_notifications - compacted)).stream())
+        if not page:
+            break
+        last = page[-1]
+
+        batch = db.batch()
+        counts_by_user = {}
+        for snap in page:
+            data = snap.to_dict()
+            if data.get('type') == 'digest' or not data.get('userId'):
+                continue
+            counts_by_user.setdefault(data['userId'], Counter())[data.get('type') or 'other'] += 1
+            batch.delete(snap.reference)
+        if not counts_by_user:
+            continue
+
+        for user_id, counts in counts_by_user.items():
+            total = sum(counts.values())
+            summary = {notification_type: firestore.Increment(count) for notification_type, count in counts.items()}
+            batch.set(db.collection('notifications').document(f"digest_{user_id}"), {
+                "userId": user_id,
+                "title": "Notificaciones archivadas",
+                "message": "Resumen de tus notificaciones antiguas ya leídas",
+                "type": "digest",
+                "isRead": True,
+                "createdAt": cutoff,
+                "readAt": firestore.SERVER_TIMESTAMP,
+                "total": firestore.Increment(total),
+                "summary": summary
+            }, merge=True)
+            compacted += total
+            users.add(user_id)
+
+        batch.commit()
+        writes += sum(sum(counts.values()) for counts in counts_by_user.values()) + len(counts_by_user)
+        _throttle(started, writes, max_writes_per_second)
+
+    result = {
+        "compacted": compacted,
+        "users": len(users),
+        "durationSeconds": round(time.monotonic() - started, 2)
+    }
+    _state_ref().set({
+        "lastCompaction": result,
+        "lastCompactionAt": firestore.SERVER_TIMESTAMP
+    }, merge=True)
+    return result
+
+def run_retention(max_deletes=5000, max_writes_per_second=500, compact=False, compact_after_days=14):
+    result = {"prune": prune_expired_notifications(max_deletes, max_writes_per_second)}
+    if compact:
+        result["compaction"] = compact_read_notifications(compact_after_days, max_deletes, max_writes_per_second)
+    return result
+
+if __name__ == '__main__':
+    # Uso desde un cron: python -m services.notification_retention
+    print(run_retention(
+        max_deletes=int(os.getenv('NOTIFICATION_RETENTION_MAX_DELETES', 5000)),
+        max_writes_per_second=int(os.getenv('NOTIFICATION_RETENTION_WRITES_PER_SECOND', 500)),
+        compact=os.getenv('NOTIFICATION_RETENTION_COMPACT', 'false').lower() == 'true'
+    ))
@@ -1,10 +1,75 @@
+import asyncio
 from models.Notification import Notification
 from utils.firebase import db
+from firebase_admin import firestore
+from utils.batch import chunks, MAX_BATCH_WRITES
+from utils.firestore_async import get_async_db, run_async
+
+# Contador de no leídas por usuario: notificationCounters/{userId} -> {"unread": n}
+COUNTERS_COLLECTION = 'notificationCounters'
+# Batches de notificaciones confirmándose a la vez en send_notifications_async
+MAX_CONCURRENT_COMMITS = 4
+
+def _counter_ref(user_id):
+    return db.collection(COUNTERS_COLLECTION).document(user_id)
+
+def queue_notification(writer, user_id, title, message, notification_type):
+    """Agrega la notificación y el incremento del contador a un batch o transacción"""
+    notification = Notification(user_id, title, message, notification_type)
+    doc_ref = db.collection('notifications').document()
+    writer.set(doc_ref, notification.to_dict())
+    adjust_unread_count(writer, user_id, 1)
+    return doc_ref
+
+def adjust_unread_count(writer, user_id, delta):
+    """Suma delta al contador de no leídas del usuario dentro de writer"""
+    if not delta:
+        return
+    writer.set(_counter_ref(user_id), {
+        "unread": firestore.Increment(delta),
+        "updatedAt": firestore.SERVER_TIMESTAMP
+    }, merge=True)
+
+@firestore.transactional
+def _seed_unread_count(transaction, user_id):
+    """Inicializa el contador con una agregación dentro de una transacción.
+
+    Toda notificación nueva escribe también el documento del contador, así que leerlo
+    en la transacción la serializa con el conteo: ningún Increment se pierde al sembrar.
+    """
+    counter = _counter_ref(user_id).get(transaction=transaction)
+    if counter.exists:
+        counter_data = counter.to_dict()
+        if counter_data.get('seeded'):
+            return max(int(counter_data.get('unread', 0)), 0)
+
+    total = db.collection('notifications') \
+        .where('userId', '==', user_id) \
+        .where('isRead', '==', False) \
+        .count().get(transaction=transaction)[0][0].value
+
+    transaction.set(_counter_ref(user_id), {
+        "unread": total,
+        "seeded": True,
+        "updatedAt": firestore.SERVER_TIMESTAMP
+    }, merge=True)
+    return total
+
+def get_unread_count(user_id):
+    counter = _counter_ref(user_id).get()
+    if counter.exists:
+        counter_data = counter.to_dict()
+        if counter_data.get('seeded'):
+            return max(int(counter_data.get('unread', 0)), 0)
+
+    # Primer acceso: inicializar el contador (una sola vez por usuario)
+    return _seed_unread_count(db.transaction(), user_id)
 
 def send_notification(user_id, title, message, notification_type):
     try:
-        notification = Notification(user_id, title, message, notification_type)
-        _, doc_ref = db.collection('notifications').add(notification.to_dict())
+        batch = db.batch()
+        doc_ref = queue_notification(batch, user_id, title, message, notification_type)
+        batch.commit()
         return doc_ref.id
     except Exception as e:
         print(f"Error sending notification: {str(e)}")
@@ -14,11 +79,42 @@ def send_admin_notification(title, message):
     try:
         # Obtener todos los administradores
         admins = db.collection('users').where('role', '==', 'admin').stream()
-        
-        for admin in admins:
-            send_notification(admin.id, title, message, 'admin')
-            
+
+        # Dos escrituras por administrador: batches de hasta 250
+        for chunk in chunks(admins, MAX_BATCH_WRITES // 2):
+            batch = db.batch()
+            for admin in chunk:
+                queue_notification(batch, admin.id, title, message, 'admin')
+            batch.commit()
+
         return True
     except Exception as e:
         print(f"Error sending admin notifications: {str(e)}")
-        return False
\ No newline at end of file
+        return False
+
+async def send_notifications_async(notifications):
+    """Envía varias notificaciones (user_id, title, message, notification_type) con el AsyncClient.
+
+    Cada notificación son dos escrituras (documento y contador), así que se arman batches
+    de hasta 250, con a lo sumo MAX_CONCURRENT_COMMITS confirmándose a la vez. Un batch
+    fallido no detiene los demás: se registra cuáles fallaron y se devuelve False.
+    """
+    async_db = get_async_db()
+    semaphore = asyncio.Semaphore(MAX_CONCURRENT_COMMITS)
+
+    async def commit(chunk):
+        batch = async_db.batch()
+        for user_id, title, message, notification_type in chunk:
+            # Las referencias de queue_notification solo aportan la ruta del documento
+            queue_notification(batch, user_id, title, message, notification_type)
+        async with semaphore:
+            await run_async(batch.commit())
+
+    batches = list(chunks(notifications, MAX_BATCH_WRITES // 2))
+    results = await asyncio.gather(*(commit(chunk) for chunk in batches), return_exceptions=True)
+
+    failed = [(index, error) for index, error in enumerate(results) if isinstance(error, Exception)]
+    for index, error in failed:
+        print(f"Error sending notifications (batch {index + 1}/{len(batches)}, "
+              f"{len(batches[index])} usuarios): {str(error)}")
+    return not failed
@@ -0,0 +1,119 @@
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+from utils.firebase import db
+from utils.sse import Subscription
+
+# El Watch guarda en memoria todo documento que coincide con la consulta, así que el
+# listener se reabre cada cierto tiempo con un inicio más reciente
+LISTENER_ROTATE_SECONDS = int(os.getenv('NOTIFICATION_LISTENER_ROTATE_SECONDS', 600))
+# Solape entre el listener viejo y el nuevo para no perder notificaciones en tránsito
+ROTATE_OVERLAP_SECONDS = 30
+
+def serialize_notification(notification_id, data):
+    data = dict(data)
+    if data.get('createdAt'):
+        data['createdAt'] = data['createdAt'].isoformat()
+    if data.get('readAt'):
+        data['readAt'] = data['readAt'].isoformat()
+    data['id'] = notification_id
+    return data
+
+class NotificationBroker:
+    """Un único listener on_snapshot por worker que reparte notificaciones por userId.
+
+    El listener se abre con el primer suscriptor y se cierra con el último, así
+    el costo de lectura no depende del número de pestañas abiertas.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers = {}
+        self._watch = None
+        self._timer = None
+        # id -> momento de publicación, para no repetir las del solape al rotar
+        self._published = {}
+
+    def subscribe(self, user_id):
+        subscription = Subscription(user_id)
+        inactive = None
+        with self._lock:
+            self._subscribers.setdefault(user_id, set()).add(subscription)
+            if self._watch is not None and not getattr(self._watch, 'is_active', True):
+                inactive = self._watch
+                self._watch = None
+            if self._watch is None:
+                self._start_listener()
+        if inactive is not None:
+            self._close_watch(inactive)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        watch = None
+        with self._lock:
+            subscriptions = self._subscribers.get(subscription.key)
+            if subscriptions:
+                subscriptions.discard(subscription)
+                if not subscriptions:
+                    del self._subscribers[subscription.key]
+            if not self._subscribers:
+                watch = self._stop_listener()
+        # Fuera del lock: unsubscribe() espera al hilo del listener, y su callback lo toma
+        if watch is not None:
+            self._close_watch(watch)
+
+    def _cancel_timer(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+    def _start_listener(self, since=None):
+        # Solo las notificaciones creadas desde ahora; lo anterior se recupera con Last-Event-ID
+        query = db.collection('notifications').where('createdAt', '>=', since or datetime.utcnow())
+        self._watch = query.on_snapshot(self._on_snapshot)
+        # Un solo temporizador de rotación por listener
+        self._cancel_timer()
+        self._timer = threading.Timer(LISTENER_ROTATE_SECONDS, self._rotate_listener)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _rotate_listener(self):
+        with self._lock:
+            if self._watch is None:
+                return
+            previous = self._watch
+            self._start_listener(datetime.utcnow() - timedelta(seconds=ROTATE_OVERLAP_SECONDS))
+            cutoff = time.monotonic() - 2 * ROTATE_OVERLAP_SECONDS
+            self._published = {key: at for key, at in self._published.items() if at >= cutoff}
+        # Fuera del lock: el callback del listener viejo también lo toma
+        self._close_watch(previous)
+
+    def _stop_listener(self):
+        """Desactiva el listener (con el lock tomado) y devuelve el Watch para cerrarlo fuera"""
+        self._cancel_timer()
+        self._published = {}
+        watch, self._watch = self._watch, None
+        return watch
+
+    def _close_watch(self, watch):
+        try:
+            watch.unsubscribe()
+        except Exception as e:
+            print(f"Error cerrando listener de notificaciones: {str(e)}")
+
+    def _on_snapshot(self, docs, changes, read_time):
+        for change in changes:
+            if change.type.name != 'ADDED':
+                continue
+            data = change.document.to_dict()
+            with self._lock:
+                subscriptions = list(self._subscribers.get(data.get('userId'), ()))
+                if not subscriptions or change.document.id in self._published:
+                    continue
+                self._published[change.document.id] = time.monotonic()
+            item = serialize_notification(change.document.id, data)
+            for subscription in subscriptions:
+                subscription.publish(item)
+
+notification_broker = NotificationBroker()
@@ -0,0 +1,104 @@
+import os
+from models.Participation import Participation
+from utils.firebase import db
+from utils.batch import chunks
+from utils.firestore_async import query_async
+
+# Cada migración escribe el documento nuevo y borra el antiguo
+MIGRATION_CHUNK_SIZE = 200
+MAX_REPORTED_DUPLICATES = 100
+
+# Mientras queden participaciones con ID aleatorio se buscan también por consulta.
+# Poner PARTICIPATION_LEGACY_FALLBACK=false una vez confirmada la migración.
+LEGACY_FALLBACK = os.getenv('PARTICIPATION_LEGACY_FALLBACK', 'true').lower() != 'false'
+
+def _legacy_query(client, challenge_id, user_id):
+    return client.collection('participations') \
+        .where('challengeId', '==', challenge_id) \
+        .where('userId', '==', user_id) \
+        .limit(1)
+
+def find_legacy_participation(challenge_id, user_id):
+    """Participación del usuario en el reto guardada con ID aleatorio (o None)"""
+    if not LEGACY_FALLBACK:
+        return None
+    return next(_legacy_query(db, challenge_id, user_id).stream(), None)
+
+async def find_legacy_participation_async(async_db, challenge_id, user_id):
+    """Igual que find_legacy_participation con el AsyncClient"""
+    if not LEGACY_FALLBACK:
+        return None
+    docs = await query_async(_legacy_query(async_db, challenge_id, user_id))
+    return docs[0] if docs else None
+
+def _priority(data):
+    # Ante duplicados se conserva la participación más avanzada
+    return (
+        data.get('paymentStatus') == 'confirmed',
+        data.get('score') is not None,
+        bool(data.get('isPaid'))
+    )
+
+def migrate_participation_ids(dry_run=False):
+    """Renombra las participaciones con ID aleatorio a {challengeId}_{userId}.
+
+    Primero se recorre la colección con una proyección ligera para agrupar por
+    usuario y reto; después, por bloques, se copia cada documento a su ID
+    determinista (create) y se elimina el original en el mismo batch. Si ya existe
+    el documento destino o hay varias participaciones del mismo usuario en el mismo
+    reto, los sobrantes no se tocan y se reportan para revisión manual.
+    """
+    legacy = {}
+    scanned = 0
+    fields = ['challengeId', 'userId', 'paymentStatus', 'score', 'isPaid']
+    for doc in db.collection('participations').select(fields).stream():
+        scanned += 1
+        data = doc.to_dict()
+        if not data.get('challengeId') or not data.get('userId'):
+            continue
+        target_id = Participation.document_id(data['challengeId'], data['userId'])
+        if doc.id == target_id:
+            continue
+        legacy.setdefault(target_id, []).append((_priority(data), doc.id))
+
+    migrated = 0
+    duplicates = []
+    for chunk in chunks(legacy.items(), MIGRATION_CHUNK_SIZE):
+        target_refs = [db.collection('participations').document(target_id) for target_id, _ in chunk]
+        existing_targets = {snap.id for snap in db.get_all(target_refs) if snap.exists}
+
+        to_copy = []
+        for target_id, candidates in chunk:
+            candidates.sort(reverse=True)
+            ids = [doc_id for _, doc_id in candidates]
+            if target_id in existing_targets:
+                duplicates.append({"keep": target_id, "duplicates": ids})
+                continue
+            to_copy.append((target_id, ids[0]))
+            if len(ids) > 1:
+                duplicates.append({"keep": ids[0], "migratedTo": target_id, "duplicates": ids[1:]})
+
+        if dry_run or not to_copy:
+            migrated += len(to_copy)
+            continue
+
+        source_refs = [db.collection('participations').document(source_id) for _, source_id in to_copy]
+        sources = {snap.id: snap for snap in db.get_all(source_refs)}
+
+        batch = db.batch()
+        for target_id, source_id in to_copy:
+            source = sources.get(source_id)
+            if source is None or not source.exists:
+                continue
+            batch.create(db.collection('participations').document(target_id), source.to_dict())
+            batch.delete(source.reference)
+            migrated += 1
+        batch.commit()
+
+    return {
+        "dryRun": dry_run,
+        "scanned": scanned,
+        "migrated": migrated,
+        "duplicatesFound": len(duplicates),
+        "duplicates": duplicates[:MAX_REPORTED_DUPLICATES]
+    }
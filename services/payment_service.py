@@ -0,0 +1,81 @@
+from firebase_admin import firestore
+from google.api_core.exceptions import FailedPrecondition
+from utils.firebase import db
+from utils.exceptions import ByteBattleError, NotFoundError
+from services.notification_service import queue_notification
+
+MAX_CONFIRM_ATTEMPTS = 3
+
+def confirm_participation_payment(participation_id):
+    """Confirma el pago de una participación en un único commit.
+
+    Participación, premio del reto, contador del usuario y notificación se escriben
+    en el mismo batch. La actualización de la participación exige que el documento
+    no haya cambiado desde que se leyó (last_update_time): si otro admin o un
+    reintento la confirmó antes, el commit falla, se vuelve a leer y la operación
+    termina como no-op. Así el premio nunca se incrementa dos veces.
+    """
+    participation_ref = db.collection('participations').document(participation_id)
+
+    for _ in range(MAX_CONFIRM_ATTEMPTS):
+        participation = participation_ref.get()
+        if not participation.exists:
+            raise NotFoundError("Participación no encontrada")
+
+        participation_data = participation.to_dict()
+        user_id = participation_data.get('userId')
+        challenge_ref = db.collection('challenges').document(participation_data.get('challengeId'))
+        challenge = challenge_ref.get()
+        if not challenge.exists:
+            raise NotFoundError("Reto no encontrado")
+
+        challenge_data = challenge.to_dict()
+        total_pot = challenge_data.get('totalPot', 0)
+
+        if participation_data.get('paymentStatus') == 'confirmed':
+            return {
+                "alreadyConfirmed": True,
+                "participationId": participation_id,
+                "userId": user_id,
+                "newTotalPot": total_pot
+            }
+
+        participation_cost = challenge_data.get('participationCost', 0)
+        challenge_title = challenge_data.get('title', 'el reto')
+
+        batch = db.batch()
+        batch.update(participation_ref, {
+            "isPaid": True,
+            "paymentStatus": "confirmed",
+            "paymentConfirmationDate": firestore.SERVER_TIMESTAMP
+        }, option=db.write_option(last_update_time=participation.update_time))
+        batch.update(challenge_ref, {
+            "totalPot": firestore.Increment(participation_cost),
+            "updatedAt": firestore.SERVER_TIMESTAMP
+        })
+        batch.update(db.collection('users').document(user_id), {
+            "totalParticipations": firestore.Increment(1),
+            "updatedAt": firestore.SERVER_TIMESTAMP
+        })
+        queue_notification(
+            batch,
+            user_id,
+            "Pago confirmado",
+            f"Tu pago para {challenge_title} ha sido confirmado. ¡Ya puedes enviar tus resultados!",
+            "payment"
+        )
+
+        try:
+            batch.commit()
+        except FailedPrecondition:
+            # La participación cambió entre la lectura y el commit: reevaluar
+            continue
+
+        return {
+            "alreadyConfirmed": False,
+            "participationId": participation_id,
+            "userId": user_id,
+            "newTotalPot": total_pot + participation_cost
+        }
+
+    raise ByteBattleError("La participación está siendo modificada, intenta de nuevo", 409)
@@ -0,0 +1,182 @@
+import heapq
+from datetime import datetime, timezone
+from firebase_admin import firestore
+from google.api_core.exceptions import FailedPrecondition
+from utils.firebase import db
+from utils.batch import BatchWriter
+from services.notification_service import queue_notification
+
+PAGE_SIZE = 500
+DEFAULT_TOP_K = 3
+
+def _timestamp(value):
+    if not isinstance(value, datetime):
+        return float('inf')
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.timestamp()
+
+class TopK:
+    """Heap acotado con los k mejores por puntaje; a igual puntaje gana el envío más antiguo"""
+
+    def __init__(self, k):
+        self.k = k
+        self._heap = []
+        self._seen = 0
+
+    def push(self, score, submission_date, participation_id, user_id):
+        # Mayor tupla = mejor resultado; el heap mínimo deja el peor en la raíz
+        self._seen += 1
+        item = (score, -_timestamp(submission_date), -self._seen, participation_id, user_id)
+        if len(self._heap) < self.k:
+            heapq.heappush(self._heap, item)
+        elif item > self._heap[0]:
+            heapq.heapreplace(self._heap, item)
+
+    def ranked(self):
+        return [
+            {"participationId": item[3], "userId": item[4], "score": item[0]}
+            for item in sorted(self._heap, reverse=True)
+        ]
+
+def _confirmed_participations(challenge_id):
+    """Participaciones confirmadas por páginas, ya en orden de clasificación"""
+    query = db.collection('participations') \
+        .where('challengeId', '==', challenge_id) \
+        .where('paymentStatus', '==', 'confirmed') \
+        .order_by('score', direction=firestore.Query.DESCENDING) \
+        .order_by('submissionDate') \
+        .select(['userId', 'score', 'submissionDate'])
+
+    last = None
+    while True:
+        page_query = query.start_after(last) if last else query
+        page = list(page_query.limit(PAGE_SIZE).stream())
+        yield from page
+        if len(page) < PAGE_SIZE:
+            return
+        last = page[-1]
+
+def compute_challenge_results(challenge_id, top_k=DEFAULT_TOP_K, force=False):
+    """Calcula ganador, podio, puestos y premio de un reto en una sola pasada.
+
+    Recorre las participaciones confirmadas por páginas (memoria constante), asigna
+    el puesto de cada una (empates con igual puntaje y fecha comparten puesto), mantiene
+    el podio en un heap acotado de top_k, cuenta participantes para el premio y guarda
+    los puestos en batches de 500. Al final, en un único batch condicionado a que el
+    reto no haya cambiado, registra ganador, podio y premio, y actualiza las
+    estadísticas del ganador (con force, las del ganador anterior se revierten en el
+    mismo batch).
+    """
+    challenge_ref = db.collection('challenges').document(challenge_id)
+    challenge = challenge_ref.get()
+    if not challenge.exists:
+        return {"error": "Reto no encontrado"}
+
+    challenge_data = challenge.to_dict()
+    if challenge_data.get('winnerUserId') and not force:
+        return {"error": "Este reto ya tiene un ganador", "winner": challenge_data['winnerUserId']}
+
+    participation_cost = challenge_data.get('participationCost', 0)
+    top = TopK(top_k)
+    writer = BatchWriter(db)
+    count = 0
+    position = 0
+    rank = None
+    previous = None
+
+    for part in _confirmed_participations(challenge_id):
+        count += 1
+        data = part.to_dict()
+        score = data.get('score')
+        if score is None:
+            writer.update(part.reference, {"rank": None})
+            continue
+
+        position += 1
+        current = (score, data.get('submissionDate'))
+        if current != previous:
+            rank = position
+            previous = current
+        writer.update(part.reference, {"rank": rank})
+        top.push(score, data.get('submissionDate'), part.id, data.get('userId'))
+
+    podium = top.ranked()
+    if not podium:
+        writer.flush()
+        return {"error": "No hay participantes válidos"}
+
+    total_pot = count * participation_cost
+    winner = podium[0]
+
+    # Puestos restantes y cierre del reto en el último batch
+    writer.flush()
+    batch = db.batch()
+    batch.update(challenge_ref, {
+        "winnerUserId": winner['userId'],
+        "totalPot": total_pot,
+        "podium": podium,
+        "confirmedParticipants": count,
+        "resultsComputedAt": firestore.SERVER_TIMESTAMP,
+        "updatedAt": firestore.SERVER_TIMESTAMP
+    }, option=db.write_option(last_update_time=challenge.update_time))
+    batch.update(db.collection('participations').document(winner['participationId']), {
+        "winner": True
+    })
+
+    # Al recalcular (force) se le quita la marca y las estadísticas al ganador anterior
+    previous_winner = challenge_data.get('winnerUserId')
+    if previous_winner:
+        previous_flags = db.collection('participations') \
+            .where('challengeId', '==', challenge_id) \
+            .where('winner', '==', True) \
+            .stream()
+        for part in previous_flags:
+            if part.id != winner['participationId']:
+                batch.update(part.reference, {"winner": False})
+
+    previous_pot = challenge_data.get('totalPot', 0) if previous_winner else 0
+    if previous_winner == winner['userId']:
+        if total_pot != previous_pot:
+            batch.update(db.collection('users').document(winner['userId']), {
+                "totalEarnings": firestore.Increment(total_pot - previous_pot),
+                "updatedAt": firestore.SERVER_TIMESTAMP
+            })
+    else:
+        if previous_winner:
+            batch.update(db.collection('users').document(previous_winner), {
+                "challengeWins": firestore.Increment(-1),
+                "totalEarnings": firestore.Increment(-previous_pot),
+                "updatedAt": firestore.SERVER_TIMESTAMP
+            })
+        batch.update(db.collection('users').document(winner['userId']), {
+            "challengeWins": firestore.Increment(1),
+            "totalEarnings": firestore.Increment(total_pot),
+            "updatedAt": firestore.SERVER_TIMESTAMP
+        })
+        queue_notification(
+            batch,
+            winner['userId'],
+            "¡Has ganado un reto!",
+            f"Felicidades, has ganado el reto '{challenge_data.get('title', 'un reto')}' con un premio de ${total_pot}",
+            "challenge_win"
+        )
+    try:
+        batch.commit()
+    except FailedPrecondition:
+        return {"error": "El reto cambió mientras se calculaban los resultados, intenta de nuevo"}
+
+    return {
+        "message": "Ganador calculado y asignado",
+        "winner": winner['userId'],
+        "totalPot": total_pot,
+        "participants": count,
+        "podium": podium,
+        "rankedParticipants": position
+    }
+
+def close_challenge(challenge_id, challenge_data):
+    """Handler de cierre para el scheduler de retos"""
+    result = compute_challenge_results(challenge_id)
+    if 'error' in result:
+        print(f"Resultados del reto {challenge_id}: {result['error']}")
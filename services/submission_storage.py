@@ -0,0 +1,74 @@
+import hashlib
+import zlib
+from firebase_admin import firestore
+from utils.firebase import db
+
+SUBMISSIONS_COLLECTION = 'submissions'
+# Cada migración escribe la submission y actualiza la participación
+MIGRATION_PAGE_SIZE = 200
+
+def submission_ref(code_ref):
+    return db.collection(SUBMISSIONS_COLLECTION).document(code_ref)
+
+def queue_submission(writer, code):
+    """Agrega el código comprimido a writer y devuelve los campos para la participación.
+
+    El ID del documento es el SHA-256 del código, así que envíos idénticos comparten
+    documento y volver a escribirlo es idempotente.
+    """
+    raw = code.encode('utf-8')
+    digest = hashlib.sha256(raw).hexdigest()
+    compressed = zlib.compress(raw, 9)
+    writer.set(submission_ref(digest), {
+        "content": compressed,
+        "encoding": "zlib",
+        "size": len(raw),
+        "compressedSize": len(compressed)
+    })
+    return {
+        "codeRef": digest,
+        "codeSize": len(raw),
+        "code": firestore.DELETE_FIELD
+    }
+
+def decode_submission(snapshot):
+    if snapshot is None or not snapshot.exists:
+        return None
+    data = snapshot.to_dict()
+    content = data.get('content') or b''
+    if data.get('encoding') == 'zlib':
+        content = zlib.decompress(content)
+    return content.decode('utf-8')
+
+def participation_code(part_data, snapshot=None):
+    """Código de una participación: desde submissions si tiene codeRef, o el inline antiguo"""
+    if part_data.get('codeRef'):
+        if snapshot is None:
+            snapshot = submission_ref(part_data['codeRef']).get()
+        return decode_submission(snapshot) or ''
+    return part_data.get('code') or ''
+
+def migrate_inline_code(max_participations=5000):
+    """Mueve el código guardado dentro de las participaciones a submissions.
+
+    Cada página migrada deja de cumplir el filtro (code se elimina), así que el
+    proceso es reanudable: basta con volver a ejecutarlo hasta que migrated sea 0.
+    """
+    migrated = 0
+    while migrated < max_participations:
+        page = list(db.collection('participations')
+                    .where('code', '!=', None)
+                    .limit(min(MIGRATION_PAGE_SIZE, max_participations - migrated))
+                    .stream())
+        if not page:
+            break
+        batch = db.batch()
+        for part in page:
+            code = part.to_dict().get('code')
+            if isinstance(code, str) and code:
+                batch.update(part.reference, queue_submission(batch, code))
+            else:
+                batch.update(part.reference, {"code": firestore.DELETE_FIELD})
+        batch.commit()
+        migrated += len(page)
+    return {"migrated": migrated}
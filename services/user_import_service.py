@@ -0,0 +1,168 @@
+import json
+import re
+from datetime import datetime
+from firebase_admin import auth
+from utils.firebase import db
+from utils.batch import BatchWriter, chunks
+from utils.concurrency import get_documents
+from utils.exceptions import ValidationError
+from models.User import User
+from services.user_search import username_index
+
+# Límite de auth.import_users por llamada
+IMPORT_BATCH_SIZE = 1000
+MAX_IMPORT_USERS = 10000
+# Página de auth.list_users (máximo permitido por la API)
+EXPORT_PAGE_SIZE = 1000
+EMAIL_PATTERN = re.compile(r"[^@]+@[^@]+\.[^@]+")
+BCRYPT_PREFIXES = ('$2a$', '$2b$', '$2y$')
+PROFILE_FIELDS = ('institution', 'universityCareer', 'professionalTitle', 'description', 'aceptaelretoUsername')
+
+def _prepare(record, default_role):
+    """Valida un registro de importación; devuelve (ImportUserRecord, User) o un mensaje de error"""
+    if not isinstance(record, dict):
+        return "Registro inválido"
+    email = str(record.get('email') or '').strip().lower()
+    username = str(record.get('username') or '').strip()
+    role = record.get('role') or default_role
+    password_hash = record.get('passwordHash')
+
+    if not email or not EMAIL_PATTERN.match(email):
+        return "Formato de email inválido"
+    if not username:
+        return "El nombre de usuario es obligatorio"
+    if role not in ('admin', 'user'):
+        return "Rol inválido"
+    if record.get('password'):
+        return "No se aceptan contraseñas en texto plano, usa passwordHash (bcrypt)"
+    if password_hash and not str(password_hash).startswith(BCRYPT_PREFIXES):
+        return "passwordHash debe ser un hash bcrypt"
+
+    uid = db.collection('users').document().id
+    email_verified = bool(record.get('emailVerified', False))
+    auth_record = auth.ImportUserRecord(
+        uid=uid,
+        email=email,
+        display_name=username,
+        email_verified=email_verified,
+        password_hash=password_hash.encode('utf-8') if password_hash else None
+    )
+    profile = User(
+        uid=uid,
+        email=email,
+        username=username,
+        role=role,
+        aceptaelreto_username=record.get('aceptaelretoUsername'),
+        description=record.get('description', ''),
+        institution=record.get('institution', ''),
+        professional_title=record.get('professionalTitle', ''),
+        university_career=record.get('universityCareer', ''),
+        age=record.get('age'),
+        profile_picture_url='',
+        email_verified=email_verified
+    )
+    return auth_record, profile
+
+def import_users(records, default_role='user'):
+    """Crea cuentas en Auth con auth.import_users (lotes de 1000) y sus perfiles en Firestore.
+
+    Los usuarios sin passwordHash se crean sin contraseña y deben usar el correo de
+    restablecimiento. Solo se escribe el perfil de las cuentas que Auth aceptó, y los
+    emails repetidos dentro del archivo se rechazan antes de llamar a Auth.
+    """
+    if not isinstance(records, list) or not records:
+        raise ValidationError("Se requiere una lista de usuarios")
+    if len(records) > MAX_IMPORT_USERS:
+        raise ValidationError(f"Máximo {MAX_IMPORT_USERS} usuarios por importación")
+
+    errors = []
+    prepared = []
+    seen_emails = set()
+    for index, record in enumerate(records):
+        result = _prepare(record, default_role)
+        if isinstance(result, str):
+            errors.append({"index": index, "message": result})
+        elif result[0].email in seen_emails:
+            errors.append({"index": index, "message": "Email repetido en la importación"})
+        else:
+            seen_emails.add(result[0].email)
+            prepared.append((index, *result))
+
+    imported = []
+    writer = BatchWriter(db)
+    for chunk in chunks(prepared, IMPORT_BATCH_SIZE):
+        hash_alg = auth.UserImportHash.bcrypt() if any(r.password_hash for _, r, _ in chunk) else None
+        result = auth.import_users([auth_record for _, auth_record, _ in chunk], hash_alg=hash_alg)
+
+        failed = {error.index: error.reason for error in result.errors}
+        for position, (index, auth_record, profile) in enumerate(chunk):
+            if position in failed:
+                errors.append({"index": index, "email": auth_record.email, "message": failed[position]})
+                continue
+            writer.set(db.collection('users').document(auth_record.uid), profile.to_dict())
+            imported.append({"index": index, "uid": auth_record.uid, "email": auth_record.email})
+            username_index.upsert(auth_record.uid, profile.username)
+    writer.flush()
+
+    errors.sort(key=lambda error: error['index'])
+    return {
+        "imported": len(imported),
+        "failed": len(errors),
+        "users": imported,
+        "errors": errors
+    }
+
+def parse_ndjson(text):
+    """Convierte un cuerpo NDJSON en lista de registros (ignora líneas vacías)"""
+    records = []
+    for number, line in enumerate(text.splitlines(), start=1):
+        if not line.strip():
+            continue
+        try:
+            records.append(json.loads(line))
+        except ValueError:
+            raise ValidationError(f"JSON inválido en la línea {number}")
+    return records
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return str(value)
+
+def _auth_timestamp(milliseconds):
+    return datetime.utcfromtimestamp(milliseconds / 1000).isoformat() if milliseconds else None
+
+def export_users():
+    """Genera una línea NDJSON por cuenta: datos de Auth más el perfil de Firestore.
+
+    Recorre auth.list_users por páginas de 1000 y lee los perfiles de cada página con
+    un solo get_all, así la memoria usada no depende del total de usuarios.
+    """
+    page = auth.list_users(max_results=EXPORT_PAGE_SIZE)
+    while page:
+        accounts = list(page.users)
+        refs = [db.collection('users').document(account.uid) for account in accounts]
+        profiles = get_documents(db, refs) if refs else []
+
+        for account, profile in zip(accounts, profiles):
+            data = profile.to_dict() if profile.exists else {}
+            line = {
+                "uid": account.uid,
+                "email": account.email,
+                "emailVerified": account.email_verified,
+                "disabled": account.disabled,
+                "createdAt": _auth_timestamp(account.user_metadata.creation_timestamp),
+                "lastSignInAt": _auth_timestamp(account.user_metadata.last_sign_in_timestamp),
+                "hasProfile": profile.exists,
+                "username": data.get('username', account.display_name),
+                "role": data.get('role'),
+                "isBanned": data.get('isBanned', False),
+                "challengeWins": data.get('challengeWins', 0),
+                "totalParticipations": data.get('totalParticipations', 0),
+                "totalEarnings": data.get('totalEarnings', 0)
+            }
+            for field in PROFILE_FIELDS:
+                line[field] = data.get(field)
+            yield json.dumps(line, default=_json_default, ensure_ascii=False) + '\n'
+
+        page = page.get_next_page()
@@ -0,0 +1,143 @@
+import os
+from array import array
+from bisect import bisect_left
+from datetime import datetime
+from firebase_admin import firestore
+from utils.firebase import db
+from utils.cache import TTLCache
+from utils.batch import BatchWriter
+
+RANKING_FIELDS = {
+    'wins': 'challengeWins',
+    'earnings': 'totalEarnings'
+}
+# Sin estos campos un usuario no entra en ranking_query (order_by omite los documentos sin el campo)
+RANKING_DEFAULTS = {
+    'isBanned': False,
+    'challengeWins': 0,
+    'totalEarnings': 0
+}
+PUBLIC_FIELDS = ['username', 'profilePictureUrl', 'institution', 'challengeWins', 'totalEarnings']
+# Usuarios del top que se guardan completos en el snapshot
+SNAPSHOT_TOP_N = 100
+SNAPSHOT_PAGE_SIZE = 1000
+
+snapshot_cache = TTLCache(ttl_seconds=int(os.getenv('RANKING_SNAPSHOT_TTL_SECONDS', 300)), name='user_ranking')
+
+def ranking_query(by):
+    """Usuarios no baneados ordenados por el campo de ranking (índice isBanned + campo DESC).
+
+    El desempate por ID lo agrega Firestore en la misma dirección; un order_by('__name__')
+    ascendente explícito exigiría otro índice compuesto.
+    """
+    return db.collection('users') \
+        .where('isBanned', '==', False) \
+        .order_by(RANKING_FIELDS[by], direction=firestore.Query.DESCENDING)
+
+def _public(doc_id, data):
+    entry = {field: data.get(field) for field in PUBLIC_FIELDS}
+    entry['id'] = doc_id
+    return entry
+
+class RankingSnapshot:
+    """Foto del ranking: el top N completo y todos los puntajes en un array compacto.
+
+    Los puntajes se guardan negados en un array('d') ascendente (8 bytes por usuario),
+    así el puesto de cualquier puntaje se obtiene con bisect en O(log n): es el número
+    de usuarios con puntaje estrictamente mayor, más uno (empates comparten puesto).
+    """
+
+    def __init__(self, by):
+        self.by = by
+        self.top = []
+        self.scores = array('d')
+        self.built_at = None
+
+    def build(self):
+        field = RANKING_FIELDS[self.by]
+        # Sin rutas repetidas (el campo de orden también está en PUBLIC_FIELDS): Firestore las rechaza
+        query = ranking_query(self.by).select(list(dict.fromkeys([field, *PUBLIC_FIELDS])))
+        last = None
+        while True:
+            page_query = query.start_after(last) if last else query
+            page = list(page_query.limit(SNAPSHOT_PAGE_SIZE).stream())
+            for doc in page:
+                data = doc.to_dict()
+                # Ya vienen en orden descendente: el array negado queda ascendente
+                self.scores.append(-float(data.get(field) or 0))
+                if len(self.top) < SNAPSHOT_TOP_N:
+                    self.top.append(_public(doc.id, data))
+            if len(page) < SNAPSHOT_PAGE_SIZE:
+                break
+            last = page[-1]
+        self.built_at = datetime.utcnow()
+        return self
+
+    def rank_of(self, score):
+        return bisect_left(self.scores, -float(score or 0)) + 1
+
+    @property
+    def total(self):
+        return len(self.scores)
+
+def get_snapshot(by):
+    # Al vencer se sigue sirviendo el snapshot anterior mientras se reconstruye en segundo plano
+    snapshot, _ = snapshot_cache.get_or_refresh(by, lambda: RankingSnapshot(by).build())
+    return snapshot
+
+def get_ranking_page(by, limit, cursor=None):
+    """Página del ranking; sin cursor y dentro del top N se sirve desde el snapshot.
+
+    Devuelve (entradas, cursor siguiente o None). Los puestos salen del snapshot, por
+    lo que pueden ir hasta RANKING_SNAPSHOT_TTL_SECONDS por detrás de Firestore.
+    """
+    field = RANKING_FIELDS[by]
+    snapshot = get_snapshot(by)
+
+    if cursor is None and limit <= len(snapshot.top):
+        entries = snapshot.top[:limit]
+    else:
+        query = ranking_query(by).select(PUBLIC_FIELDS).limit(limit)
+        if cursor:
+            cursor_doc = db.collection('users').document(cursor).get()
+            if not cursor_doc.exists:
+                return None, None
+            query = query.start_after(cursor_doc)
+        entries = [_public(doc.id, doc.to_dict()) for doc in query.stream()]
+
+    result = [{**entry, "rank": snapshot.rank_of(entry.get(field))} for entry in entries]
+    next_cursor = result[-1]['id'] if len(result) == limit else None
+    return result, next_cursor
+
+def get_user_rank(by, user_id):
+    """Puesto de un usuario con su puntaje actual sobre el snapshot vigente"""
+    user = db.collection('users').document(user_id).get()
+    if not user.exists:
+        return None
+    data = user.to_dict()
+    snapshot = get_snapshot(by)
+    score = data.get(RANKING_FIELDS[by]) or 0
+    return {
+        "id": user_id,
+        "username": data.get('username'),
+        "score": score,
+        "rank": snapshot.rank_of(score),
+        "totalUsers": snapshot.total,
+        "snapshotAt": snapshot.built_at.isoformat()
+    }
+
+def backfill_ranking_fields():
+    """Completa isBanned, challengeWins y totalEarnings en los usuarios que no los tienen"""
+    writer = BatchWriter(db)
+    scanned = 0
+    updated = 0
+    for doc in db.collection('users').select(list(RANKING_DEFAULTS)).stream():
+        scanned += 1
+        data = doc.to_dict()
+        missing = {field: default for field, default in RANKING_DEFAULTS.items() if data.get(field) is None}
+        if missing:
+            writer.update(doc.reference, missing)
+            updated += 1
+    writer.flush()
+    snapshot_cache.invalidate()
+    return {"scanned": scanned, "updated": updated}
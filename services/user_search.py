@@ -0,0 +1,207 @@
+import os
+import threading
+import time
+from utils.firebase import db
+from utils.batch import BatchWriter
+from utils.text import normalize
+
+MAX_RESULTS = 20
+LOAD_PAGE_SIZE = 1000
+# Otras instancias también registran usuarios: el índice se reconstruye cada cierto tiempo
+INDEX_TTL_SECONDS = int(os.getenv('USERNAME_INDEX_TTL_SECONDS', 600))
+# Espera antes de reintentar una recarga de fondo fallida (se sigue sirviendo el trie anterior)
+RELOAD_RETRY_SECONDS = 60
+# Último carácter del rango Unicode privado: cota superior de un prefijo en Firestore
+PREFIX_END = '\uf8ff'
+_TERMINAL = ''
+
+class UsernameTrie:
+    """Trie de usernames normalizados; cada nodo es un dict carácter -> nodo.
+
+    La clave vacía de un nodo guarda los uids cuyo username termina ahí, así
+    varios usuarios pueden compartir nombre.
+    """
+
+    def __init__(self):
+        self._root = {}
+        self._names = {}
+
+    def __len__(self):
+        return len(self._names)
+
+    def insert(self, uid, username):
+        self.remove(uid)
+        key = normalize(username)
+        if not key:
+            return
+        node = self._root
+        for char in key:
+            node = node.setdefault(char, {})
+        node.setdefault(_TERMINAL, {})[uid] = username
+        self._names[uid] = key
+
+    def remove(self, uid):
+        key = self._names.pop(uid, None)
+        if key is None:
+            return
+        path = [self._root]
+        for char in key:
+            path.append(path[-1][char])
+        owners = path[-1][_TERMINAL]
+        owners.pop(uid, None)
+        if not owners:
+            del path[-1][_TERMINAL]
+        # Podar los nodos que quedaron vacíos
+        for depth in range(len(key), 0, -1):
+            if path[depth]:
+                break
+            del path[depth - 1][key[depth - 1]]
+
+    def search(self, prefix, limit=MAX_RESULTS):
+        """Hasta limit usuarios cuyo username normalizado empieza por prefix, en orden alfabético"""
+        node = self._root
+        for char in normalize(prefix):
+            node = node.get(char)
+            if node is None:
+                return []
+
+        results = []
+        stack = [node]
+        while stack and len(results) < limit:
+            current = stack.pop()
+            for uid, username in current.get(_TERMINAL, {}).items():
+                results.append({"id": uid, "username": username})
+                if len(results) >= limit:
+                    break
+            # Hijos en orden inverso para recorrerlos alfabéticamente desde la pila
+            stack.extend(current[char] for char in sorted(current, reverse=True) if char != _TERMINAL)
+        return results
+
+class UsernameIndex:
+    """Trie en memoria de la instancia, cargado al primer uso y actualizado incrementalmente.
+
+    Al vencer INDEX_TTL_SECONDS se recarga en un hilo de fondo y se reemplaza de una
+    vez; mientras tanto las búsquedas usan el trie anterior. Los cambios recibidos
+    durante la recarga se aplican también al trie nuevo antes del reemplazo.
+    """
+
+    def __init__(self):
+        self._trie = UsernameTrie()
+        self._lock = threading.Lock()
+        # Una sola carga a la vez
+        self._load_lock = threading.Lock()
+        self._loaded_at = None
+        self._next_reload_at = None
+        # (uid, username o None si se eliminó) recibidos durante una carga
+        self._pending = None
+
+    def _load(self):
+        trie = UsernameTrie()
+        query = db.collection('users').order_by('__name__').select(['username'])
+        last = None
+        while True:
+            page_query = query.start_after(last) if last else query
+            page = list(page_query.limit(LOAD_PAGE_SIZE).stream())
+            for doc in page:
+                trie.insert(doc.id, doc.to_dict().get('username'))
+            if len(page) < LOAD_PAGE_SIZE:
+                break
+            last = page[-1]
+        return trie
+
+    def _reload(self):
+        with self._lock:
+            self._pending = []
+        try:
+            trie = self._load()
+        except Exception:
+            with self._lock:
+                self._pending = None
+            raise
+        with self._lock:
+            for uid, username in self._pending:
+                if username is None:
+                    trie.remove(uid)
+                else:
+                    trie.insert(uid, username)
+            self._trie = trie
+            self._pending = None
+            self._loaded_at = time.monotonic()
+            self._next_reload_at = self._loaded_at + INDEX_TTL_SECONDS
+
+    def _reload_in_background(self):
+        try:
+            self._reload()
+        except Exception as e:
+            # Sin esto cada autocompletado lanzaría otra recarga justo cuando Firestore falla
+            self._next_reload_at = time.monotonic() + RELOAD_RETRY_SECONDS
+            print(f"Error recargando el índice de usernames: {str(e)}")
+        finally:
+            self._load_lock.release()
+
+    def _ensure_loaded(self):
+        if self._loaded_at is None:
+            # Primera carga: todavía no hay trie que servir, así que se espera
+            with self._load_lock:
+                if self._loaded_at is None:
+                    self._reload()
+            return
+        if time.monotonic() >= self._next_reload_at and self._load_lock.acquire(blocking=False):
+            threading.Thread(target=self._reload_in_background, name='username-index', daemon=True).start()
+
+    def _apply(self, uid, username):
+        with self._lock:
+            if self._pending is not None:
+                self._pending.append((uid, username))
+            # Si todavía no se cargó, la carga inicial ya leerá el cambio desde Firestore
+            if self._loaded_at is None:
+                return
+            if username is None:
+                self._trie.remove(uid)
+            else:
+                self._trie.insert(uid, username)
+
+    def upsert(self, uid, username):
+        self._apply(uid, username)
+
+    def remove(self, uid):
+        self._apply(uid, None)
+
+    def search(self, prefix, limit=MAX_RESULTS):
+        self._ensure_loaded()
+        with self._lock:
+            return self._trie.search(prefix, limit)
+
+username_index = UsernameIndex()
+
+def search_users_by_username(prefix, limit=MAX_RESULTS):
+    """Búsqueda por prefijo en Firestore con un rango sobre usernameLower (índice simple)"""
+    key = normalize(prefix)
+    if not key:
+        return []
+    query = db.collection('users') \
+        .where('usernameLower', '>=', key) \
+        .where('usernameLower', '<', key + PREFIX_END) \
+        .order_by('usernameLower') \
+        .limit(limit)
+    users = []
+    for doc in query.stream():
+        user_data = doc.to_dict()
+        user_data['id'] = doc.id
+        users.append(user_data)
+    return users
+
+def backfill_username_lower():
+    """Rellena usernameLower en los usuarios que no lo tienen o lo tienen desactualizado"""
+    writer = BatchWriter(db)
+    scanned = 0
+    updated = 0
+    for doc in db.collection('users').select(['username', 'usernameLower']).stream():
+        scanned += 1
+        data = doc.to_dict()
+        expected = normalize(data.get('username'))
+        if data.get('usernameLower') != expected:
+            writer.update(doc.reference, {"usernameLower": expected})
+            updated += 1
+    writer.flush()
+    return {"scanned": scanned, "updated": updated}
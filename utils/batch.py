@@ -0,0 +1,50 @@
+from itertools import islice
+
+# Firestore admite como máximo 500 escrituras por batch/commit
+MAX_BATCH_WRITES = 500
+
+def chunks(items, size):
+    """Divide cualquier iterable (incluido un stream de Firestore) en listas de tamaño size"""
+    iterator = iter(items)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+class BatchWriter:
+    """Acumula escrituras y confirma un batch cada `limit` operaciones"""
+
+    def __init__(self, db, limit=MAX_BATCH_WRITES):
+        self._db = db
+        self._limit = limit
+        self._batch = None
+        self._pending = 0
+        self.committed = 0
+
+    def _write(self, method, *args, **kwargs):
+        if self._batch is None:
+            self._batch = self._db.batch()
+        getattr(self._batch, method)(*args, **kwargs)
+        self._pending += 1
+        if self._pending >= self._limit:
+            self.flush()
+
+    def set(self, *args, **kwargs):
+        self._write('set', *args, **kwargs)
+
+    def create(self, *args, **kwargs):
+        self._write('create', *args, **kwargs)
+
+    def update(self, *args, **kwargs):
+        self._write('update', *args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        self._write('delete', *args, **kwargs)
+
+    def flush(self):
+        if self._pending:
+            self._batch.commit()
+            self.committed += self._pending
+        self._batch = None
+        self._pending = 0
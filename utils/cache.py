@@ -0,0 +1,110 @@
+import threading
+import time
+from utils.metrics import register_cache
+
+class TTLCache:
+    """Cache en memoria con expiración por entrada, seguro entre hilos.
+
+    get_or_compute evita que varias solicitudes simultáneas recalculen la misma
+    clave: la primera calcula y las demás esperan su resultado. get_or_refresh
+    además sigue sirviendo la entrada vencida mientras se recalcula en segundo plano.
+    """
+
+    def __init__(self, ttl_seconds, max_entries=1024, name=None):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._entries = {}
+        self._lock = threading.Lock()
+        self._key_locks = {}
+        self._refreshing = set()
+        self.hits = 0
+        self.misses = 0
+        if name:
+            register_cache(name, self)
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+            return default
+
+    def set(self, key, value, ttl_seconds=None):
+        expires = time.monotonic() + (self.ttl_seconds if ttl_seconds is None else ttl_seconds)
+        with self._lock:
+            if len(self._entries) >= self.max_entries and key not in self._entries:
+                self._evict()
+            self._entries[key] = (expires, value)
+
+    def _evict(self):
+        now = time.monotonic()
+        for key in [k for k, (expires, _) in self._entries.items() if expires <= now]:
+            del self._entries[key]
+        if len(self._entries) >= self.max_entries:
+            # Sin expiradas: descartar la que vence antes
+            del self._entries[min(self._entries, key=lambda k: self._entries[k][0])]
+
+    def invalidate(self, key=None):
+        with self._lock:
+            if key is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(key, None)
+
+    def get_or_compute(self, key, compute):
+        """Devuelve (valor, cacheado); calcula con compute() si no hay entrada vigente"""
+        missing = object()
+        value = self.get(key, missing)
+        if value is not missing:
+            return value, True
+
+        with self._lock:
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+        with key_lock:
+            # Otra solicitud pudo calcularlo mientras se esperaba el lock
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry is not None and entry[0] > time.monotonic():
+                    return entry[1], True
+            value = compute()
+            self.set(key, value)
+            return value, False
+
+    def get_or_refresh(self, key, compute):
+        """Como get_or_compute, pero solo la primera carga bloquea.
+
+        Si la entrada venció se devuelve igual (valor anterior) y se recalcula en un
+        hilo de fondo; mientras tanto las demás solicitudes siguen viendo el valor viejo.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self.hits += 1
+        if entry is None:
+            return self.get_or_compute(key, compute)
+        if entry[0] <= time.monotonic():
+            self._refresh_in_background(key, compute)
+        return entry[1], True
+
+    def _refresh_in_background(self, key, compute):
+        with self._lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+
+        def refresh():
+            try:
+                self.set(key, compute())
+            except Exception as e:
+                print(f"Error recalculando la entrada {key} del cache: {str(e)}")
+            finally:
+                with self._lock:
+                    self._refreshing.discard(key)
+
+        threading.Thread(target=refresh, name='cache-refresh', daemon=True).start()
+
+    def hit_ratio(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
@@ -0,0 +1,89 @@
+import gzip
+import os
+from flask import request
+
+# brotli es opcional: si no está instalado solo se usa gzip
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESSIBLE_MIMETYPES = {
+    'application/json',
+    'text/html',
+    'text/plain',
+    'text/css',
+    'text/csv',
+    'application/javascript'
+}
+
+def _accepted_encodings(header):
+    """Codificaciones aceptadas por el cliente según Accept-Encoding (ignora q=0)"""
+    accepted = set()
+    for part in (header or '').split(','):
+        token, _, params = part.strip().partition(';')
+        token = token.strip().lower()
+        if not token:
+            continue
+        quality = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        if quality > 0:
+            accepted.add(token)
+    return accepted
+
+def _choose_encoding(header):
+    accepted = _accepted_encodings(header)
+    if brotli is not None and ('br' in accepted or '*' in accepted):
+        return 'br'
+    if 'gzip' in accepted or '*' in accepted:
+        return 'gzip'
+    return None
+
+def init_compression(app, min_size=None, gzip_level=6, brotli_quality=5):
+    """Comprime las respuestas grandes según Accept-Encoding.
+
+    Se omiten los streams (SSE, NDJSON), las respuestas ya codificadas, las que no
+    tienen cuerpo y las menores que COMPRESSION_MIN_SIZE bytes.
+    """
+    if min_size is None:
+        min_size = int(os.getenv('COMPRESSION_MIN_SIZE', 1024))
+
+    @app.after_request
+    def compress_response(response):
+        # Aunque no se comprima, la respuesta depende de Accept-Encoding para los caches
+        if response.mimetype in COMPRESSIBLE_MIMETYPES:
+            response.vary.add('Accept-Encoding')
+
+        if (response.direct_passthrough
+                or response.is_streamed
+                or request.method == 'HEAD'
+                or response.status_code < 200
+                or response.status_code in (204, 206, 304)
+                or 'Content-Encoding' in response.headers
+                or response.mimetype not in COMPRESSIBLE_MIMETYPES):
+            return response
+
+        encoding = _choose_encoding(request.headers.get('Accept-Encoding'))
+        if encoding is None:
+            return response
+
+        data = response.get_data()
+        if len(data) < min_size:
+            return response
+
+        if encoding == 'br':
+            compressed = brotli.compress(data, quality=brotli_quality)
+        else:
+            compressed = gzip.compress(data, compresslevel=gzip_level)
+
+        response.set_data(compressed)
+        response.headers['Content-Encoding'] = encoding
+        response.headers['Content-Length'] = str(len(compressed))
+        return response
+
+    return compress_response
@@ -0,0 +1,37 @@
+import contextvars
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+# Pool compartido y acotado para lecturas de Firestore independientes.
+# Las tareas no deben volver a usar este pool (podrían bloquearse esperando hilos).
+MAX_PARALLEL_READS = int(os.getenv('FIRESTORE_MAX_PARALLEL_READS', 8))
+
+_executor = ThreadPoolExecutor(max_workers=MAX_PARALLEL_READS, thread_name_prefix='firestore-read')
+
+def _submit(fn, *args):
+    # Cada tarea corre en una copia del contexto de quien la envía: así las consultas
+    # del pool ven la solicitud actual (ruta, límite de documentos, métricas)
+    return _executor.submit(contextvars.copy_context().run, fn, *args)
+
+def parallel_map(fn, items):
+    """Aplica fn a cada elemento en el pool y devuelve los resultados en el mismo orden"""
+    items = list(items)
+    if len(items) <= 1:
+        return [fn(item) for item in items]
+    futures = [_submit(fn, item) for item in items]
+    return [future.result() for future in futures]
+
+def gather(*calls):
+    """Ejecuta en paralelo funciones sin argumentos y devuelve sus resultados en orden.
+
+    Si alguna falla se propaga la primera excepción, igual que una llamada secuencial.
+    """
+    if len(calls) <= 1:
+        return [call() for call in calls]
+    futures = [_submit(call) for call in calls]
+    return [future.result() for future in futures]
+
+def get_documents(db, refs):
+    """Lee varios documentos en un solo RPC (get_all) y los devuelve en el orden de refs"""
+    snapshots = {snapshot.reference.path: snapshot for snapshot in db.get_all(refs)}
+    return [snapshots[ref.path] for ref in refs]
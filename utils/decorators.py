@@ -1,3 +1,4 @@
+import inspect
 from functools import wraps
 from flask import request, jsonify
 from firebase_admin import auth
@@ -6,7 +7,30 @@ from utils.exceptions import UnauthorizedError, ForbiddenError
 
 db = get_db()
 
+def supports_async(decorator):
+    """Permite usar un decorador de autenticación sobre vistas async (flask[async]).
+
+    La verificación sigue siendo síncrona: el decorador llama a la vista, que devuelve su
+    corrutina, y el envoltorio async la espera. Si la verificación responde con un error,
+    se devuelve tal cual. Flask necesita ver una función async para ejecutarla en un loop.
+    """
+    @wraps(decorator)
+    def apply(f):
+        checked = decorator(f)
+        if not inspect.iscoroutinefunction(f):
+            return checked
+
+        @wraps(f)
+        async def async_function(*args, **kwargs):
+            result = checked(*args, **kwargs)
+            if inspect.isawaitable(result):
+                result = await result
+            return result
+        return async_function
+    return apply
+
 # decorators.py
+@supports_async
 def firebase_token_required(f):
     @wraps(f)
     def decorated_function(*args, **kwargs):
@@ -15,14 +39,10 @@ def firebase_token_required(f):
             raise UnauthorizedError("Authentication token required")
         
         token = auth_header.split('Bearer ')[1]
+        # Solo la verificación del token: los errores de la vista no son de autenticación
+        # (y así se comportan igual las vistas síncronas y las async)
         try:
             decoded_token = auth.verify_id_token(token)
-
-            request.user = {
-                'uid': decoded_token['uid'],
-                'email': decoded_token.get('email', '')
-            }
-            return f(*args, **kwargs)
         except auth.InvalidIdTokenError:
             print("Token inválido")
             raise UnauthorizedError("Invalid token")
@@ -30,8 +50,54 @@ def firebase_token_required(f):
             raise UnauthorizedError("Token expired")
         except Exception as e:
             raise UnauthorizedError(f"Authentication error: {str(e)}")
+
+        request.user = {
+            'uid': decoded_token['uid'],
+            'email': decoded_token.get('email', '')
+        }
+        return f(*args, **kwargs)
     return decorated_function
 
+def stream_token_required(f):
+    """Como firebase_token_required, pero acepta el token en ?token= porque
+    EventSource no permite enviar el header Authorization."""
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        auth_header = request.headers.get('Authorization')
+        if auth_header and auth_header.startswith('Bearer '):
+            token = auth_header.split('Bearer ')[1]
+        else:
+            token = request.args.get('token')
+        if not token:
+            raise UnauthorizedError("Authentication token required")
+
+        try:
+            decoded_token = auth.verify_id_token(token)
+        except auth.InvalidIdTokenError:
+            raise UnauthorizedError("Invalid token")
+        except auth.ExpiredIdTokenError:
+            raise UnauthorizedError("Token expired")
+        except Exception as e:
+            raise UnauthorizedError(f"Authentication error: {str(e)}")
+
+        request.user = {
+            'uid': decoded_token['uid'],
+            'email': decoded_token.get('email', '')
+        }
+        return f(*args, **kwargs)
+    return decorated_function
+
+def max_query_documents(limit):
+    """Máximo de documentos por consulta de Firestore en esta ruta (None = sin límite).
+
+    Debe ir debajo de los demás decoradores; functools.wraps copia el atributo.
+    """
+    def decorator(f):
+        f.max_query_documents = limit
+        return f
+    return decorator
+
+@supports_async
 def admin_required(f):
     @wraps(f)
     def decorated_function(*args, **kwargs):
@@ -40,26 +106,27 @@ def admin_required(f):
             return jsonify({"error": "Token de autenticación requerido"}), 401
 
         token = auth_header.split(' ')[1]
+        # Igual que firebase_token_required: el try cubre solo la verificación
         try:
             decoded_token = auth.verify_id_token(token)
             request.user = decoded_token
             
             # Verificar rol de admin
             user_ref = db.collection('users').document(decoded_token['uid']).get()
-            if not user_ref.exists:
-                return jsonify({"error": "Usuario no encontrado"}), 404
-                
-            user_data = user_ref.to_dict()
-            if user_data.get('role') != 'admin':
-                return jsonify({"error": "Se requieren privilegios de administrador"}), 403
-                
-            return f(*args, **kwargs)
-            
         except auth.InvalidIdTokenError:
             return jsonify({"error": "Token inválido"}), 401
         except auth.ExpiredIdTokenError:
             return jsonify({"error": "Token expirado"}), 401
         except Exception as e:
             return jsonify({"error": f"Error de autenticación: {str(e)}"}), 500
+
+        if not user_ref.exists:
+            return jsonify({"error": "Usuario no encontrado"}), 404
+            
+        user_data = user_ref.to_dict()
+        if user_data.get('role') != 'admin':
+            return jsonify({"error": "Se requieren privilegios de administrador"}), 403
+            
+        return f(*args, **kwargs)
             
     return decorated_function
\ No newline at end of file
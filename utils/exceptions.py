@@ -28,6 +28,11 @@ class ForbiddenError(ByteBattleError):
     def __init__(self, message="Forbidden", payload=None):
         super().__init__(message, 403, payload)
 
+class QueryTooLargeError(ByteBattleError):
+    """Raised when a Firestore query streams more documents than the route allows"""
+    def __init__(self, message="Query returned too many documents", payload=None):
+        super().__init__(message, 422, payload)
+
 class ValidationError(ByteBattleError):
     """Raised when input validation fails"""
     def __init__(self, message="Validation error", payload=None):
@@ -0,0 +1,63 @@
+import asyncio
+import threading
+from firebase_admin import firestore_async
+from utils.firebase import get_db
+from utils.firestore_instrumentation import instrument_firestore
+
+# El canal gRPC del AsyncClient queda ligado al loop en que se usa, y Flask ejecuta
+# cada vista async en un loop propio (asgiref). Por eso el cliente vive en un loop de
+# fondo y las vistas le envían sus corrutinas: una sola conexión por proceso.
+_loop = None
+_client = None
+_lock = threading.Lock()
+
+async def _create_client():
+    client = firestore_async.client()
+    instrument_firestore(client)
+    return client
+
+def _ensure_started():
+    global _loop, _client
+    with _lock:
+        if _loop is None:
+            # Inicializa la app de Firebase si todavía no existe
+            get_db()
+            loop = asyncio.new_event_loop()
+            threading.Thread(target=loop.run_forever, name='firestore-async', daemon=True).start()
+            _client = asyncio.run_coroutine_threadsafe(_create_client(), loop).result()
+            _loop = loop
+    return _loop
+
+def get_async_db():
+    """AsyncClient de Firestore. Sus operaciones deben esperarse con run_async (o los helpers de abajo)"""
+    _ensure_started()
+    return _client
+
+async def run_async(coro):
+    """Ejecuta una corrutina del AsyncClient en su loop y espera el resultado desde cualquier loop.
+
+    La tarea hereda el contexto actual, así que la instrumentación sigue viendo la
+    ruta de la solicitud.
+    """
+    return await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(coro, _ensure_started()))
+
+async def _get_all(refs):
+    return [snapshot async for snapshot in get_async_db().get_all(refs)]
+
+async def get_documents_async(refs):
+    """Como utils.concurrency.get_documents: un solo get_all y resultados en el orden de refs.
+
+    Las referencias repetidas se leen una sola vez.
+    """
+    if not refs:
+        return []
+    unique = list({ref.path: ref for ref in refs}.values())
+    snapshots = {snapshot.reference.path: snapshot for snapshot in await run_async(_get_all(unique))}
+    return [snapshots[ref.path] for ref in refs]
+
+async def _stream(query):
+    return [doc async for doc in query.stream()]
+
+async def query_async(query):
+    """Todos los documentos de una consulta del AsyncClient"""
+    return await run_async(_stream(query))
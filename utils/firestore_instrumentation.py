@@ -0,0 +1,230 @@
+import os
+import time
+from functools import wraps
+from firebase_admin import firestore
+from flask import current_app, has_request_context, request
+from utils.exceptions import QueryTooLargeError
+from utils.metrics import (firestore_operations, firestore_latency, firestore_documents,
+                           firestore_size_warnings, firestore_size_rejections)
+from utils.query_shapes import shape_registry, query_shape, current_endpoint
+
+# RPCs de la API GAPIC de Firestore que se miden
+UNARY_METHODS = ('commit', 'begin_transaction', 'rollback', 'batch_write', 'get_document', 'list_documents')
+STREAMING_METHODS = ('run_query', 'batch_get_documents', 'run_aggregation_query')
+# RPCs cuyo request trae una consulta estructurada
+QUERY_METHODS = ('run_query', 'run_aggregation_query')
+# Campo de la respuesta que indica que trae un documento
+DOCUMENT_FIELDS = {'run_query': 'document', 'batch_get_documents': 'found'}
+# Máximo de documentos por consulta en una solicitud; las rutas lo cambian con
+# @max_query_documents (0 = sin límite)
+DEFAULT_MAX_DOCUMENTS = int(os.getenv('FIRESTORE_MAX_DOCS_PER_QUERY', 5000))
+WARN_RATIO = 0.8
+
+def _record(method, started, outcome, shape=None, endpoint=None, error=None):
+    seconds = time.perf_counter() - started
+    firestore_latency.observe(seconds, method=method)
+    firestore_operations.inc(method=method, outcome=outcome)
+    shape_registry.record(method, seconds, shape=shape, endpoint=endpoint, error=error)
+
+def _rpc_request(args, kwargs):
+    return kwargs.get('request', args[0] if args else None)
+
+def _document_limit():
+    """Máximo de documentos por consulta para la ruta actual (None = sin límite).
+
+    El límite protege las rutas: los trabajos de fondo (scheduler, índice de búsqueda)
+    no tienen contexto de solicitud y recorren colecciones completas a propósito.
+    """
+    if not has_request_context():
+        return None
+    limit = DEFAULT_MAX_DOCUMENTS
+    if request.endpoint:
+        view = current_app.view_functions.get(request.endpoint)
+        limit = getattr(view, 'max_query_documents', limit)
+    return limit or None
+
+def _has_document(response, field):
+    message_type = type(response)
+    if not hasattr(message_type, 'pb'):
+        return True
+    return message_type.pb(response).HasField(field)
+
+class _TimedStream:
+    """Envuelve la respuesta de un RPC de streaming y mide hasta consumirla por completo.
+
+    También cuenta los documentos recibidos: al acercarse al máximo de la ruta emite
+    una advertencia y al superarlo cancela el stream y lanza QueryTooLargeError, antes
+    de que la consulta termine de cargarse en memoria.
+    """
+
+    def __init__(self, stream, method, started, shape, endpoint, limit):
+        self._stream = self._iterator(stream)
+        self._wrapped = stream
+        self._method = method
+        self._started = started
+        self._shape = shape
+        self._endpoint = endpoint
+        self._document_field = DOCUMENT_FIELDS.get(method)
+        self._limit = limit if self._document_field else None
+        self._warn_at = int(limit * WARN_RATIO) if self._limit else None
+        self._documents = 0
+        self._done = False
+
+    def _iterator(self, stream):
+        return iter(stream)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        try:
+            response = next(self._stream)
+        except StopIteration:
+            self._finish('ok')
+            raise
+        except Exception as e:
+            self._finish('error', e)
+            raise
+        return self._observe(response)
+
+    def _observe(self, response):
+        if self._document_field and _has_document(response, self._document_field):
+            self._documents += 1
+            if self._limit:
+                self._check_limit()
+        return response
+
+    def _check_limit(self):
+        if self._documents == self._warn_at:
+            firestore_size_warnings.inc(endpoint=self._endpoint)
+        if self._documents > self._limit:
+            firestore_size_rejections.inc(endpoint=self._endpoint)
+            error = QueryTooLargeError(
+                f"La consulta superó el máximo de {self._limit} documentos para esta ruta",
+                {"endpoint": self._endpoint}
+            )
+            cancel = getattr(self._wrapped, 'cancel', None)
+            if callable(cancel):
+                cancel()
+            self._finish('error', error)
+            raise error
+
+    def _finish(self, outcome, error=None):
+        if self._done:
+            return
+        self._done = True
+        if self._document_field:
+            firestore_documents.observe(self._documents, method=self._method)
+        _record(self._method, self._started, outcome, self._shape, self._endpoint, error)
+
+    def __getattr__(self, name):
+        # cancel(), trailing_metadata(), etc. del stream gRPC
+        return getattr(self._wrapped, name)
+
+class _TimedAsyncStream(_TimedStream):
+    """Igual que _TimedStream para el AsyncClient, cuya respuesta se recorre con async for"""
+
+    def _iterator(self, stream):
+        return stream.__aiter__()
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        try:
+            response = await self._stream.__anext__()
+        except StopAsyncIteration:
+            self._finish('ok')
+            raise
+        except Exception as e:
+            self._finish('error', e)
+            raise
+        return self._observe(response)
+
+def _wrap_unary(method, call):
+    @wraps(call)
+    def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            result = call(*args, **kwargs)
+        except Exception as e:
+            _record(method, started, 'error', endpoint=current_endpoint(), error=e)
+            raise
+        _record(method, started, 'ok', endpoint=current_endpoint())
+        return result
+    return wrapper
+
+def _stream_context(method, args, kwargs):
+    """(forma de la consulta, ruta, máximo de documentos) de un RPC de streaming"""
+    shape = None
+    if method in QUERY_METHODS:
+        try:
+            shape = query_shape(_rpc_request(args, kwargs))
+        except Exception:
+            # La instrumentación nunca debe romper la consulta
+            shape = None
+    return shape, current_endpoint(), _document_limit()
+
+def _wrap_streaming(method, call):
+    @wraps(call)
+    def wrapper(*args, **kwargs):
+        shape, endpoint, limit = _stream_context(method, args, kwargs)
+        started = time.perf_counter()
+        try:
+            stream = call(*args, **kwargs)
+        except Exception as e:
+            _record(method, started, 'error', shape, endpoint, e)
+            raise
+        return _TimedStream(stream, method, started, shape, endpoint, limit)
+    return wrapper
+
+# En el AsyncClient todos los RPC se esperan con await; los de streaming devuelven
+# después un iterable asíncrono
+def _wrap_unary_async(method, call):
+    @wraps(call)
+    async def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            result = await call(*args, **kwargs)
+        except Exception as e:
+            _record(method, started, 'error', endpoint=current_endpoint(), error=e)
+            raise
+        _record(method, started, 'ok', endpoint=current_endpoint())
+        return result
+    return wrapper
+
+def _wrap_streaming_async(method, call):
+    @wraps(call)
+    async def wrapper(*args, **kwargs):
+        shape, endpoint, limit = _stream_context(method, args, kwargs)
+        started = time.perf_counter()
+        try:
+            stream = await call(*args, **kwargs)
+        except Exception as e:
+            _record(method, started, 'error', shape, endpoint, e)
+            raise
+        return _TimedAsyncStream(stream, method, started, shape, endpoint, limit)
+    return wrapper
+
+def instrument_firestore(db):
+    """Envuelve los métodos RPC del cliente GAPIC que usa db.
+
+    Así se miden todas las operaciones (consultas, get_all, batches, agregaciones)
+    sin tocar el código que usa el SDK, y se registra la forma de cada consulta
+    para el log de operaciones lentas y el generador de índices. Acepta también el
+    AsyncClient (en ese caso debe llamarse desde su loop). Es idempotente.
+    """
+    api = db._firestore_api
+    if getattr(api, '_instrumented', False):
+        return api
+    is_async = isinstance(db, firestore.AsyncClient)
+    wrap_unary = _wrap_unary_async if is_async else _wrap_unary
+    wrap_streaming = _wrap_streaming_async if is_async else _wrap_streaming
+    for method in UNARY_METHODS:
+        if hasattr(api, method):
+            setattr(api, method, wrap_unary(method, getattr(api, method)))
+    for method in STREAMING_METHODS:
+        if hasattr(api, method):
+            setattr(api, method, wrap_streaming(method, getattr(api, method)))
+    api._instrumented = True
+    return api
@@ -0,0 +1,203 @@
+import bisect
+import os
+import threading
+import time
+from contextlib import contextmanager
+from flask import Response, g, request
+
+# Buckets de latencia en segundos (los mismos que usa el cliente oficial de Prometheus)
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+class _Metric:
+    """Base de las métricas: un solo juego de valores por proceso protegido por un lock.
+
+    El lock solo cubre una suma en un dict, así que su costo es despreciable frente a
+    una solicitud. Los valores son por proceso: con varios workers cada uno expone los suyos.
+    """
+
+    kind = None
+
+    def __init__(self, name, description, labels=()):
+        self.name = name
+        self.description = description
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+        REGISTRY.register(self)
+
+    def _key(self, labels):
+        return tuple(str(labels.get(label, '')) for label in self.labels)
+
+    def _snapshot(self):
+        with self._lock:
+            return {key: list(value) if isinstance(value, list) else value
+                    for key, value in self._values.items()}
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def collect(self):
+        return [(self.name, key, value) for key, value in sorted(self._snapshot().items())]
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, description, labels=(), buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        super().__init__(name, description, labels)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        # El bucket se busca fuera del lock
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._values.get(key)
+            if series is None:
+                # [conteo por bucket..., +Inf, suma]
+                series = self._values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[index] += 1
+            series[-1] += value
+
+    def collect(self):
+        samples = []
+        for key, series in sorted(self._snapshot().items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), series[:-1]):
+                cumulative += count
+                samples.append((f"{self.name}_bucket", key + (('le', _format_value(bound)),), cumulative))
+            samples.append((f"{self.name}_sum", key, series[-1]))
+            samples.append((f"{self.name}_count", key, cumulative))
+        return samples
+
+class CallbackMetric(_Metric):
+    """Valores que se leen de otro objeto al exportar (p. ej. contadores de un cache)"""
+
+    def __init__(self, name, description, labels=(), callback=None, kind='gauge'):
+        self._callback = callback
+        self.kind = kind
+        super().__init__(name, description, labels)
+
+    def collect(self):
+        return [(self.name, self._key(labels), value) for labels, value in self._callback()]
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+
+    def render(self):
+        """Todas las métricas en el formato de texto de Prometheus 0.0.4"""
+        lines = []
+        with self._lock:
+            metrics = list(self._metrics)
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.description}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, key, value in metric.collect():
+                lines.append(f"{name}{_format_labels(metric.labels, key)} {_format_value(value)}")
+        return '\n'.join(lines) + '\n'
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _format_labels(names, key):
+    pairs = []
+    for index, value in enumerate(key):
+        # Los buckets agregan ('le', valor) al final de la clave
+        if isinstance(value, tuple):
+            pairs.append(f'{value[0]}="{_escape(value[1])}"')
+        else:
+            pairs.append(f'{names[index]}="{_escape(value)}"')
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+def _format_value(value):
+    if isinstance(value, str):
+        return value
+    if isinstance(value, float) and value.is_integer():
+        return repr(value)
+    return str(value)
+
+REGISTRY = Registry()
+
+http_requests = Counter(
+    'http_requests_total', 'Solicitudes HTTP atendidas', ('endpoint', 'method', 'status'))
+http_latency = Histogram(
+    'http_request_duration_seconds', 'Latencia de las solicitudes HTTP', ('endpoint', 'method'))
+firestore_operations = Counter(
+    'firestore_operations_total', 'Llamadas RPC a Firestore', ('method', 'outcome'))
+firestore_latency = Histogram(
+    'firestore_operation_duration_seconds', 'Latencia de las llamadas RPC a Firestore', ('method',))
+firestore_documents = Histogram(
+    'firestore_query_documents', 'Documentos devueltos por consulta', ('method',),
+    buckets=(1, 10, 50, 100, 500, 1000, 2500, 5000, 10000))
+firestore_size_warnings = Counter(
+    'firestore_query_size_warnings_total', 'Consultas que se acercaron al máximo de documentos', ('endpoint',))
+firestore_size_rejections = Counter(
+    'firestore_query_size_rejections_total', 'Consultas cortadas por superar el máximo de documentos', ('endpoint',))
+external_latency = Histogram(
+    'external_call_duration_seconds', 'Latencia de servicios externos', ('service', 'outcome'))
+
+_caches = {}
+
+def register_cache(name, cache):
+    """Expone hits/misses de un TTLCache como cache_hits_total y cache_misses_total"""
+    _caches[name] = cache
+
+CallbackMetric('cache_hits_total', 'Aciertos acumulados por cache', ('cache',), kind='counter',
+               callback=lambda: [({'cache': name}, cache.hits) for name, cache in sorted(_caches.items())])
+CallbackMetric('cache_misses_total', 'Fallos acumulados por cache', ('cache',), kind='counter',
+               callback=lambda: [({'cache': name}, cache.misses) for name, cache in sorted(_caches.items())])
+CallbackMetric('cache_hit_ratio', 'Proporción de aciertos por cache', ('cache',),
+               callback=lambda: [({'cache': name}, round(cache.hit_ratio(), 4)) for name, cache in sorted(_caches.items())])
+
+@contextmanager
+def time_external(service):
+    """Mide una llamada a un servicio externo (SMTP, Identity Toolkit...)"""
+    start = time.perf_counter()
+    outcome = 'ok'
+    try:
+        yield
+    except Exception:
+        outcome = 'error'
+        raise
+    finally:
+        external_latency.observe(time.perf_counter() - start, service=service, outcome=outcome)
+
+def init_metrics(app):
+    """Registra los hooks de latencia por endpoint y la ruta /metrics.
+
+    Si METRICS_TOKEN está definido, /metrics exige 'Authorization: Bearer <token>'
+    (para el scraper de Prometheus); si no, solo la pueden leer administradores.
+    """
+    from utils.decorators import admin_required
+    token = os.getenv('METRICS_TOKEN')
+
+    @app.before_request
+    def start_request_timer():
+        g.request_started = time.perf_counter()
+
+    @app.after_request
+    def record_request_metrics(response):
+        started = g.pop('request_started', None)
+        if started is not None:
+            endpoint = request.endpoint or 'unmatched'
+            http_latency.observe(time.perf_counter() - started, endpoint=endpoint, method=request.method)
+            http_requests.inc(endpoint=endpoint, method=request.method, status=response.status_code)
+        return response
+
+    def metrics_view():
+        if token and request.headers.get('Authorization') != f'Bearer {token}':
+            return Response('No autorizado\n', status=401, mimetype='text/plain')
+        return Response(REGISTRY.render(), mimetype='text/plain; version=0.0.4')
+
+    app.add_url_rule('/metrics', 'metrics', metrics_view if token else admin_required(metrics_view), methods=['GET'])
+    return record_request_metrics
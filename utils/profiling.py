@@ -0,0 +1,102 @@
+import cProfile
+import io
+import os
+import pstats
+import re
+import threading
+import time
+import uuid
+from flask import g, request
+from firebase_admin import auth
+from utils.firebase import get_db
+
+PROFILE_HEADER = 'X-Profile'
+PROFILE_ID_HEADER = 'X-Profile-Id'
+# Funciones del resumen de texto que acompaña al .pstats
+SUMMARY_LINES = 40
+
+# cProfile admite un solo perfilador activo a la vez (sys.monitoring en Python 3.12+)
+_profiler_lock = threading.Lock()
+
+def get_profiling_dir():
+    """Directorio de perfiles (PROFILING_DIR); si no está definido el perfilado está apagado"""
+    return os.getenv('PROFILING_DIR')
+
+def _is_admin():
+    auth_header = request.headers.get('Authorization', '')
+    if not auth_header.startswith('Bearer '):
+        return False
+    try:
+        decoded_token = auth.verify_id_token(auth_header.split('Bearer ')[1])
+        user = get_db().collection('users').document(decoded_token['uid']).get()
+        return user.exists and user.to_dict().get('role') == 'admin'
+    except Exception:
+        return False
+
+def _write_profile(profiler, directory):
+    endpoint = re.sub(r'[^A-Za-z0-9_.-]', '_', request.endpoint or 'unmatched')
+    profile_id = f"{time.strftime('%Y%m%d-%H%M%S')}-{endpoint}-{uuid.uuid4().hex[:8]}"
+    os.makedirs(directory, exist_ok=True)
+    profiler.dump_stats(os.path.join(directory, f"{profile_id}.pstats"))
+
+    # Resumen legible junto al binario: las funciones con más tiempo acumulado
+    summary = io.StringIO()
+    stats = pstats.Stats(profiler, stream=summary)
+    stats.sort_stats('cumulative').print_stats(SUMMARY_LINES)
+    with open(os.path.join(directory, f"{profile_id}.txt"), 'w', encoding='utf-8') as summary_file:
+        summary_file.write(f"{request.method} {request.full_path}\n")
+        summary_file.write(summary.getvalue())
+    return profile_id
+
+def init_profiling(app):
+    """Perfilado bajo demanda: 'X-Profile: 1' en una solicitud de un admin la ejecuta con cProfile.
+
+    El resultado se guarda en PROFILING_DIR como .pstats (para snakeviz o pstats) y
+    .txt, y su nombre vuelve en el header X-Profile-Id. Si PROFILING_DIR no está
+    definido no se registra ningún hook, así que desactivado no cuesta nada.
+
+    cProfile solo mide el hilo de la solicitud: en las vistas async el trabajo de
+    Firestore corre en el hilo 'firestore-async' (utils.firestore_async) y en el perfil
+    aparece solo como espera. Para esas lecturas sirven /metrics y el log de lentas.
+    """
+    directory = get_profiling_dir()
+    if not directory:
+        return None
+
+    @app.before_request
+    def start_profiler():
+        if request.headers.get(PROFILE_HEADER) != '1' or not _is_admin():
+            return
+        if not _profiler_lock.acquire(blocking=False):
+            g.profile_status = 'busy'
+            return
+        profiler = cProfile.Profile()
+        g.profiler = profiler
+        profiler.enable()
+
+    @app.after_request
+    def stop_profiler(response):
+        profiler = g.pop('profiler', None)
+        if profiler is None:
+            status = g.pop('profile_status', None)
+            if status:
+                response.headers[PROFILE_ID_HEADER] = status
+            return response
+        try:
+            profiler.disable()
+            response.headers[PROFILE_ID_HEADER] = _write_profile(profiler, directory)
+        except Exception as e:
+            print(f"Error al guardar el perfil: {str(e)}")
+        finally:
+            _profiler_lock.release()
+        return response
+
+    @app.teardown_request
+    def release_profiler(exc):
+        # Si after_request no llegó a ejecutarse, no dejar el perfilador tomado
+        profiler = g.pop('profiler', None)
+        if profiler is not None:
+            profiler.disable()
+            _profiler_lock.release()
+
+    return stop_profiler
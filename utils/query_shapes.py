@@ -0,0 +1,157 @@
+import json
+import os
+import threading
+import time
+from collections import deque
+from flask import has_request_context, request
+from google.cloud.firestore_v1.types import StructuredQuery
+
+SLOW_OPERATION_MS = float(os.getenv('FIRESTORE_SLOW_MS', 500))
+MAX_SLOW_OPERATIONS = 200
+MAX_SHAPES = 500
+
+EQUALITY_OPERATORS = {'EQUAL', 'IN', 'IS_NULL', 'IS_NAN'}
+ARRAY_OPERATORS = {'ARRAY_CONTAINS', 'ARRAY_CONTAINS_ANY'}
+OPERATOR_SYMBOLS = {
+    'EQUAL': '==', 'NOT_EQUAL': '!=', 'LESS_THAN': '<', 'LESS_THAN_OR_EQUAL': '<=',
+    'GREATER_THAN': '>', 'GREATER_THAN_OR_EQUAL': '>=', 'IN': 'in', 'NOT_IN': 'not-in',
+    'ARRAY_CONTAINS': 'array-contains', 'ARRAY_CONTAINS_ANY': 'array-contains-any',
+    'IS_NULL': '== null', 'IS_NAN': '== NaN', 'IS_NOT_NULL': '!= null', 'IS_NOT_NAN': '!= NaN'
+}
+
+def _field_filters(filter_pb, filters):
+    kind = filter_pb.WhichOneof('filter_type')
+    if kind == 'composite_filter':
+        for child in filter_pb.composite_filter.filters:
+            _field_filters(child, filters)
+    elif kind == 'field_filter':
+        op = StructuredQuery.FieldFilter.Operator(filter_pb.field_filter.op).name
+        filters.append((filter_pb.field_filter.field.field_path, op))
+    elif kind == 'unary_filter':
+        op = StructuredQuery.UnaryFilter.Operator(filter_pb.unary_filter.op).name
+        filters.append((filter_pb.unary_filter.field.field_path, op))
+
+def query_shape(rpc_request):
+    """Forma de una consulta (colección, filtros, orden, limit) a partir del request del RPC.
+
+    Solo se guardan campos y operadores, nunca los valores filtrados. Devuelve None
+    si el request no es una consulta estructurada.
+    """
+    if isinstance(rpc_request, dict):
+        structured = rpc_request.get('structured_query')
+        aggregation = rpc_request.get('structured_aggregation_query')
+    else:
+        structured = getattr(rpc_request, 'structured_query', None)
+        aggregation = getattr(rpc_request, 'structured_aggregation_query', None)
+    if structured is None and aggregation is not None:
+        structured = aggregation.structured_query
+    if structured is None:
+        return None
+
+    query_pb = type(structured).pb(structured) if hasattr(type(structured), 'pb') else structured
+    filters = []
+    if query_pb.HasField('where'):
+        _field_filters(query_pb.where, filters)
+    return {
+        "collection": query_pb.from_[0].collection_id if query_pb.from_ else '',
+        "allDescendants": bool(query_pb.from_ and query_pb.from_[0].all_descendants),
+        "filters": filters,
+        "orderBy": [
+            (order.field.field_path, StructuredQuery.Direction(order.direction).name)
+            for order in query_pb.order_by
+        ],
+        "limit": query_pb.limit.value if query_pb.HasField('limit') else None,
+        "aggregation": aggregation is not None
+    }
+
+def describe_shape(shape):
+    """'participations WHERE challengeId == AND score > ORDER BY score DESC LIMIT'"""
+    text = shape['collection']
+    if shape['allDescendants']:
+        text = f"collectionGroup({text})"
+    if shape['filters']:
+        text += ' WHERE ' + ' AND '.join(f"{field} {OPERATOR_SYMBOLS.get(op, op)}" for field, op in shape['filters'])
+    if shape['orderBy']:
+        text += ' ORDER BY ' + ', '.join(f"{field} {'DESC' if direction == 'DESCENDING' else 'ASC'}"
+                                          for field, direction in shape['orderBy'])
+    if shape['limit'] is not None:
+        text += ' LIMIT'
+    if shape['aggregation']:
+        text = f"AGGREGATE {text}"
+    return text
+
+def current_endpoint():
+    # Los hilos de fondo (scheduler, índices, refrescos de caché) no tienen contexto de
+    # solicitud; el pool de utils.concurrency sí hereda el de la ruta que lo usa
+    return request.endpoint if has_request_context() else 'background'
+
+class ShapeRegistry:
+    """Formas de consulta observadas en este proceso con su latencia, y log de operaciones lentas"""
+
+    def __init__(self):
+        self._shapes = {}
+        self._slow = deque(maxlen=MAX_SLOW_OPERATIONS)
+        self._lock = threading.Lock()
+
+    def record(self, method, seconds, shape=None, endpoint=None, error=None):
+        milliseconds = seconds * 1000
+        description = describe_shape(shape) if shape else None
+        if shape is not None:
+            with self._lock:
+                entry = self._shapes.get(description)
+                if entry is None:
+                    if len(self._shapes) >= MAX_SHAPES:
+                        entry = None
+                    else:
+                        entry = self._shapes[description] = {
+                            "shape": shape,
+                            "count": 0,
+                            "totalMs": 0.0,
+                            "maxMs": 0.0,
+                            "endpoints": set(),
+                            "missingIndex": False
+                        }
+                if entry is not None:
+                    entry['count'] += 1
+                    entry['totalMs'] += milliseconds
+                    entry['maxMs'] = max(entry['maxMs'], milliseconds)
+                    entry['endpoints'].add(endpoint)
+                    # Firestore responde FAILED_PRECONDITION "The query requires an index"
+                    if error is not None and 'requires an index' in str(error):
+                        entry['missingIndex'] = True
+
+        if milliseconds >= SLOW_OPERATION_MS:
+            operation = {
+                "at": time.strftime('%Y-%m-%dT%H:%M:%S'),
+                "method": method,
+                "ms": round(milliseconds, 1),
+                "endpoint": endpoint,
+                "query": description,
+                "error": str(error) if error is not None else None
+            }
+            with self._lock:
+                self._slow.append(operation)
+            print(f"Operación lenta de Firestore: {json.dumps(operation, ensure_ascii=False)}")
+
+    def shapes(self):
+        with self._lock:
+            entries = [(description, dict(entry, endpoints=sorted(e for e in entry['endpoints'] if e)))
+                       for description, entry in self._shapes.items()]
+        return [
+            {
+                "query": description,
+                "count": entry['count'],
+                "avgMs": round(entry['totalMs'] / entry['count'], 1),
+                "maxMs": round(entry['maxMs'], 1),
+                "endpoints": entry['endpoints'],
+                "missingIndex": entry['missingIndex'],
+                "shape": entry['shape']
+            }
+            for description, entry in sorted(entries, key=lambda item: -item[1]['totalMs'])
+        ]
+
+    def slow_operations(self):
+        with self._lock:
+            return list(reversed(self._slow))
+
+shape_registry = ShapeRegistry()
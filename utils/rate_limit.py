@@ -0,0 +1,192 @@
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+from flask import request, jsonify
+
+# redis es opcional: solo se usa si está instalado y RATE_LIMIT_REDIS_URL está definido
+try:
+    import redis
+except ImportError:
+    redis = None
+
+PERIODS = {
+    'second': 1,
+    'minute': 60,
+    'hour': 3600,
+    'day': 86400
+}
+
+def parse_limit(limit):
+    """'10/minute' -> (capacidad, tokens por segundo)"""
+    amount, _, period = limit.partition('/')
+    capacity = int(amount)
+    seconds = PERIODS[period.strip().lower()]
+    return capacity, capacity / seconds
+
+class MemoryBucketStore:
+    """Token buckets en proceso: key -> (tokens, último relleno) en un dict acotado.
+
+    Cuando se supera max_keys se descartan los buckets usados hace más tiempo;
+    un bucket descartado equivale a uno lleno, así que nunca bloquea de más.
+    """
+
+    def __init__(self, max_keys=50000):
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def consume(self, key, rate, capacity, cost=1):
+        return self.consume_all([(key, rate, capacity)], cost)
+
+    def consume_all(self, buckets, cost=1):
+        """Descuenta cost de cada bucket (key, rate, capacity) solo si todos tienen tokens"""
+        now = time.monotonic()
+        with self._lock:
+            refilled = []
+            retry_after = 0
+            for key, rate, capacity in buckets:
+                tokens, last = self._buckets.pop(key, (capacity, now))
+                tokens = min(capacity, tokens + (now - last) * rate)
+                if tokens < cost:
+                    retry_after = max(retry_after, (cost - tokens) / rate)
+                refilled.append((key, tokens))
+            allowed = retry_after == 0
+            for key, tokens in refilled:
+                self._buckets[key] = (tokens - cost if allowed else tokens, now)
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        return allowed, retry_after
+
+class RedisBucketStore:
+    """Token buckets compartidos entre workers/instancias, atómicos vía script Lua"""
+
+    # KEYS: buckets; ARGV: now, cost y luego (rate, capacity) por bucket
+    SCRIPT = """
+    local now = tonumber(ARGV[1])
+    local cost = tonumber(ARGV[2])
+    local tokens = {}
+    local retry = 0
+    for i, key in ipairs(KEYS) do
+        local rate = tonumber(ARGV[1 + 2 * i])
+        local capacity = tonumber(ARGV[2 + 2 * i])
+        local data = redis.call('HMGET', key, 'tokens', 'ts')
+        local current = tonumber(data[1]) or capacity
+        local ts = tonumber(data[2]) or now
+        current = math.min(capacity, current + math.max(now - ts, 0) * rate)
+        if current < cost then
+            retry = math.max(retry, (cost - current) / rate)
+        end
+        tokens[i] = current
+    end
+    for i, key in ipairs(KEYS) do
+        local rate = tonumber(ARGV[1 + 2 * i])
+        local capacity = tonumber(ARGV[2 + 2 * i])
+        local current = tokens[i]
+        if retry == 0 then
+            current = current - cost
+        end
+        redis.call('HSET', key, 'tokens', current, 'ts', now)
+        redis.call('EXPIRE', key, math.ceil(capacity / rate) + 1)
+    end
+    return tostring(retry)
+    """
+
+    def __init__(self, url):
+        self._client = redis.Redis.from_url(url)
+        self._script = self._client.register_script(self.SCRIPT)
+
+    def consume(self, key, rate, capacity, cost=1):
+        return self.consume_all([(key, rate, capacity)], cost)
+
+    def consume_all(self, buckets, cost=1):
+        """Igual que MemoryBucketStore.consume_all, atómico en Redis"""
+        keys = [f"ratelimit:{key}" for key, _, _ in buckets]
+        args = [time.time(), cost]
+        for _, rate, capacity in buckets:
+            args += [rate, capacity]
+        retry_after = float(self._script(keys=keys, args=args))
+        return retry_after == 0, retry_after
+
+_backend = None
+_backend_lock = threading.Lock()
+
+def get_backend():
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                redis_url = os.getenv('RATE_LIMIT_REDIS_URL')
+                if redis_url and redis is not None:
+                    _backend = RedisBucketStore(redis_url)
+                else:
+                    _backend = MemoryBucketStore()
+    return _backend
+
+def set_backend(backend):
+    """Reemplaza el almacenamiento (p. ej. un MemoryBucketStore local en lugar de Redis)"""
+    global _backend
+    _backend = backend
+
+def client_ip():
+    # X-Forwarded-For lo controla el cliente: remote_addr solo lo toma de los proxies
+    # de confianza (ProxyFix con TRUSTED_PROXY_HOPS en main.py)
+    return request.remote_addr or 'unknown'
+
+def _identity(key):
+    if key == 'uid':
+        user = getattr(request, 'user', None) or {}
+        if user.get('uid'):
+            return f"uid:{user['uid']}"
+    return f"ip:{client_ip()}"
+
+def rate_limit(limit, key='ip', scope=None):
+    """Limita la vista con un token bucket por IP (key='ip') o por usuario (key='uid').
+
+    Con key='uid' debe ir debajo de firebase_token_required para conocer request.user.
+    Se pueden apilar varios límites (p. ej. por minuto y por hora): se verifican juntos
+    y solo se descuenta un token si todos lo permiten. Si el backend falla la solicitud
+    se deja pasar: el limitador nunca tumba la ruta.
+    """
+    capacity, rate = parse_limit(limit)
+
+    def decorator(f):
+        bucket = (f"{scope or f.__name__}:{limit}", key, rate, capacity)
+
+        # Ya limitada más abajo (wraps copia el atributo): se suma a esa verificación
+        limits = getattr(f, 'rate_limits', None)
+        if limits is not None:
+            limits.append(bucket)
+            return f
+        limits = [bucket]
+
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            if os.getenv('RATE_LIMIT_ENABLED', 'true').lower() == 'false':
+                return f(*args, **kwargs)
+
+            buckets = [(f"{name}:{_identity(bucket_key)}", bucket_rate, bucket_capacity)
+                       for name, bucket_key, bucket_rate, bucket_capacity in limits]
+            try:
+                allowed, retry_after = get_backend().consume_all(buckets)
+            except Exception as e:
+                print(f"Error en rate limit ({f.__name__}): {str(e)}")
+                allowed, retry_after = True, 0
+
+            if not allowed:
+                response = jsonify({
+                    "success": False,
+                    "message": "Demasiadas solicitudes, intenta de nuevo más tarde",
+                    "code": "rate_limited"
+                })
+                response.status_code = 429
+                response.headers['Retry-After'] = str(max(math.ceil(retry_after), 1))
+                return response
+
+            return f(*args, **kwargs)
+
+        decorated_function.rate_limits = limits
+        return decorated_function
+    return decorator
@@ -0,0 +1,49 @@
+import json
+import queue
+from flask import Response, stream_with_context
+
+# Comentario SSE enviado periódicamente para mantener viva la conexión en proxies
+HEARTBEAT_SECONDS = 15
+# Tras este tiempo se pide al cliente que reconecte (libera el worker)
+MAX_STREAM_SECONDS = 300
+RETRY_MILLISECONDS = 3000
+SUBSCRIBER_QUEUE_SIZE = 100
+# Mensaje de control: el cliente no consume a tiempo y debe reconectar
+RECONNECT = object()
+
+class Subscription:
+    """Cola acotada de un cliente SSE; key identifica a qué se suscribió"""
+
+    def __init__(self, key):
+        self.key = key
+        self.queue = queue.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+
+    def publish(self, item):
+        try:
+            self.queue.put_nowait(item)
+        except queue.Full:
+            with self.queue.mutex:
+                self.queue.queue.clear()
+            self.queue.put_nowait(RECONNECT)
+
+    def get(self, timeout):
+        return self.queue.get(timeout=timeout)
+
+def format_sse(data, event=None, event_id=None):
+    lines = []
+    if event_id:
+        lines.append(f"id: {event_id}")
+    if event:
+        lines.append(f"event: {event}")
+    lines.append(f"data: {json.dumps(data, default=str)}")
+    return "\n".join(lines) + "\n\n"
+
+def heartbeat():
+    return ": heartbeat\n\n"
+
+def sse_response(generator):
+    response = Response(stream_with_context(generator), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    # Evita que nginx/Vercel acumulen el stream en buffer
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
@@ -0,0 +1,15 @@
+import re
+import unicodedata
+
+_WHITESPACE = re.compile(r"\s+")
+
+def strip_accents(text):
+    """'Sebastián Núñez' -> 'Sebastian Nunez' (descompone y quita las marcas diacríticas)"""
+    decomposed = unicodedata.normalize('NFKD', text)
+    return ''.join(char for char in decomposed if not unicodedata.combining(char))
+
+def normalize(text):
+    """Forma canónica para búsquedas: sin acentos, en minúsculas y con espacios simples"""
+    if not text:
+        return ''
+    return _WHITESPACE.sub(' ', strip_accents(str(text)).casefold()).strip()